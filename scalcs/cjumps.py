@@ -205,10 +205,20 @@ def pulse_square_paired(t, ):
 
     return conc + cb
 
-def solve_jump(mec, reclen, step, cfunc, cargs, abserr=1.0e-8, relerr=1.0e-6):
+def solve_jump(mec, reclen, step, cfunc, cargs, abserr=1.0e-8, relerr=1.0e-6,
+    method='BDF'):
     """
     Calculate response to a concentration pulse by integration.
 
+    By default dP/dt = P * (Q0 + c(t) * Q1) (see Mechanism.Q_linear()) is
+    integrated with a stiff implicit method of scipy.integrate.solve_ivp()
+    given the analytical Jacobian (Q0 + c(t) * Q1)'; occupancies at sample
+    times are interpolated from its dense output. Integration is
+    restarted wherever concentration starts changing after being constant
+    for more than one sample, so that pulses are not stepped over. If rates
+    are not linear in concentration, odeint with Q rebuilt by mec.set_eff()
+    (dPdt()) is used instead.
+
     Parameters
     ----------
     mec : dcpyps.Mechanism
@@ -222,7 +232,10 @@ def solve_jump(mec, reclen, step, cfunc, cargs, abserr=1.0e-8, relerr=1.0e-6):
     cargs : tuple
         Arguments for cfunc(t, cargs).
     rtol, atol : float, optional
-        Tolerance limits for the error control performed by the scipy.odeint solver.
+        Tolerance limits for the error control performed by the solver.
+    method : str
+        'BDF', 'Radau' or 'LSODA' (solve_ivp() methods) or 'odeint' for
+        scipy.integrate.odeint with Q rebuilt by mec.set_eff() (dPdt()).
 
     Returns
     -------
@@ -239,17 +252,47 @@ def solve_jump(mec, reclen, step, cfunc, cargs, abserr=1.0e-8, relerr=1.0e-6):
     t = np.arange(0, reclen, step)
     mec.set_eff('c', cargs[1])
     P0 = qml.pinf(mec.Q)
-    Pt = scpi.odeint(dPdt, P0, t, args=(mec, cfunc, cargs),
-        atol=abserr,rtol=relerr)
+    c =  cfunc(t, cargs)
+    if method != 'odeint':
+        try:
+            Q0, Q1 = mec.Q_linear('c')
+        except RuntimeError:
+            method = 'odeint'
+    if method == 'odeint':
+        Pt = scpi.odeint(dPdt, P0, t, args=(mec, cfunc, cargs),
+            atol=abserr,rtol=relerr)
+    else:
+        def fun(tt, P):
+            return np.dot(P, Q0 + cfunc(tt, cargs) * Q1)
+        def jac(tt, P):
+            return (Q0 + cfunc(tt, cargs) * Q1).transpose()
+
+        change = c[1:] != c[:-1]
+        restart = np.flatnonzero(change[1:] & ~change[:-1]) + 1
+        bounds = np.unique(np.concatenate(([0], restart, [t.shape[0] - 1])))
+        Pt = np.empty((t.shape[0], mec.k))
+        Pt[0] = P0
+        for i0, i1 in zip(bounds[:-1], bounds[1:]):
+            sol = scpi.solve_ivp(fun, (t[i0], t[i1]), Pt[i0], method=method,
+                t_eval=t[i0 : i1 + 1], jac=jac, atol=abserr, rtol=relerr,
+                first_step=step)
+            if not sol.success:
+                raise RuntimeError('solve_jump: ' + sol.message)
+            Pt[i0 : i1 + 1] = sol.y.transpose()
     P = Pt.transpose()
     Popen = np.sum(P[: mec.kA], axis=0)
-    c =  cfunc(t, cargs)
     return t, c, Popen, P
 
-def calc_jump (mec, reclen, step, cfunc, cargs):
+def calc_jump(mec, reclen, step, cfunc, cargs, cstep=None):
     """
     Calculate response to a concentration pulse directly from Q matrix.
 
+    Concentration is held constant between samples at its value at the end
+    of each step. The profile is split into runs of constant concentration;
+    Q is decomposed once for each distinct concentration and occupancies
+    at all sample times of a run are found at once from its spectral
+    expansion.
+
     Parameters
     ----------
     mec : dcpyps.Mechanism
@@ -262,6 +305,9 @@ def calc_jump (mec, reclen, step, cfunc, cargs):
         Concentration profile.
     cargs : tuple
         Arguments for cfunc(t, cargs).
+    cstep : float, optional
+        If given, concentration is rounded to multiples of cstep, so that
+        smooth profiles (e.g. pulse_erf()) need fewer decompositions.
 
     Returns
     -------
@@ -277,16 +323,30 @@ def calc_jump (mec, reclen, step, cfunc, cargs):
 
     t = np.arange(0, reclen, step)
     c =  cfunc(t, cargs)
+    cq = c if cstep is None else np.round(c / cstep) * cstep
     mec.set_eff('c', cargs[1])
     pi = qml.pinf(mec.Q)
-    Pt = np.array([pi.copy()])
-
-    for i in range(1, t.shape[0]):
-        mec.set_eff('c', c[i])
-        eigenvals, A = qml.eigs_sorted(mec.Q)
-        w = coefficient_calc(mec.k, A, pi)
-        pi = P_t(step, eigenvals, w)
-        Pt = np.append(Pt, [pi.copy()], axis=0)
+    Pt = np.empty((t.shape[0], mec.k))
+    Pt[0] = pi
+
+    # Runs of samples 1, 2, ... at constant concentration.
+    levels, index = np.unique(cq[1:], return_inverse=True)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1,
+        [index.shape[0]]))
+    spectra = {}
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        level = index[start]
+        if level not in spectra:
+            mec.set_eff('c', levels[level])
+            spectra[level] = qml.eigs(mec.Q)
+        eigenvals, A = spectra[level]
+        w = np.dot(pi, A) # w[n] = pi * A[n]
+        n = np.arange(1, end - start + 1)
+        Pt[start + 1 : end + 1] = np.dot(np.exp(np.outer(n * step,
+            eigenvals)), w).real
+        pi = Pt[end]
+    if t.shape[0] > 1:
+        mec.set_eff('c', c[-1])
 
     P = Pt.transpose()
     Popen = np.sum(P[: mec.kA], axis=0)
@@ -0,0 +1,176 @@
+"""Functions for preparing idealised single channel records for
+likelihood calculations: imposing time resolution, joining intervals into
+open and shut periods and dividing the record into bursts.
+
+All functions work on whole arrays of intervals (e.g. views returned by
+scalcsio.SCNRecord) and return bursts packed as by scalcslib.pack_bursts(),
+which can be given directly to scalcslib.HJCLikelihood(), HJClik_batched()
+or likelihood(). Times (intervals, tres, tcrit) may be in any units as
+long as they are the same.
+"""
+
+import numpy as np
+
+BAD = 8 # Property flag of unusable intervals.
+
+def impose_resolution(intervals, amplitudes, props, tres):
+    """
+    Impose time resolution on a record and join the result into open and
+    shut periods.
+
+    Intervals shorter than tres are unresolved and their length is added to
+    the preceding resolved interval. The record starts at the first
+    resolvable and usable interval. Contiguous intervals of the same kind
+    (open or shut) are joined into one period; the amplitude of an open
+    period is the time weighted mean amplitude of its openings. A period is
+    unusable if any of its intervals is flagged unusable (props & 8) or is
+    negative. The last period is unusable if it is a shutting.
+
+    Parameters
+    ----------
+    intervals : array_like, shape (n,)
+        Interval lengths.
+    amplitudes : array_like, shape (n,)
+        Interval amplitudes (0 for shuttings).
+    props : array_like of ints, shape (n,)
+        Interval property flags.
+    tres : float
+        Time resolution.
+
+    Returns
+    -------
+    pint : ndarray, shape (nper,)
+        Period lengths.
+    pampl : ndarray, shape (nper,)
+        Period amplitudes (0 for shut periods).
+    pbad : ndarray of bools, shape (nper,)
+        True for unusable periods.
+    """
+
+    tint = np.asarray(intervals, dtype=np.float64)
+    ampl = np.asarray(amplitudes)
+    bad = ((np.asarray(props) & BAD) != 0) | (tint < 0)
+    resolved = tint >= tres
+    usable = np.flatnonzero(resolved & ~bad)
+    if usable.shape[0] == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=bool)
+    first = usable[0]
+    tint, ampl, bad = tint[first:], ampl[first:], bad[first:]
+    isopen = ampl != 0
+
+    # Each resolved interval starts a group which takes in following
+    # unresolved intervals; a group starts a new period if its kind differs
+    # from the kind of the previous group.
+    groups = np.flatnonzero(resolved[first:])
+    gopen = isopen[groups]
+    newperiod = np.ones(gopen.shape[0], dtype=bool)
+    newperiod[1:] = gopen[1:] != gopen[:-1]
+    starts = groups[newperiod]
+    popen = gopen[newperiod]
+    bounds = np.append(starts, tint.shape[0])
+
+    # Period sums as differences of cumulative sums. Rounding errors are
+    # far below the precision of intervals stored in SCN files (float32).
+    def period_sums(x):
+        cs = np.empty(x.shape[0] + 1)
+        cs[0] = 0.0
+        np.cumsum(x, out=cs[1:])
+        return np.diff(cs[bounds])
+
+    pint = period_sums(tint)
+    pbad = np.zeros(starts.shape[0], dtype=bool)
+    pbad[np.searchsorted(starts, np.flatnonzero(bad), side='right') - 1] = \
+        True
+
+    # Amplitudes need averaging only in open periods of several intervals.
+    pampl = np.where(popen, ampl[starts], 0).astype(np.float64)
+    plen = np.diff(bounds)
+    multi = np.flatnonzero(popen & (plen > 1))
+    if multi.shape[0]:
+        mlen = plen[multi]
+        moff = np.zeros(multi.shape[0], dtype=np.intp)
+        np.cumsum(mlen[:-1], out=moff[1:])
+        ind = (np.arange(mlen.sum()) +
+            np.repeat(starts[multi] - moff, mlen))
+        topen = np.where(isopen[ind], tint[ind], 0.0)
+        pampl[multi] = (np.add.reduceat(topen * ampl[ind], moff) /
+            np.add.reduceat(topen, moff))
+    if not popen[-1]:
+        pbad[-1] = True
+    return pint, pampl, pbad
+
+def burst_segments(pint, pampl, pbad, tcrit):
+    """
+    Divide a record of open and shut periods into bursts. A burst ends at a
+    shut period longer than tcrit or at an unusable shut period; these
+    shuttings are not part of any burst. Bursts which contain an unusable
+    opening are discarded. Each burst starts and ends with an opening.
+
+    Parameters
+    ----------
+    pint, pampl, pbad : array_like, shape (nper,)
+        Open and shut periods as returned by impose_resolution().
+    tcrit : float
+        Critical shut time.
+
+    Returns
+    -------
+    intervals : ndarray, shape (n,)
+        Intervals of all bursts, burst after burst.
+    offsets : ndarray, shape (nbursts + 1,)
+        Burst i occupies intervals[offsets[i] : offsets[i+1]].
+    """
+
+    pint = np.asarray(pint, dtype=np.float64)
+    pbad = np.asarray(pbad, dtype=bool)
+    isopen = np.asarray(pampl) != 0
+    if pint.shape[0] == 0:
+        return np.zeros(0), np.zeros(1, dtype=np.intp)
+
+    # Shuttings which end bursts; a leading shutting cannot start one.
+    gap = ~isopen & ((pint >= tcrit) | pbad)
+    gap[0] |= ~isopen[0]
+    gaps = np.flatnonzero(gap)
+    segstart = np.append(0, gaps + 1)
+    segend = np.append(gaps, pint.shape[0])
+    good = segend > segstart
+    badopen = np.flatnonzero(isopen & pbad)
+    good[np.searchsorted(gaps, badopen)] = False
+
+    keep = ~gap
+    if not good.all():
+        keep &= good[np.cumsum(gap)]
+    intervals = pint[keep]
+    offsets = np.zeros(np.count_nonzero(good) + 1, dtype=np.intp)
+    np.cumsum(segend[good] - segstart[good], out=offsets[1:])
+    return intervals, offsets
+
+def prepare_bursts(intervals, amplitudes, props, tres, tcrit):
+    """
+    Impose time resolution on a record and divide it into bursts (see
+    impose_resolution() and burst_segments()). Records from different files
+    should be prepared one by one.
+
+    Parameters
+    ----------
+    intervals : array_like, shape (n,)
+        Interval lengths.
+    amplitudes : array_like, shape (n,)
+        Interval amplitudes (0 for shuttings).
+    props : array_like of ints, shape (n,)
+        Interval property flags.
+    tres : float
+        Time resolution.
+    tcrit : float
+        Critical shut time.
+
+    Returns
+    -------
+    intervals : ndarray, shape (m,)
+        Intervals of all bursts, burst after burst.
+    offsets : ndarray, shape (nbursts + 1,)
+        Burst i occupies intervals[offsets[i] : offsets[i+1]].
+    """
+
+    return burst_segments(*impose_resolution(intervals, amplitudes, props,
+        tres), tcrit=tcrit)
@@ -0,0 +1,233 @@
+"""Fitting of mechanism rate constants to single channel records by
+maximising likelihood (HJC missed events likelihood or ideal likelihood).
+
+Example:
+
+    lik = scl.HJCLikelihood(mec, tres, tcrit, conc, bursts)
+    res = fit.fit(mec, lik, method='lbfgs', checkpoint='fit.npz')
+    # next time start from where the last fit finished
+    res = fit.fit(mec, lik, warmstart='fit.npz')
+"""
+
+import os
+import time
+import warnings
+
+import numpy as np
+import scipy.optimize as so
+
+METHODS = {'simplex': 'Nelder-Mead', 'lbfgs': 'L-BFGS-B',
+    'trust': 'trust-constr'}
+
+class FitObjective(object):
+    """
+    Minus log-likelihood as seen by an optimiser. Counts evaluations,
+    remembers the best parameters met so far and periodically saves them
+    to a checkpoint file.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be fitted.
+    lik : callable
+        Either lik(theta, opts) as scalcslib.HJClik() or scalcslib.likelihood()
+        or lik(theta) as scalcslib.HJCLikelihood; both return minus
+        log-likelihood and updated rates. If lik has a loglik_fd_gradient()
+        method it is used to calculate gradients.
+    opts : dictionary, optional
+        Options passed to lik.
+    checkpoint : str, optional
+        File name to save best parameters to.
+    interval : float
+        Minimum time in seconds between checkpoint writes.
+    """
+
+    def __init__(self, mec, lik, opts=None, checkpoint=None, interval=5.0):
+
+        self.mec = mec
+        self.lik = lik
+        self.opts = opts
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.nevals = 0
+        self.ngrads = 0
+        self.best = np.inf
+        self.best_theta = None
+        self.has_gradient = opts is None and hasattr(lik, 'loglik_fd_gradient')
+        self.tsaved = time.time()
+        self.tstart = time.time()
+
+    def record(self, theta, value):
+        if value < self.best:
+            self.best = value
+            self.best_theta = np.array(theta, dtype=np.float64)
+            if (self.checkpoint is not None and
+                time.time() - self.tsaved > self.interval):
+                self.save()
+
+    def save(self):
+        """
+        Save the best parameters so far to the checkpoint file.
+        """
+
+        if self.checkpoint is None or self.best_theta is None:
+            return
+        save_checkpoint(self.checkpoint, self.mec, self.best_theta,
+            -self.best)
+        self.tsaved = time.time()
+
+    def __call__(self, theta):
+        self.nevals += 1
+        if self.opts is None:
+            value = self.lik(theta)[0]
+        else:
+            value = self.lik(theta, self.opts)[0]
+        self.record(theta, value)
+        return value
+
+    def value_and_gradient(self, theta):
+        self.nevals += 1
+        self.ngrads += 1
+        loglik, grad = self.lik.loglik_fd_gradient(theta)
+        self.record(theta, -loglik)
+        return -loglik, -grad
+
+    def evals_per_second(self):
+        return self.nevals / (time.time() - self.tstart)
+
+def save_checkpoint(filename, mec, theta, loglik):
+    """
+    Save fitted parameters of a mechanism.
+
+    Parameters
+    ----------
+    filename : str
+        Output file (numpy .npz archive).
+    mec : dcpyps.Mechanism
+        The mechanism.
+    theta : array_like
+        Logarithms of free rate constants.
+    loglik : float
+        Log-likelihood at theta.
+    """
+
+    tmp = filename + '.tmp.npz'
+    np.savez(tmp, theta=theta, loglik=loglik,
+        names=np.array(mec.get_free_parameter_names()),
+        title=np.array([str(mec.mtitle), str(mec.rtitle)]))
+    os.replace(tmp, filename)
+
+def load_checkpoint(filename, mec):
+    """
+    Load parameters saved by save_checkpoint() if they were fitted for a
+    mechanism with the same title and free parameters as mec.
+
+    Parameters
+    ----------
+    filename : str
+        Checkpoint file.
+    mec : dcpyps.Mechanism
+        The mechanism.
+
+    Returns
+    -------
+    theta : ndarray or None
+        Logarithms of free rate constants; None if file does not exist or
+        does not match the mechanism (a RuntimeWarning is issued).
+    loglik : float or None
+        Log-likelihood at theta.
+    """
+
+    if not os.path.exists(filename):
+        return None, None
+    with np.load(filename) as data:
+        if (list(data['names']) != list(mec.get_free_parameter_names()) or
+            list(data['title']) != [str(mec.mtitle), str(mec.rtitle)]):
+            warnings.warn('checkpoint ' + filename +
+                ' does not match the mechanism; ignored.', RuntimeWarning)
+            return None, None
+        return data['theta'], float(data['loglik'])
+
+def fit(mec, lik, opts=None, theta0=None, method='simplex', maxiter=None,
+    checkpoint=None, warmstart=None, verbose=True):
+    """
+    Fit free rate constants of a mechanism by minimising minus
+    log-likelihood.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be fitted. On return it is set to the best
+        parameters found.
+    lik : callable
+        Likelihood, see FitObjective.
+    opts : dictionary, optional
+        Options for lik(theta, opts), e.g. as for scalcslib.HJClik().
+    theta0 : array_like, optional
+        Initial logarithms of free rate constants; default current ones.
+    method : str
+        'simplex' (Nelder-Mead), 'lbfgs' (L-BFGS-B) or 'trust'
+        (trust-region, scipy 'trust-constr'). Gradient based methods use
+        the finite difference gradient of lik.loglik_fd_gradient() where
+        available and scipy finite differences of lik otherwise.
+    maxiter : int, optional
+        Maximum number of iterations.
+    checkpoint : str, optional
+        File to save best parameters to during and at the end of the fit.
+    warmstart : str, optional
+        Checkpoint of a previous fit of the same mechanism to start from;
+        overrides theta0 if it matches the mechanism.
+    verbose : bool
+        Print summary including evaluations per second.
+
+    Returns
+    -------
+    res : scipy.optimize.OptimizeResult
+        Result of the optimiser with additional fields theta (best
+        logarithms of rate constants found), loglik, nevals, time and
+        evals_per_sec.
+    """
+
+    if method not in METHODS:
+        raise RuntimeError('fit: unknown method ' + str(method) +
+            '; use one of ' + ', '.join(sorted(METHODS)))
+    if theta0 is None:
+        theta0 = np.log(mec.theta())
+    if warmstart is not None:
+        theta, loglik = load_checkpoint(warmstart, mec)
+        if theta is not None:
+            theta0 = theta
+            if verbose:
+                print ('fit: warm start from ' + warmstart +
+                    '; loglik = {0:.6f}'.format(loglik))
+    theta0 = np.asarray(theta0, dtype=np.float64)
+
+    obj = FitObjective(mec, lik, opts, checkpoint)
+    options = {} if maxiter is None else {'maxiter': maxiter}
+    if method == 'simplex':
+        res = so.minimize(obj, theta0, method=METHODS[method],
+            options=options)
+    elif obj.has_gradient:
+        kwargs = {'hess': so.BFGS()} if method == 'trust' else {}
+        res = so.minimize(obj.value_and_gradient, theta0,
+            method=METHODS[method], jac=True, options=options, **kwargs)
+    else:
+        kwargs = {'hess': so.BFGS()} if method == 'trust' else {}
+        res = so.minimize(obj, theta0, method=METHODS[method],
+            jac='2-point', options=options, **kwargs)
+    elapsed = time.time() - obj.tstart
+
+    obj.record(res.x, res.fun)
+    obj.save()
+    mec.theta_unsqueeze(np.exp(obj.best_theta))
+    res.theta = obj.best_theta
+    res.loglik = -obj.best
+    res.nevals = obj.nevals
+    res.time = elapsed
+    res.evals_per_sec = obj.nevals / elapsed if elapsed > 0 else np.inf
+    if verbose:
+        print ('fit: ' + METHODS[method] + ' finished: ' + str(res.message))
+        print ('fit: loglik = {0:.6f}; '.format(res.loglik) +
+            '{0:d} evaluations in {1:.3f} s '.format(res.nevals, res.time) +
+            '({0:.1f} evaluations per second)'.format(res.evals_per_sec))
+    return res
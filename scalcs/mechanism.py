@@ -525,8 +525,75 @@ class Mechanism(object):
         self.kI = self.kB + self.kC + self.kD # all shut states
         self.k = self.kA + self.kB + self.kC + self.kD # all states
 
+    def compile_Q(self):
+        """
+        Precompile Q matrix construction. If every rate uses the default
+        identity() or multiply() rate function, Q is linear in effector
+        values,
+            Q(x) = Q0 + sum_e x_e * Q_e,
+        and update_submat() fills it with a single array expression instead
+        of calling each rate function. Otherwise the fast path is switched
+        off. Rate constants are read when Q is updated, so changing them
+        needs no recompilation. Changing states needs it (set_Q() and
+        update_states() call this); replaced rate functions are detected
+        by _check_linear().
+        """
+
+        self._linear = None
+        self._linear_funcs = [Rate._func for Rate in self.Rates]
+        effs = list(self._effdict.keys())
+        src, dst, col = [], [], []
+        for Rate in self.Rates:
+            if len(Rate.rateconstants) != 1:
+                return
+            if Rate.func is identity:
+                col.append(0)
+            elif Rate.func is multiply:
+                # multiply() takes the value of the first effector.
+                col.append(1)
+            else:
+                return
+            src.append(Rate.State1.no)
+            dst.append(Rate.State2.no)
+        k = len(self.States)
+        flat = np.array(src, dtype=int) * k + np.array(dst, dtype=int)
+        if len(np.unique(flat)) != len(flat):
+            return
+        self._linear = (flat, np.array(src, dtype=int),
+            np.array(col, dtype=int), effs, np.arange(k) * (k + 1))
+
+    def _check_linear(self):
+        """
+        Recompile the fast Q fill if a rate function was replaced (e.g.
+        through Rate.func) since compile_Q().
+
+        Returns
+        -------
+        linear : bool
+            True if Q can be filled on the compiled fast path.
+        """
+
+        funcs = self._linear_funcs
+        if len(funcs) != len(self.Rates) or any(func is not Rate._func
+            for func, Rate in zip(funcs, self.Rates)):
+            self.compile_Q()
+            self._theta_map = None
+        return self._linear is not None
+
+    def _fill_linear(self, Q, x):
+        """
+        Fill Q for effector vector x = [1, x_e] on the compiled fast path.
+        """
+        flat, src, col, effs, diag = self._linear
+        rates = np.array([Rate._rateconstants[0] for Rate in self.Rates])
+        rates *= x[col]
+        Q.flat[flat] = rates
+        Q.flat[diag] = -np.bincount(src, weights=rates, minlength=len(diag))
+
     def set_Q(self):
 
+        self.compile_Q()
+        self._theta_map, self._theta_sig = None, None
         self.Q = np.zeros((len(self.States), len(self.States)), dtype=np.float64)
 
         # Initialize all rates:
@@ -587,14 +654,19 @@ class Mechanism(object):
         return np.array([rate.unit_rate() for rate in self.Rates])
 
     def update_submat(self):
-        for Rate in self.Rates:
-            self.Q[Rate.State1.no, Rate.State2.no] = \
-                Rate.calc(self._effdict)
+        if self._check_linear():
+            effs = self._linear[3]
+            x = np.array([1.0] + [self._effdict[e] for e in effs[:1]])
+            self._fill_linear(self.Q, x)
+        else:
+            for Rate in self.Rates:
+                self.Q[Rate.State1.no, Rate.State2.no] = \
+                    Rate.calc(self._effdict)
 
-        # Update diagonal elements
-        for d in range(self.Q.shape[0]):
-            self.Q[d,d] = 0
-            self.Q[d,d] = -np.sum(self.Q[d])
+            # Update diagonal elements
+            for d in range(self.Q.shape[0]):
+                self.Q[d,d] = 0
+                self.Q[d,d] = -np.sum(self.Q[d])
 
 #        self.eigenvals, self.A = qml.eigs(self.Q)
 #        self.GAB, self.GBA = qml.iGs(self.Q, self.kA, self.kB)
@@ -615,6 +687,93 @@ class Mechanism(object):
         self.QAI = self.Q[:self.kA, self.kA:self.k]
         self.QGG = self.Q[:self.kG, :self.kG]
 
+    def Q_linear(self, eff='c'):
+        """
+        Split Q into parts independent of and proportional to an effector:
+            Q(x) = Q0 + x * Q1
+        where x is the effector value (e.g. concentration). Values of other
+        effectors are kept as set.
+
+        Parameters
+        ----------
+        eff : str
+            Effector name.
+
+        Returns
+        -------
+        Q0, Q1 : ndarrays, shape (k, k)
+
+        Raises
+        ------
+        RuntimeError
+            If a rate does not depend linearly on the effector.
+        """
+
+        Q0 = np.zeros((self.k, self.k))
+        Q1 = np.zeros((self.k, self.k))
+        if self._check_linear():
+            effs = self._linear[3]
+            x0, x1 = np.array([1.0, 0.0]), np.array([0.0, 0.0])
+            if effs and eff == effs[0]:
+                x1[1] = 1.0
+            elif effs:
+                x0[1] = self._effdict[effs[0]]
+            self._fill_linear(Q0, x0)
+            self._fill_linear(Q1, x1)
+            return Q0, Q1
+
+        effdict = dict(self._effdict)
+        for Rate in self.Rates:
+            effdict[eff] = 0.0
+            r0 = Rate.calc(effdict)
+            effdict[eff] = 1.0
+            r1 = Rate.calc(effdict) - r0
+            effdict[eff] = 2.0
+            if not np.isclose(Rate.calc(effdict), r0 + 2 * r1,
+                rtol=1e-12, atol=0):
+                errmsg = "DCPYPS: Rate %s is not linear in %s.\n" % (
+                    Rate.name, eff)
+                raise RuntimeError(errmsg)
+            Q0[Rate.State1.no, Rate.State2.no] = r0
+            Q1[Rate.State1.no, Rate.State2.no] = r1
+        for Q in (Q0, Q1):
+            Q[np.diag_indices(self.k)] = 0
+            Q[np.diag_indices(self.k)] = -Q.sum(axis=1)
+        return Q0, Q1
+
+    def Q_stack(self, values, eff='c'):
+        """
+        Build Q matrices for an array of effector values (e.g.
+        concentrations). Values of other effectors are kept as set. Uses
+        Q_linear() when rates are linear in the effector and falls back to
+        setting each value in turn otherwise; the mechanism is left as it
+        was.
+
+        Parameters
+        ----------
+        values : array_like, shape (n,)
+            Effector values.
+        eff : str
+            Effector name.
+
+        Returns
+        -------
+        Q : ndarray, shape (n, k, k)
+        """
+
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        try:
+            Q0, Q1 = self.Q_linear(eff)
+            return Q0 + values[:, np.newaxis, np.newaxis] * Q1
+        except RuntimeError:
+            saved = self._effdict.get(eff, 0)
+            Q = np.empty((len(values), self.k, self.k))
+            for i in range(len(values)):
+                self.set_eff(eff, values[i])
+                Q[i] = self.Q
+            self.set_eff(eff, saved)
+            return Q
+
     def set_eff(self, eff, val):
         self.set_effdict({eff:val})
 
@@ -633,6 +792,8 @@ class Mechanism(object):
 
     def theta(self):
 
+        if self._compile_theta():
+            return self._rate_vector()[self._theta_map[0]]
         theta = []
         for rate in self.Rates:
             if not rate.fixed and not rate.is_constrained and not rate.mr:
@@ -650,6 +811,18 @@ class Mechanism(object):
 
     def theta_unsqueeze(self, theta):
 
+        if self._compile_theta():
+            ifree, idep, P, c, iset = self._theta_map
+            k = self._rate_vector()
+            k[ifree] = theta
+            if np.all(k > 0):
+                k[idep] = np.exp(np.dot(P, np.log(k)) + c)
+                # Each rate gets its own single element view of k.
+                k = k.reshape(-1, 1)
+                for i in iset:
+                    self.Rates[i]._rateconstants = k[i]
+                return
+
         iter = 0
         for i in range(len(self.Rates)):
             if ((not self.Rates[i].fixed) and
@@ -657,8 +830,136 @@ class Mechanism(object):
               (not self.Rates[i].mr)):
                 self.Rates[i].rateconstants = theta[iter]
                 iter += 1
-        self.update_constrains()
-        self.update_mr()
+        self._apply_constrains()
+        self._apply_mr()
+        self._apply_mr()
+
+    def _rate_vector(self):
+        return np.array([Rate._rateconstants[0] for Rate in self.Rates])
+
+    def _theta_signature(self):
+        # Everything the compiled theta map depends on besides rate values.
+        return ([(rate.fixed, rate.is_constrained, rate.mr,
+            rate.constrain_func, None if rate.constrain_args is None else
+            tuple(rate.constrain_args)) for rate in self.Rates],
+            [tuple(cycle.mrconstr) for cycle in self.Cycles])
+
+    def _compile_theta(self):
+        """
+        Compile the map from free parameters to rate constants, as done
+        by theta_unsqueeze(), into index arrays and a linear map in log
+        space:
+            log(k[idep]) = P * log(k) + c
+        where k holds the current rate constants with free ones replaced
+        by theta. Constraints (constrain_rate_multiple() only) and
+        microscopic reversibility products become rows of P. The map is
+        rebuilt whenever fixed, constrained or MR flags, constraint
+        functions or arguments or MR cycles change (see
+        _theta_signature()), also when rates are edited directly.
+
+        Returns
+        -------
+        compiled : bool
+            False if the map cannot be expressed this way (e.g. custom
+            rate or constraint functions) and rates have to be updated one
+            by one.
+        """
+
+        linear = self._check_linear()
+        signature = self._theta_signature()
+        if signature != self._theta_sig:
+            self._theta_map, self._theta_sig = None, signature
+        if self._theta_map is not None:
+            return self._theta_map is not False
+        self._theta_map = False
+        if not linear:
+            return False
+
+        n = len(self.Rates)
+        P, c = np.eye(n), np.zeros(n)
+        ifree, idep = [], []
+        for i, rate in enumerate(self.Rates):
+            if not rate.fixed and not rate.is_constrained and not rate.mr:
+                ifree.append(i)
+        for i, rate in enumerate(self.Rates):
+            if rate.is_constrained:
+                j, factor = rate.constrain_args[0], rate.constrain_args[1]
+                if (rate.constrain_func is not constrain_rate_multiple or
+                    factor <= 0):
+                    return False
+                P[i], c[i] = P[j], c[j] + np.log(factor)
+                idep.append(i)
+        terms = self._mr_terms()
+        # MR rates are set once by update_constrains() and once more by
+        # theta_unsqueeze().
+        for id, coefs, forward in terms + terms:
+            if id is None:
+                return False
+            sign = -1 if forward else 1
+            row, const = np.zeros(n), 0.0
+            for i, power in coefs:
+                row += power * P[i]
+                const += power * c[i]
+            P[id], c[id] = sign * row, sign * const
+            idep.append(id)
+
+        idep = np.unique(np.array(idep, dtype=int))
+        ifree = np.array(ifree, dtype=int)
+        self._theta_map = (ifree, idep, P[idep], c[idep],
+            np.union1d(ifree, idep).tolist())
+        return True
+
+    def Q_theta_stack(self, thetas, eff='c', val=None):
+        """
+        Build Q matrices for a population of free parameter vectors, as
+        theta_unsqueeze() followed by set_eff() would for each of them. The
+        mechanism is left as it was.
+
+        Parameters
+        ----------
+        thetas : array_like, shape (P, ntheta)
+            Free rate constants (not logarithms), one set per row.
+        eff : str
+            Effector name.
+        val : float, optional
+            Effector value; the current value if not given.
+
+        Returns
+        -------
+        Q : ndarray, shape (P, k, k)
+        """
+
+        thetas = np.atleast_2d(np.asarray(thetas, dtype=np.float64))
+        npop = thetas.shape[0]
+        if val is None:
+            val = self._effdict.get(eff, 0.0)
+        if self._compile_theta():
+            ifree, idep, P, c, iset = self._theta_map
+            K = np.tile(self._rate_vector(), (npop, 1))
+            K[:, ifree] = thetas
+            if np.all(K > 0):
+                K[:, idep] = np.exp(np.dot(np.log(K), P.T) + c)
+                flat, src, col, effs, diag = self._linear
+                x = np.array([1.0, 0.0])
+                if effs:
+                    x[1] = val if eff == effs[0] else self._effdict[effs[0]]
+                K *= x[col]
+                Q = np.zeros((npop, self.k * self.k))
+                Q[:, flat] = K
+                S = np.zeros((len(src), self.k))
+                S[np.arange(len(src)), src] = 1
+                Q[:, diag] = -np.dot(K, S)
+                return Q.reshape(npop, self.k, self.k)
+
+        saved, savedval = self.theta(), self._effdict.get(eff, 0.0)
+        Q = np.empty((npop, self.k, self.k))
+        for i in range(npop):
+            self.theta_unsqueeze(thetas[i])
+            self.set_eff(eff, val)
+            Q[i] = self.Q
+        self.theta_unsqueeze(saved)
+        self.set_eff(eff, savedval)
+        return Q
 
     def update_states(self):
         """
@@ -679,12 +980,17 @@ class Mechanism(object):
 
     def update_constrains(self):
 
+        self._theta_map = None
+        self._apply_constrains()
+        self._apply_mr()
+
+    def _apply_constrains(self):
+
         for i in range(len(self.Rates)):
             if self.Rates[i].is_constrained:
                 args = self.Rates[i].constrain_args
                 func = self.Rates[i].constrain_func
                 self.Rates[i].rateconstants = func(self.Rates[args[0]].rateconstants, args[1])
-        self.update_mr()
                 
     def set_mr(self, mr, nrate, ncycle=0):
         """
@@ -703,9 +1009,41 @@ class Mechanism(object):
         self.update_mr()
 
     def update_mr(self):
-        #TODO: check for consistency between cycle.mrconstr and rate.mr.
+
+        self._theta_map = None
+        return self._apply_mr()
+
+    def _apply_mr(self):
 
         ids = []
+        for id, terms, forward in self._mr_terms():
+            prod = 1
+            for i, power in terms:
+                if power > 0:
+                    prod = prod * self.Rates[i].rateconstants
+                else:
+                    prod = prod / self.Rates[i].rateconstants
+            if forward:
+                prod = 1 / prod
+            self.Rates[id].rateconstants = prod
+            ids.append(id)
+        return ids
+
+    def _mr_terms(self):
+        """
+        Find, for each cycle with a microscopic reversibility constraint,
+        the constrained rate and the rates whose product sets it.
+
+        Returns
+        -------
+        terms : list of tuples
+            (id, [(rate index, +1 or -1), ...], forward) per cycle.
+            Forward rates (+1) multiply and backward rates (-1) divide the
+            product; the constrained rate is its inverse if forward.
+        """
+        #TODO: check for consistency between cycle.mrconstr and rate.mr.
+
+        terms = []
         for cycle in self.Cycles:
             if cycle.mrconstr:
                 # check if constrain is correct: should be just one rate per cycle
@@ -727,7 +1065,7 @@ class Mechanism(object):
                 if not exist:
                     sys.stderr.write("DCPYPS: Warning: MR2: Proposed rate to be constrained is not in the cycle.")
 
-                prod = 1
+                coefs = []
                 id = None
                 forward = False
                 for j in range(len(states1)):
@@ -740,21 +1078,18 @@ class Mechanism(object):
                                 id = icount
                                 forward = True
                             else:
-                                prod = prod * rate.rateconstants
+                                coefs.append((icount, 1))
                         if ((states1[j] == rate.State2.name) and
                                 (states2[j] == rate.State1.name)):
                             if ((cycle.mrconstr[1] == states1[j]) and
                                 (cycle.mrconstr[0] == states2[j])):
                                 id = icount
                             else:
-                                prod = prod / rate.rateconstants
+                                coefs.append((icount, -1))
                         icount += 1
-                if forward:
-                    prod = 1 / prod
-                self.Rates[id].rateconstants = prod
-                ids.append(id)
+                terms.append((id, coefs, forward))
 
-        return ids
+        return terms
 
     def check_mr(self, cycle):
 
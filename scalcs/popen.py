@@ -38,6 +38,185 @@ def Popen(mec, tres, conc=0, eff='c'):
         popen = popen / (1 + conc / mec.fastKB)
     return popen
 
+def Popen_curve(mec, tres, conc, eff='c'):
+    """
+    Calculate equilibrium open probability at an array of concentrations
+    in a single batched pass. Equivalent to calling Popen() at each
+    concentration.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be analysed.
+    tres : float
+        Time resolution (dead time).
+    conc : array_like, shape (n,)
+        Concentrations.
+
+    Returns
+    -------
+    popen : ndarray, shape (n,)
+        Open probability values at given concentrations.
+    """
+
+    conc = np.asarray(conc, dtype=np.float64).reshape(-1)
+    Q = mec.Q_stack(conc, eff)
+    if tres == 0:
+        p = qml.pinf_stack(Q[:, :mec.kG, :mec.kG])
+        popen = np.sum(p[:, :mec.kA], axis=1) / np.sum(p, axis=1)
+    else:
+        hmopen, hmshut = scl.exact_mean_open_shut_time_stack(Q, mec.kA,
+            mec.kF, tres)
+        popen = hmopen / (hmopen + hmshut)
+    if mec.fastblock:
+        popen = popen / (1 + conc / mec.fastKB)
+    return popen
+
+class PopenCurve(object):
+    """
+    Equilibrium concentration-response curve of a mechanism. Popen is
+    calculated on a logarithmic concentration grid in one batched pass;
+    maximum Popen, EC50 and Hill slope are then derived from this shared
+    curve, refining on small batched grids where needed. Results are
+    kept as attributes.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be analysed.
+    tres : float
+        Time resolution (dead time).
+    eff : str
+        Effector name.
+    cmin, cmax : floats
+        Concentration range of the grid.
+    points : int
+        Number of points per decade.
+
+    Attributes
+    ----------
+    conc, popen : ndarrays
+        Concentrations and open probabilities on the grid.
+    P0 : float
+        Open probability in absence of effector.
+    decline : bool
+        True if Popen curve decreases with concentration.
+    maxPopen, cmax : floats
+        Maximum (or, for declining curves, minimum) Popen and
+        concentration at which it is reached.
+    EC50 : float
+        Concentration at which Popen is 50% of its maximal response (to
+        the left of the peak if the curve is not monotonic). NaN if Popen
+        does not depend on concentration or half response is not
+        bracketed.
+    nH : float
+        Hill slope at EC50.
+    """
+
+    def __init__(self, mec, tres, eff='c', cmin=1e-9, cmax=100, points=8):
+        self.mec, self.tres, self.eff = mec, tres, eff
+        ndec = int(round(math.log10(cmax / cmin)))
+        self.conc = np.logspace(math.log10(cmin), math.log10(cmax),
+            ndec * points + 1)
+        self.popen = self.calc(self.conc)
+        # As Popen0(): HJC Popen is undefined if there are no openings.
+        self.P0 = Popen_curve(mec, 0, [0.0], eff)[0]
+        if tres > 0 and self.P0 >= 1e-10:
+            self.P0 = self.calc(np.array([0.0]))[0]
+        self.decline = (self.calc(np.array([1.0]))[0] < self.P0)
+        self._max()
+        self._EC50()
+        self._nH()
+
+    def calc(self, conc):
+        """
+        Popen at an array of concentrations (see Popen_curve()).
+        """
+        return Popen_curve(self.mec, self.tres, conc, self.eff)
+
+    def _max(self):
+        sign = -1 if self.decline else 1
+        p = sign * self.popen
+        # First point at which the curve turns back by more than rounding
+        # error (ignoring vanishingly small Popen values).
+        rel = np.diff(p) / np.maximum(np.fabs(self.popen[1:]), 1e-300)
+        rel[self.popen[1:] < 1e-5] = 0
+        turn = np.flatnonzero((rel[:-1] > 1e-8) & (rel[1:] < -1e-8))
+        if len(turn):
+            # Curve goes through a maximum: narrow down on it.
+            i = int(turn[0]) + 1
+            c1, c2 = self.conc[i-1], self.conc[i+1]
+            while c2 / c1 > 1 + 1e-6:
+                c = np.logspace(math.log10(c1), math.log10(c2), 33)
+                j = int(np.argmax(sign * self.calc(c)))
+                c1, c2 = c[max(j-1, 0)], c[min(j+1, 32)]
+            self.cmax = math.sqrt(c1 * c2)
+            self.maxPopen = self.calc(np.array([self.cmax]))[0]
+            self.ipeak = i
+        else:
+            # Monotonic: take the plateau and the concentration at which
+            # it is reached.
+            self.maxPopen = self.popen[-1]
+            off = np.fabs(self.popen - self.maxPopen) > (
+                1e-5 * math.fabs(self.maxPopen))
+            j = np.flatnonzero(off)
+            self.cmax = self.conc[j[-1] + 1 if len(j) else 0]
+            self.ipeak = len(p) - 1
+
+    def response(self, popen):
+        """
+        Fraction of the maximal response corresponding to Popen value(s).
+        """
+        return (popen - self.P0) / (self.maxPopen - self.P0)
+
+    def _EC50(self):
+        if math.fabs(self.maxPopen - self.P0) < 1e-10:
+            self.EC50 = float('nan')
+            return
+        # Grid up to the peak, closed by the peak itself (response 1) in
+        # case a refined peak lies above all grid points.
+        below = self.conc[:self.ipeak+1] < self.cmax
+        conc = np.append(self.conc[:self.ipeak+1][below], self.cmax)
+        y = np.append(self.response(self.popen[:self.ipeak+1][below]),
+            1.0) - 0.5
+        hit = np.flatnonzero(y >= 0)
+        if not len(hit):
+            self.EC50 = float('nan')
+            return
+        i = int(hit[0])
+        c1 = conc[i-1] if i > 0 else 0.0
+        c2 = conc[i]
+        for k in range(3):
+            c = (np.logspace(math.log10(c1), math.log10(c2), 17) if c1 > 0
+                else np.linspace(c1, c2, 17))
+            y = self.response(self.calc(c)) - 0.5
+            hit = np.flatnonzero(y >= 0)
+            if not len(hit):
+                self.EC50 = float('nan')
+                return
+            # Rounding may put the half response at the left end.
+            j = max(int(hit[0]), 1)
+            c1, c2, y1, y2 = c[j-1], c[j], y[j-1], y[j]
+        # Interpolate linearly within the final bracket.
+        self.EC50 = c1 - y1 * (c2 - c1) / (y2 - y1)
+
+    def _nH(self):
+        """
+        Hill slope at EC50 from a central difference of
+        log((P - P0) / (Pmax - P)) against log(c).
+        """
+        if math.isnan(self.EC50):
+            self.nH = float('nan')
+            return
+        P0, Pmax = self.P0, self.maxPopen
+        if self.decline:
+            P0, Pmax = Pmax, P0
+        d = 1e-3
+        c = self.EC50 * np.power(10, np.array([-d, d]))
+        y = self.calc(c)
+        h = np.log10(np.fabs((y - P0) / (Pmax - y)))
+        self.nH = (h[1] - h[0]) / (2 * d)
+
 def Popen0(mec, tres, eff='c'):
     """
     Find Popen at concentration = 0.
@@ -76,49 +255,8 @@ def maxPopen(mec, tres, eff='c'):
         Concentration at which Popen curve reaches maximal value.
     """
 
-    flat, monot = False, True
-    conc = 1e-9    # start at 1 nM
-    poplast = Popen(mec, tres, conc)
-
-    niter = 0
-    while (not flat and conc < 100 and monot):
-        conc *= math.sqrt(10)
-        popen = Popen(mec, tres, conc)
-        if decline(mec, tres) and (math.fabs(popen) < 1e-12):
-            flat = math.fabs(poplast) < 1e-12
-        else:
-            rel = (popen - poplast) / popen
-            if niter > 1 and popen > 1e-5:
-                if (rel * rellast) < -1e-10: # goes through min/max
-                    monot = False
-                flat = ((math.fabs(rel) < 1e-5) and
-                    (math.fabs(rellast) < 1e-5))
-            if conc < 0.01:    # do not leave before 10 mM ?
-                flat = False
-            rellast = rel
-        poplast = popen
-        niter += 1
-
-    if not monot:    # find maxPopen and cmax more accurately
-        c1, c2 = conc / math.sqrt(10), conc # conc before and after max
-        epsc, epsy =  c1 / 1000, 1e-4 # accuracy in concentration and Popen
-        perr = 2 * epsy
-        fac = 1.01
-        maxnstep  = int(math.log10(math.fabs(c1 - c2) / epsc) / math.log10(2) + 0.5)
-        nstep = 0
-        while nstep <= maxnstep and math.fabs(perr) > 0:
-            conc = 0.5 * (c1 + c2)
-            conc1 = conc / fac
-            P1 = Popen(mec, tres, conc)
-            conc1 = conc * fac
-            P2 = Popen(mec, tres, conc)
-            perr = P2 - P1
-            if perr < 0:
-                c1 = conc1
-            else:
-                c2 = conc1
-
-    return Popen(mec, tres, conc), conc
+    curve = PopenCurve(mec, tres, eff)
+    return curve.maxPopen, curve.cmax
 
 def decline(mec, tres, eff='c'):
     """
@@ -156,28 +294,11 @@ def EC50(mec, tres, eff='c'):
         Concentration at which Popen is 50% of its maximal value.
     """
 
-    P0 = Popen0(mec, tres)
-    maxP, c2 = maxPopen(mec, tres)
-    c1 = 0
-    epsy = 0.001    # accuracy in Popen
-    perr = 2 * epsy
-    epsc = 0.1e-9    # accuracy in concentration 0.1 nM
-    nstepmax = int(math.log10(math.fabs(c1 - c2) / epsc) / math.log10(2) + 0.5)
-    nstep = 0
-    while math.fabs(perr) > epsy and nstep <= nstepmax:
-        conc = (c1 + c2) / 2
-        perr = math.fabs((Popen(mec, tres, conc) - P0) / (maxP - P0)) - 0.5
-        if perr < 0:
-            c1 = conc
-        elif perr > 0:
-            c2 = conc
-        nstep += 1
-    return conc
+    return PopenCurve(mec, tres, eff).EC50
 
 def nH(mec, tres, eff='c'):
     """
     Calculate Hill slope, nH, at EC50 of a calculated Popen curve.
-    This is Python implementation of DCPROGS HJC_HILL.FOR subroutine.
 
     Parameters
     ----------
@@ -191,39 +312,7 @@ def nH(mec, tres, eff='c'):
         Hill slope.
     """
 
-    P0 = Popen0(mec, tres)
-    Pmax, cmax = maxPopen(mec, tres)
-    if decline(mec, tres):
-        P0, Pmax = Pmax, P0
-    ec50 = EC50(mec, tres)
-    # Calculate Popen curve
-    n = 64
-    dc = (math.log10(ec50 * 1.1) - math.log10(ec50 * 0.9)) / (n - 1)
-    c = np.zeros(n)
-    y = np.zeros(n)
-    for i in range(n):
-        c[i] = (ec50 * 0.9) * pow(10, i * dc)
-        y[i] = Popen(mec, tres, c[i])
-
-    # Find two points around EC50.
-    i50 = 0
-    s1, s2 = 0, 0
-    i = 0
-    while i50 ==0 and i < n-1:
-        if (c[i] <= ec50) and (c[i+1] >= ec50):
-            i50 = i
-            y1 = math.log10(math.fabs((y[i] - P0) / (Pmax - y[i])))
-            y2 = math.log10(math.fabs((y[i+1] - P0) / (Pmax - y[i+1])))
-            s1 = (y2 - y1) / (math.log10(c[i+1]) - math.log10(c[i]))
-            y3 = math.log10(math.fabs((y[i+1] - P0) / (Pmax - y[i+1])))
-            y4 = math.log10(math.fabs((y[i+2] - P0) / (Pmax - y[i+2])))
-            s2 = (y4 - y3) / (math.log10(c[i+2]) - math.log10(c[i+1]))
-        i += 1
-
-    # Interpolate linearly for Hill slope at EC50
-    b = (s2 - s1) / (c[i50+1] - c[i50])
-    nH = s1 + b * (ec50 - c[i50])
-    return nH
+    return PopenCurve(mec, tres, eff).nH
 
 
 def printout(mec, tres):
@@ -238,7 +327,7 @@ def printout(mec, tres):
     return out
 
 def print_pars(mec, tres):
-    emaxPopen, conc = maxPopen(mec, tres)
-    return ('maxPopen = {0:.5g}; '.format(emaxPopen) + 
-           ' EC50 = {0:.5g} microM; '.format(EC50(mec, tres) * 1000000) + 
-           ' nH = {0:.5g}'.format(nH(mec, tres)))
\ No newline at end of file
+    curve = PopenCurve(mec, tres)
+    return ('maxPopen = {0:.5g}; '.format(curve.maxPopen) + 
+           ' EC50 = {0:.5g} microM; '.format(curve.EC50 * 1000000) + 
+           ' nH = {0:.5g}'.format(curve.nH))
\ No newline at end of file
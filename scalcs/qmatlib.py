@@ -33,33 +33,85 @@ and maximum likelihood fitting of mechanisms.
 Phil Trans R Soc Lond A 354, 2555-2590.
 """
 
+from collections import OrderedDict
+
 import numpy as np
 from numpy import linalg as nplin
 import math
 
 #import dcpypsrc
 
-def eigs(Q):
+# Opt-in cache of spectral decompositions (see eigs_cache_enable()). Maps
+# (shape, dtype, bytes) of a matrix to (eigvals, A, M, N).
+_eigs_cache = None
+_eigs_cache_maxsize = 0
+_eigs_cache_stats = {'hits': 0, 'misses': 0}
+
+def eigs_cache_enable(maxsize=128):
     """
-    Calculate eigenvalues and spectral matrices of a matrix Q.
+    Switch on caching of spectral decompositions calculated by eigs(),
+    eigs_sorted(), eigs_decomposition() and expQt(). Matrices are compared
+    by contents, so repeated decomposition of an identical Q matrix (or
+    submatrix) is done only once. The least recently used decomposition is
+    dropped when the cache is full.
 
     Parameters
     ----------
-    Q : array_like, shape (k, k)
+    maxsize : int
+        Maximum number of decompositions to keep.
+    """
+
+    global _eigs_cache, _eigs_cache_maxsize
+    if _eigs_cache is None:
+        _eigs_cache = OrderedDict()
+    _eigs_cache_maxsize = maxsize
+    while len(_eigs_cache) > maxsize:
+        _eigs_cache.popitem(last=False)
+
+def eigs_cache_disable():
+    """
+    Switch off and empty the cache of spectral decompositions.
+    """
+
+    global _eigs_cache
+    _eigs_cache = None
+    eigs_cache_clear()
+
+def eigs_cache_clear():
+    """
+    Empty the cache of spectral decompositions and reset its statistics.
+    """
+
+    if _eigs_cache is not None:
+        _eigs_cache.clear()
+    _eigs_cache_stats['hits'] = 0
+    _eigs_cache_stats['misses'] = 0
+
+def eigs_cache_info():
+    """
+    Statistics of the cache of spectral decompositions.
 
     Returns
     -------
-    eigvals : ndarray, shape (k,)
-        Eigenvalues of M.
-    A : ndarray, shape (k, k, k)
-        Spectral matrices of Q.
+    info : dictionary
+        Number of hits and misses, current and maximum size and whether
+        the cache is enabled.
+    """
+
+    return {'hits': _eigs_cache_stats['hits'],
+        'misses': _eigs_cache_stats['misses'],
+        'size': 0 if _eigs_cache is None else len(_eigs_cache),
+        'maxsize': _eigs_cache_maxsize,
+        'enabled': _eigs_cache is not None}
+
+def _eigs_calc(Q):
+    """
+    Calculate eigenvalues, spectral matrices, eigenvectors and inverse
+    eigenvectors of Q.
     """
 
     eigvals, M = nplin.eig(Q)
     N = nplin.inv(M)
-    k = N.shape[0]
-    A = np.zeros((k, k, k))
-    # TODO: make this a one-liner avoiding loops
     # DO NOT DELETE commented explicit loops for future reference
     #
     # rev. 1
@@ -71,16 +123,79 @@ def eigs(Q):
     #     A[i] = np.dot(X, Y)
     # END DO NOT DELETE
     #
-    # rev. 2 - cumulative time fastest on my system
-    for i in range(k):
-        A[i] = np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k))
-
+    # rev. 2
+    # A = np.zeros((k, k, k))
+    # for i in range(k):
+    #     A[i] = np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k))
+    #
     # rev. 3 - cumulative time not faster
     # A = np.array([
     #         np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k)) \
     #             for i in range(k)
     #         ])
 
+    # rev. 4 - all outer products in one call. A is real as in rev. 2.
+    A = np.einsum('im,mj->mij', M, N).real
+    return eigvals, A, M, N
+
+def eigs_decomposition(Q):
+    """
+    Calculate eigenvalues, spectral matrices, eigenvectors and inverse
+    eigenvectors of a matrix Q. Results are taken from the cache if it is
+    enabled (see eigs_cache_enable()).
+
+    Parameters
+    ----------
+    Q : array_like, shape (k, k)
+
+    Returns
+    -------
+    eigvals : ndarray, shape (k,)
+        Eigenvalues of Q.
+    A : ndarray, shape (k, k, k)
+        Spectral matrices of Q.
+    M : ndarray, shape (k, k)
+        Eigenvectors (columns) of Q.
+    N : ndarray, shape (k, k)
+        Inverse of M.
+    """
+
+    if _eigs_cache is None:
+        return _eigs_calc(Q)
+
+    Q = np.asarray(Q)
+    key = (Q.shape, Q.dtype.str, Q.tobytes())
+    if key in _eigs_cache:
+        _eigs_cache_stats['hits'] += 1
+        _eigs_cache.move_to_end(key)
+        result = _eigs_cache[key]
+    else:
+        _eigs_cache_stats['misses'] += 1
+        result = _eigs_calc(Q)
+        if _eigs_cache_maxsize > 0:
+            _eigs_cache[key] = result
+            if len(_eigs_cache) > _eigs_cache_maxsize:
+                _eigs_cache.popitem(last=False)
+    # Callers are free to modify what they get.
+    return tuple(x.copy() for x in result)
+
+def eigs(Q):
+    """
+    Calculate eigenvalues and spectral matrices of a matrix Q.
+
+    Parameters
+    ----------
+    Q : array_like, shape (k, k)
+
+    Returns
+    -------
+    eigvals : ndarray, shape (k,)
+        Eigenvalues of M.
+    A : ndarray, shape (k, k, k)
+        Spectral matrices of Q.
+    """
+
+    eigvals, A, M, N = eigs_decomposition(Q)
     return eigvals, A
 
 def eigs_sorted(Q):
@@ -100,17 +215,34 @@ def eigs_sorted(Q):
         Spectral matrices of Q.
     """
 
-    eigvals, M = nplin.eig(Q)
-    N = nplin.inv(M)
-    k = N.shape[0]
-    A = np.zeros((k, k, k))
-    for i in range(k):
-        A[i] = np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k))
+    eigvals, A = eigs(Q)
     sorted_indices = eigvals.real.argsort()
     eigvals = eigvals[sorted_indices]
     A = A[sorted_indices, : , : ]
     return eigvals, A
 
+def eigs_stack(Q):
+    """
+    Calculate eigenvalues and spectral matrices of a stack of matrices Q
+    (batched version of eigs(); the cache is not used).
+
+    Parameters
+    ----------
+    Q : array_like, shape (n, k, k)
+
+    Returns
+    -------
+    eigvals : ndarray, shape (n, k)
+        Eigenvalues of Q[n].
+    A : ndarray, shape (n, k, k, k)
+        Spectral matrices of Q[n].
+    """
+
+    eigvals, M = nplin.eig(Q)
+    N = nplin.inv(M)
+    A = np.einsum('nim,nmj->nmij', M, N).real
+    return eigvals, A
+
 def expQt(M, t):
     """
     Calculate exponential of a matrix M.
@@ -147,6 +279,27 @@ def expQt(M, t):
     expM = np.sum(A * np.exp(eigvals * t).reshape(A.shape[0],1,1), axis=0)
     return expM
 
+def expQt_stack(M, t):
+    """
+    Calculate exponentials of a matrix M for an array of times from a single
+    spectral decomposition.
+        expM[n] = exp(M * t[n])
+
+    Parameters
+    ----------
+    M : array_like, shape (k, k)
+    t : array_like, shape (n,)
+        Times.
+
+    Returns
+    -------
+    expM : ndarray, shape (n, k, k)
+    """
+
+    eigvals, A = eigs(M)
+    t = np.asarray(t, dtype=np.float64).reshape(-1)
+    return np.einsum('nm,mij->nij', np.exp(np.outer(t, eigvals)), A)
+
 def Qpow(M, n):
     """
     Rise matrix M to power n.
@@ -208,6 +361,47 @@ def pinf(Q):
     pinf = np.append(pinf, 1 - np.sum(pinf))
     return pinf
 
+def pinf_stack(Q):
+    """
+    Calculate equilibrium occupancies for a stack of Q matrices with the
+    reduced Q-matrix method (see pinf()).
+
+    Parameters
+    ----------
+    Q : array_like, shape (n, k, k)
+
+    Returns
+    -------
+    pinf : ndarray, shape (n, k)
+    """
+
+    Q = np.asarray(Q)
+    R = (Q - Q[:, -1:, :])[:, :-1, :-1]
+    r = Q[:, -1, :-1]
+    pinf = -nplin.solve(np.swapaxes(R, 1, 2), r[:, :, np.newaxis])[:, :, 0]
+    return np.concatenate((pinf, 1 - np.sum(pinf, axis=1)[:, np.newaxis]),
+        axis=1)
+
+def expQ_stack(Q, t):
+    """
+    Calculate exponentials of a stack of matrices at a single time.
+        expM[n] = exp(Q[n] * t)
+
+    Parameters
+    ----------
+    Q : array_like, shape (n, k, k)
+    t : float
+        Time.
+
+    Returns
+    -------
+    expM : ndarray, shape (n, k, k)
+    """
+
+    eigvals, M = nplin.eig(Q)
+    N = nplin.inv(M)
+    return np.matmul(M * np.exp(eigvals * t)[:, np.newaxis, :], N).real
+
 def iGs(Q, kA, kB):
     r"""
     Calculate GBA and GAB matrices (Eq. 1.25, CH82).
@@ -250,6 +444,29 @@ def iGt(t, QAA, QAB):
     GAB = np.dot(expQt(QAA, t), QAB)
     return GAB
 
+def iGt_stack(t, QAA, QAB):
+    """
+    Calculate GAB(t) (Eq. 1.20, CH82) for an array of times from a single
+    spectral decomposition of QAA.
+        GAB(t[n]) = sum_m exp(eigval[m] * t[n]) * A[m] * QAB
+
+    Parameters
+    ----------
+    t : array_like, shape (n,)
+        Times.
+    QAA : array_like, shape (kA, kA)
+    QAB : array_like, shape (kA, kB)
+
+    Returns
+    -------
+    GAB : ndarray, shape (n, kA, kB)
+    """
+
+    eigvals, A = eigs(QAA)
+    t = np.asarray(t, dtype=np.float64).reshape(-1)
+    return np.einsum('nm,mij->nij', np.exp(np.outer(t, eigvals)),
+        np.matmul(A, QAB))
+
 def eGs(GAF, GFA, kA, kF, expQFF):
     """
     Calculate eGAF, probabilities from transitions from apparently open to
@@ -276,6 +493,25 @@ def eGs(GAF, GFA, kA, kF, expQFF):
     eGAF = np.dot(np.dot(nplin.inv(temp), GAF), expQFF)
     return eGAF
 
+def eGs_stack(GAF, GFA, expQFF):
+    """
+    Batched version of eGs() for stacks of matrices.
+
+    Parameters
+    ----------
+    GAF : array_like, shape (n, kA, kF)
+    GFA : array_like, shape (n, kF, kA)
+    expQFF : array_like, shape (n, kF, kF)
+
+    Returns
+    -------
+    eGAF : ndarray, shape (n, kA, kF)
+    """
+
+    kA, kF = GAF.shape[1], GAF.shape[2]
+    temp = np.eye(kA) - np.matmul(np.matmul(GAF, np.eye(kF) - expQFF), GFA)
+    return np.matmul(np.matmul(nplin.inv(temp), GAF), expQFF)
+
 def phiA(mec):
     """
     Calculate initial vector for openings.
@@ -376,6 +612,27 @@ def phiHJC(eGAF, eGFA, kA):
 
     return phi
 
+def phiHJC_stack(eGAF, eGFA):
+    """
+    Batched version of phiHJC() for stacks of matrices.
+
+    Parameters
+    ----------
+    eGAF : array_like, shape (n, kA, kF)
+    eGFA : array_like, shape (n, kF, kA)
+
+    Returns
+    -------
+    phi : ndarray, shape (n, kA)
+    """
+
+    n, kA = eGAF.shape[0], eGAF.shape[1]
+    if kA == 1:
+        return np.ones((n, 1))
+    S = np.concatenate((np.eye(kA) - np.matmul(eGAF, eGFA),
+        np.ones((n, kA, 1))), axis=2)
+    return np.sum(nplin.inv(np.matmul(S, np.swapaxes(S, 1, 2))), axis=1)
+
 def H(s, tres, QAA, QFF, QAF, QFA, kF):
     """
     Evaluate H(s) funtion (Eq. 54, HJC92).
@@ -621,6 +878,49 @@ def AR(roots, tres, QAA, QFF, QAF, QFA, kA, kF):
 
     return R
 
+def AR_stack(roots, tres, QAA, QFF, QAF, QFA, expQFF):
+    """
+    Batched version of AR() for stacks of matrices. Uses
+        exp(-(s*I - QFF) * tres) = exp(-s * tres) * exp(QFF * tres)
+    so that no matrix exponential is needed for each root.
+
+    Parameters
+    ----------
+    roots : array_like, shape (n, kA)
+        Roots of the asymptotic pdf.
+    tres : float
+        Time resolution (dead time).
+    QAA, QFF, QAF, QFA : array_like, shapes (n, kA, kA), (n, kF, kF) ...
+        Submatrices of Q.
+    expQFF : array_like, shape (n, kF, kF)
+        exp(QFF * tres).
+
+    Returns
+    -------
+    R : ndarray, shape(n, kA, kA, kA)
+    """
+
+    n, kA, kF = QAF.shape
+    IA, IF = np.eye(kA), np.eye(kF)
+    s = roots[:, :, np.newaxis, np.newaxis]
+    invXFF = nplin.inv(s * IF - QFF[:, np.newaxis])
+    SFF = IF - np.exp(-s * tres) * expQFF[:, np.newaxis]
+    QAF, QFA = QAF[:, np.newaxis], QFA[:, np.newaxis]
+    WA = s * IA - QAA[:, np.newaxis] - np.matmul(np.matmul(np.matmul(QAF,
+        invXFF), SFF), QFA)
+    try:
+        row = pinf_stack(WA.reshape(n * kA, kA, kA))
+        col = pinf_stack(np.swapaxes(WA, 2, 3).reshape(n * kA, kA, kA))
+    except nplin.LinAlgError:
+        return np.array([AR(roots[i], tres, QAA[i], QFF[i], QAF[i, 0],
+            QFA[i, 0], kA, kF) for i in range(n)])
+    row, col = row.reshape(n, kA, kA), col.reshape(n, kA, kA)
+    w1 = np.matmul(SFF, invXFF) - tres * (IF - SFF)
+    W1A = IA + np.matmul(np.matmul(QAF, w1), np.matmul(invXFF, QFA))
+    denom = np.einsum('nij,nijk,nik->ni', row, W1A, col)
+    return (col[:, :, :, np.newaxis] * row[:, :, np.newaxis, :] /
+        denom[:, :, np.newaxis, np.newaxis])
+
 def HAF(roots, tres, tcrit, QAF, expQFF, R):
     """
     Parameters
@@ -680,6 +980,34 @@ def CHSvec(roots, tres, tcrit, QFA, kA, expQAA, phiF, R):
 
     return start, end
 
+def CHSvec_stack(roots, tres, tcrit, QFA, expQAA, phiF, R):
+    """
+    Batched version of CHSvec() for stacks of matrices.
+
+    Parameters
+    ----------
+    roots : array_like, shape (n, kF)
+    tres, tcrit : floats
+    QFA : array_like, shape(n, kF, kA)
+    expQAA : array_like, shape(n, kA, kA)
+    phiF : array_like, shape(n, kF)
+    R : array_like, shape(n, kF, kF, kF)
+
+    Returns
+    -------
+    start : ndarray, shape (n, kA)
+        CHS start vectors.
+    end : ndarray, shape (n, kF, 1)
+        CHS end vectors.
+    """
+
+    coeff = -np.exp(roots * (tcrit - tres)) / roots
+    temp = np.einsum('nm,nmij->nij', coeff, R)
+    H = np.matmul(np.matmul(temp, QFA), expQAA)
+    start = np.einsum('ni,nij->nj', phiF, H)
+    start /= np.sum(start, axis=1)[:, np.newaxis]
+    return start, np.sum(H, axis=2)[:, :, np.newaxis]
+
 def eGAF(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF):
     #TODO: update documentation
     """
@@ -719,13 +1047,183 @@ def eGAF(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF):
 
     return eGAFt
 
+def eGAF_regions(t, tres):
+    """
+    Sort time intervals into the exact regions (t < 2 * tres and
+    t < 3 * tres) and the asymptotic region of eGAF(t). The result can be
+    passed to eGAF_stack() to avoid repeating this for every evaluation.
+
+    Parameters
+    ----------
+    t : array_like, shape (n,)
+        Time intervals.
+    tres : float
+        Time resolution (dead time).
+
+    Returns
+    -------
+    regions : tuple
+        (ex, u, ex2, u2, asy, ua): masks of exact (t < 3 * tres), second
+        exact (2 * tres <= t < 3 * tres) and asymptotic intervals together
+        with arguments t - tres, t - 2 * tres and t - tres in those regions.
+    """
+
+    t = np.asarray(t, dtype=np.float64)
+    ex1 = t < (tres * 2)
+    ex2 = (t < (tres * 3)) & ~ex1
+    ex = ex1 | ex2
+    asy = ~ex
+    return ex, t[ex] - tres, ex2, t[ex2] - 2 * tres, asy, t[asy] - tres
+
+def eGAF_stack(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF,
+    regions=None):
+    """
+    Calculate transition densities eGAF(t) for an array of time intervals in
+    one call. Intervals are sorted into the exact regions (t < 2 * tres and
+    t < 3 * tres) and the asymptotic region exactly as in eGAF().
+
+    Parameters
+    ----------
+    t : array_like, shape (n,)
+        Time intervals.
+    tres : float
+        Time resolution (dead time).
+    eigvals : array_like, shape (1, k)
+        Eigenvalues of -Q matrix.
+    Z00, Z10, Z11 : array_like, shape (k, kA, kF)
+        Z constants for the exact open time pdf.
+    roots : array_like, shape (1, kA)
+        Roots of the asymptotic pdf.
+    R : array_like, shape(kA, kA, kA)
+    QAF : array_like, shape(kA, kF)
+    expQFF : array_like, shape(kF, kF)
+    regions : tuple, optional
+        Output of eGAF_regions(t, tres).
+
+    Returns
+    -------
+    eGAFt : ndarray, shape(n, kA, kF)
+    """
+
+    if regions is None:
+        regions = eGAF_regions(t, tres)
+    ex, u, ex2, u2, asy, ua = regions
+    eGAFt = np.empty((ex.shape[0], ) + Z00.shape[1:])
+
+    if u.shape[0]:
+        eGAFt[ex] = np.einsum('nm,mij->nij', np.exp(-np.outer(u, eigvals)), Z00)
+    if u2.shape[0]:
+        E = np.exp(-np.outer(u2, eigvals))
+        eGAFt[ex2] -= (np.einsum('nm,mij->nij', E, Z10) +
+            np.einsum('nm,mij->nij', E * u2[:, np.newaxis], Z11))
+    if ua.shape[0]:
+        RQ = np.dot(np.dot(R, QAF), expQFF)
+        eGAFt[asy] = np.einsum('nm,mij->nij', np.exp(np.outer(ua, roots)), RQ)
+
+    return eGAFt
+
+def eGAF_population(regions, eigvals, Z00, Z10, Z11, roots, R, QAF,
+    expQFF):
+    """
+    Calculate transition densities eGAF(t) for an array of time intervals
+    and a population of parameter sets in one call. Arguments are those of
+    eGAF_stack() stacked along a leading population axis.
+
+    Parameters
+    ----------
+    regions : tuple
+        Output of eGAF_regions(t, tres).
+    eigvals : array_like, shape (P, k)
+    Z00, Z10, Z11 : array_like, shape (P, k, kA, kF)
+    roots : array_like, shape (P, kA)
+    R : array_like, shape(P, kA, kA, kA)
+    QAF : array_like, shape(P, kA, kF)
+    expQFF : array_like, shape(P, kF, kF)
+
+    Returns
+    -------
+    eGAFt : ndarray, shape(P, n, kA, kF)
+    """
+
+    ex, u, ex2, u2, asy, ua = regions
+    eGAFt = np.empty((Z00.shape[0], ex.shape[0]) + Z00.shape[2:])
+
+    if u.shape[0]:
+        E = np.exp(-u[np.newaxis, :, np.newaxis] * eigvals[:, np.newaxis, :])
+        eGAFt[:, ex] = np.einsum('pnm,pmij->pnij', E, Z00)
+    if u2.shape[0]:
+        E = np.exp(-u2[np.newaxis, :, np.newaxis] * eigvals[:, np.newaxis, :])
+        eGAFt[:, ex2] -= (np.einsum('pnm,pmij->pnij', E, Z10) +
+            np.einsum('pnm,pmij->pnij', E * u2[:, np.newaxis], Z11))
+    if ua.shape[0]:
+        RQ = np.matmul(np.matmul(R, QAF[:, np.newaxis]),
+            expQFF[:, np.newaxis])
+        E = np.exp(ua[np.newaxis, :, np.newaxis] * roots[:, np.newaxis, :])
+        eGAFt[:, asy] = np.einsum('pnm,pmij->pnij', E, RQ)
+
+    return eGAFt
+
+def eGAF_stack_gradient(G, eigvals, Z00, Z10, Z11, roots, RQ, regions):
+    """
+    Back-propagate through eGAF_stack(): given G[n] = dL / deGAF(t[n]) for
+    a scalar function L, calculate the gradients of L with respect to the
+    constants eGAF(t) is built from.
+
+    Parameters
+    ----------
+    G : array_like, shape (n, kA, kF)
+        Gradient of L with respect to each eGAF(t).
+    eigvals : array_like, shape (k,)
+        Eigenvalues of -Q matrix.
+    Z00, Z10, Z11 : array_like, shape (k, kA, kF)
+        Z constants for the exact open time pdf.
+    roots : array_like, shape (kA,)
+        Roots of the asymptotic pdf.
+    RQ : array_like, shape (kA, kA, kF)
+        Asymptotic constants R * QAF * expQFF.
+    regions : tuple
+        Output of eGAF_regions(t, tres).
+
+    Returns
+    -------
+    grads : tuple of ndarrays
+        Gradients with respect to eigvals, Z00, Z10, Z11, roots and RQ.
+    """
+
+    ex, u, ex2, u2, asy, ua = regions
+    geig = np.zeros(eigvals.shape)
+    gZ10 = np.zeros(Z10.shape)
+    gZ11 = np.zeros(Z11.shape)
+
+    G0 = G[ex]
+    E = np.exp(-np.outer(u, eigvals))
+    gZ00 = np.einsum('nm,nij->mij', E, G0)
+    geig -= np.sum(u[:, np.newaxis] * E *
+        np.einsum('nij,mij->nm', G0, Z00), axis=0)
+    if u2.shape[0]:
+        G2 = G[ex2]
+        E = np.exp(-np.outer(u2, eigvals))
+        Eu = E * u2[:, np.newaxis]
+        gZ10 = -np.einsum('nm,nij->mij', E, G2)
+        gZ11 = -np.einsum('nm,nij->mij', Eu, G2)
+        geig += np.sum(Eu * (np.einsum('nij,mij->nm', G2, Z10) +
+            u2[:, np.newaxis] * np.einsum('nij,mij->nm', G2, Z11)), axis=0)
+
+    Ga = G[asy]
+    E = np.exp(np.outer(ua, roots))
+    gRQ = np.einsum('nm,nij->mij', E, Ga)
+    groots = np.sum(ua[:, np.newaxis] * E *
+        np.einsum('nij,mij->nm', Ga, RQ), axis=0)
+
+    return geig, gZ00, gZ10, gZ11, groots, gRQ
+
 def f0(u, eigvals, Z00):
     """
     A component of exact time pdf (Eq. 22, HJC92).
 
     Parameters
     ----------
-    u : float
+    u : float or array_like, shape (n,)
         u = t - tres
     eigvals : array_like, shape (k,)
         Eigenvalues of -Q matrix.
@@ -736,13 +1234,17 @@ def f0(u, eigvals, Z00):
     Returns
     -------
     f : ndarray
+        For array u, values for all u stacked along the first axis.
     """
 
 #    f = np.zeros(Z00[0].shape)
 #    for i in range(len(eigvals)):
 #        f += Z00[i] *  math.exp(-eigvals[i] * u)
 
-    if Z00.ndim > 1:
+    if np.ndim(u) > 0:
+        E = np.exp(-np.outer(u, eigvals))
+        f = np.tensordot(E, Z00, axes=1)
+    elif Z00.ndim > 1:
         f = np.sum(Z00 *  np.exp(-eigvals * u).reshape(Z00.shape[0],1,1),
             axis=0)
     else:
@@ -755,7 +1257,7 @@ def f1(u, eigvals, Z10, Z11):
 
     Parameters
     ----------
-    u : float
+    u : float or array_like, shape (n,)
         u = t - tres
     eigvals : array_like, shape (k,)
         Eigenvalues of -Q matrix.
@@ -766,13 +1268,19 @@ def f1(u, eigvals, Z10, Z11):
     Returns
     -------
     f : ndarray
+        For array u, values for all u stacked along the first axis.
     """
 
 #    f = np.zeros(Z10[0].shape)
 #    for i in range(len(eigvals)):
 #        f += (Z10[i] + Z11[i] * u) *  math.exp(-eigvals[i] * u)
 
-    if Z10.ndim > 1:
+    if np.ndim(u) > 0:
+        u = np.asarray(u, dtype=np.float64).reshape(-1)
+        E = np.exp(-np.outer(u, eigvals))
+        f = (np.tensordot(E, Z10, axes=1) +
+            np.tensordot(E * u[:, np.newaxis], Z11, axes=1))
+    elif Z10.ndim > 1:
         f = np.sum((Z10 + Z11 * u) *
             np.exp(-eigvals * u).reshape(Z10.shape[0],1,1), axis=0)
     else:
@@ -840,3 +1348,46 @@ def Zxx(Q, eigen, A, kopen, QFF, QAF, QFA, expQFF, open):
     Z11 = np.array([np.dot(C, M) for C in C11])
 
     return eigen, Z00, Z10, Z11
+
+def Zxx_stack(eigen, A, kopen, QAF, QFA, expQFF, open):
+    """
+    Batched version of Zxx() for a stack of parameter sets.
+
+    Parameters
+    ----------
+    eigen : array_like, shape (n, k)
+        Eigenvalues of -Q matrices.
+    A : array_like, shape (n, k, k, k)
+        Spectral matrices of -Q matrices.
+    kopen : int
+        Number of open states.
+    QAF, QFA : array_like
+        Submatrices of Q (exchange A and F for shut time pdf).
+    expQFF : array_like, shape (n, kF, kF)
+    open : bool
+        True for open time pdf, False for shut time pdf.
+
+    Returns
+    -------
+    eigen : ndarray, shape (n, k)
+    Z00, Z10, Z11 : ndarrays, shape (n, k, kA, kF)
+    """
+
+    k = A.shape[1]
+    if open:
+        C00 = A[:, :, :kopen, :kopen]
+        A1 = A[:, :, :kopen, kopen:]
+    else:
+        C00 = A[:, :, kopen:, kopen:]
+        A1 = A[:, :, kopen:, :kopen]
+    D = np.matmul(np.matmul(A1, expQFF[:, np.newaxis]), QFA[:, np.newaxis])
+    C11 = np.matmul(D, C00)
+    # DC[:, i, j] = D[i] * C00[j]
+    DC = np.matmul(D[:, :, np.newaxis], C00[:, np.newaxis])
+    diff = eigen[:, np.newaxis, :] - eigen[:, :, np.newaxis]
+    diff[:, np.arange(k), np.arange(k)] = np.inf
+    w = 1 / diff
+    C10 = (np.einsum('nij,nijab->niab', w, DC) +
+        np.einsum('nij,njiab->niab', w, DC))
+    M = np.matmul(QAF, expQFF)[:, np.newaxis]
+    return eigen, np.matmul(C00, M), np.matmul(C10, M), np.matmul(C11, M)
@@ -1007,3 +1007,190 @@ def mec_save_to_yaml(mec, fname):
     import yaml
     stream = open(fname, 'w')
     yaml.dump(mec, stream)
+
+def scn_read_header(fname):
+    """
+    Read header of SCN file. SCN files are generated by SCAN program
+    (DCPROGS) and contain idealised single channel record. Only new format
+    files (iscanver 103, 104 or -103 (simulated)) are supported.
+
+    Parameters
+    ----------
+    fname : filename
+
+    Returns
+    -------
+    ioffset : int
+        Byte (counted from 1) where data start.
+    nint : int
+        Number of intervals.
+    calfac2 : float
+        Calibration factor to convert integer amplitudes to pA.
+    header : dictionary
+        All header values.
+    """
+
+    f = open(fname, 'rb')
+    iscanver, ioffset, nint = struct.unpack('<3i', f.read(12))
+    if abs(iscanver) < 103:
+        f.close()
+        raise RuntimeError("scn_read_header: Old version of SCN file " +
+            "({0:d}) is not supported.".format(iscanver))
+    header = {'iscanver': iscanver, 'ioffset': ioffset, 'nint': nint}
+    header['title'] = f.read(70).decode('latin-1').strip()
+    header['date'] = f.read(11).decode('latin-1').strip()
+    header['tapeID'] = f.read(24).decode('latin-1').strip()
+    (header['ipatch'], header['Emem'], header['unknown1'], header['avamp'],
+        header['rms'], header['ffilt'], header['calfac2'], header['treso'],
+        header['tresg']) = struct.unpack('<ifi6f', f.read(36))
+    f.close()
+    return ioffset, nint, header['calfac2'], header
+
+def scn_write(fname, intervals, amplitudes, props, calfac2=1.0,
+    title='', ipatch=0, Emem=0.0, avamp=0.0, rms=0.0, ffilt=0.0,
+    treso=0.0, tresg=0.0):
+    """
+    Write idealised single channel record in SCN (version 104) format.
+
+    Parameters
+    ----------
+    fname : filename
+    intervals : array_like, shape (nint,)
+        Interval lengths in milliseconds.
+    amplitudes : array_like of ints, shape (nint,)
+        Amplitudes in calfac2 units (0 for shuttings).
+    props : array_like of ints, shape (nint,)
+        Interval property flags (e.g. 8 for unusable).
+    calfac2 : float
+        Calibration factor to convert amplitudes to pA.
+    Other parameters are stored in header as they are (see
+    scn_read_header()).
+    """
+
+    nint = len(intervals)
+    ioffset = 154
+    f = open(fname, 'wb')
+    f.write(struct.pack('<3i', 104, ioffset, nint))
+    for text, length in ((title, 70), (time.strftime('%d-%b-%Y'), 11),
+        ('', 24)):
+        f.write(text.encode('latin-1')[:length].ljust(length))
+    f.write(struct.pack('<ifi6f', ipatch, Emem, 0, avamp, rms, ffilt,
+        calfac2, treso, tresg))
+    np.asarray(intervals, dtype='<f4').tofile(f)
+    np.asarray(amplitudes, dtype='<i2').tofile(f)
+    np.asarray(props, dtype='i1').tofile(f)
+    f.close()
+
+class SCNRecord(object):
+    """
+    Idealised single channel record read from SCN file. Data are memory
+    mapped on first access; intervals, amplitudes and props are read-only
+    views of the file, so nothing is copied into memory.
+
+    Data in file:
+        real*4 tint(1...nint)       4nint bytes
+        integer*2 iampl(1..nint)    2nint bytes
+        integer*1 iprops(1..nint)   nint bytes
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.ioffset, self.nint, self.calfac2, self.header = \
+            scn_read_header(fname)
+        self._data = None
+
+    def _map(self):
+        if self._data is None:
+            start, n = self.ioffset - 1, self.nint
+            if n == 0:
+                self._data = (np.zeros(0, '<f4'), np.zeros(0, '<i2'),
+                    np.zeros(0, 'i1'))
+            else:
+                self._data = tuple(np.memmap(self.fname, dtype=dtype,
+                    mode='r', offset=start + skip, shape=(n,))
+                    for dtype, skip in (('<f4', 0), ('<i2', 4 * n),
+                    ('i1', 6 * n)))
+        return self._data
+
+    @property
+    def intervals(self):
+        """Interval lengths in milliseconds (float32 view)."""
+        return self._map()[0]
+
+    @property
+    def amplitudes(self):
+        """Amplitudes in calfac2 units (int16 view)."""
+        return self._map()[1]
+
+    @property
+    def props(self):
+        """Interval property flags (int8 view)."""
+        return self._map()[2]
+
+    def __len__(self):
+        return self.nint
+
+class SCNDataset(object):
+    """
+    Several SCN files concatenated lazily. Only headers are read when the
+    dataset is created; files are memory mapped when their data are first
+    accessed. Ranges which lie within one file are returned as views of
+    that file, ranges spanning files are copied.
+
+    Parameters
+    ----------
+    fnames : list of filenames
+    """
+
+    # Types of arrays returned for empty ranges, as of SCNRecord views.
+    _DTYPES = {'intervals': '<f4', 'amplitudes': '<i2', 'props': 'i1'}
+
+    def __init__(self, fnames):
+        self.records = [SCNRecord(fname) for fname in fnames]
+        self.offsets = np.zeros(len(self.records) + 1, dtype=np.intp)
+        np.cumsum([rec.nint for rec in self.records], out=self.offsets[1:])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def _pieces(self, name, start, stop):
+        # Views of records covering intervals start:stop.
+        start, stop, step = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        first = max(np.searchsorted(self.offsets, start, side='right') - 1, 0)
+        last = min(np.searchsorted(self.offsets, stop, side='left'),
+            len(self.records))
+        pieces = []
+        for i in range(first, last):
+            a, b = self.offsets[i], self.offsets[i + 1]
+            pieces.append((self.records[i], getattr(self.records[i],
+                name)[max(start, a) - a : min(stop, b) - a]))
+        return pieces
+
+    def _get(self, name, start, stop):
+        pieces = [data for rec, data in self._pieces(name, start, stop)]
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return np.zeros(0, self._DTYPES[name])
+        return np.concatenate(pieces)
+
+    def intervals(self, start=None, stop=None):
+        """Interval lengths in milliseconds of intervals start:stop."""
+        return self._get('intervals', start, stop)
+
+    def amplitudes(self, start=None, stop=None):
+        """
+        Amplitudes in pA of intervals start:stop. Calibration factors may
+        differ between files, so amplitudes are always copied.
+        """
+        pieces = [data * np.float32(rec.calfac2)
+            for rec, data in self._pieces('amplitudes', start, stop)]
+        return np.concatenate(pieces) if pieces else np.zeros(0, np.float32)
+
+    def props(self, start=None, stop=None):
+        """Interval property flags of intervals start:stop."""
+        return self._get('props', start, stop)
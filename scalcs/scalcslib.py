@@ -35,16 +35,19 @@ Sakmann B, Neher E) Plenum Press, New York, pp. 589-633.
 __author__="R.Lape, University College London"
 __date__ ="$07-Dec-2010 20:29:14$"
 
+import os
 import sys
 from math import*
 from decimal import*
-import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import scipy.optimize as so
 import numpy as np
 from numpy import linalg as nplin
 
 from scalcs import qmatlib as qml
+from scalcs import scsim
 #import bisectHJC
 from scalcs import pdfs
 #import optimize
@@ -220,11 +223,41 @@ def asymptotic_pdf(t, tres, tau, area):
 
     return apdf
 
-def asymptotic_roots(tres, QAA, QFF, QAF, QFA, kA, kF):
+# Number of asymptotic_roots() calls and of H(s) evaluations ("probes")
+# spent on them (see asymptotic_roots_stats()).
+_root_stats = {'calls': 0, 'probes': 0, 'warm': 0, 'fallback': 0}
+
+def asymptotic_roots_stats(clear=False):
+    """
+    Statistics of asymptotic root finding since start or last clear.
+
+    Parameters
+    ----------
+    clear : bool
+        Reset statistics after reading them.
+
+    Returns
+    -------
+    stats : dictionary
+        Number of calls, probes (evaluations of H(s)), calls solved from
+        the warm start guess and calls which needed the bisection fallback.
+    """
+
+    stats = dict(_root_stats)
+    if clear:
+        for key in _root_stats:
+            _root_stats[key] = 0
+    return stats
+
+def asymptotic_roots(tres, QAA, QFF, QAF, QFA, kA, kF, guess=None,
+    full_output=False):
     """
     Find roots for the asymptotic probability density function (Eqs. 52-58,
     HJC92).
 
+    Roots are found by asymptotic_roots_newton(), which falls back to
+    bisection (bisect_intervals()) and brentq if it fails.
+
     Parameters
     ----------
     tres : float
@@ -238,25 +271,320 @@ def asymptotic_roots(tres, QAA, QFF, QAF, QFA, kA, kF):
         A number of open states in kinetic scheme.
     kF : int
         A number of shut states in kinetic scheme.
+    guess : array_like, shape (kA,), optional
+        Approximate roots, e.g. for the previous parameters during fitting.
+    full_output : bool
+        If True, return also the number of probes used.
 
     Returns
     -------
     roots : array_like, shape (1, kA)
+    nprobes : int
+        Number of evaluations of H(s); only if full_output is True.
+    """
+
+    roots, nprobes, warm = asymptotic_roots_newton(tres,
+        QAA, QFF, QAF, QFA, kA, kF, guess)
+    if roots is None:
+        _root_stats['fallback'] += 1
+        probes0 = _root_stats['probes']
+        sas = -1000000
+        sbs = -0.0000001
+        sro = bisect_intervals(sas, sbs, tres,
+            QAA, QFF, QAF, QFA, kA, kF)
+
+        roots = np.zeros(kA)
+        for i in range(kA):
+            roots[i], r = so.brentq(qml.detW, sro[i, 0], sro[i, 1],
+                args=(tres, QAA, QFF, QAF, QFA, kA, kF), full_output=True)
+            _root_stats['probes'] += r.function_calls
+
+#            roots[i] = so.bisect(qml.detW, sro[i,0], sro[i,1],
+#                args=(tres, QAA, QFF, QAF, QFA, kA, kF))
+
+        nprobes += _root_stats['probes'] - probes0
+    else:
+        _root_stats['probes'] += nprobes
+        _root_stats['warm'] += warm
+    _root_stats['calls'] += 1
+
+    if full_output:
+        return roots, nprobes
+    return roots
+
+def asymptotic_roots_newton(tres, QAA, QFF, QAF, QFA, kA, kF, guess=None,
+    tol=1e-14, maxiter=100):
     """
+    Find roots of det W(s) = 0 (Eqs. 52-58, HJC92) with Newton steps.
 
-    sas = -1000000
-    sbs = -0.0000001
-    sro = bisect_intervals(sas, sbs, tres,
-        QAA, QFF, QAF, QFA, kA, kF)
+    One spectral decomposition QFF = sum(l[m] * A[m]) is used for all s:
+        H(s) = QAA + sum(c[m](s) * QAF * A[m] * QFA),
+        c[m](s) = (1 - exp(-(s - l[m]) * tres)) / (s - l[m]),
+    so that neither W(s) nor W'(s) (qml.dW()) need a matrix inverse or
+    exponential. If guess is given, Newton iteration starts from it and
+    the roots found are accepted only if counting the eigenvalues of H(s)
+    below s (Frank Ball's method, bisect_gFB()) between them confirms that
+    each is a different root. Otherwise intervals containing one root each
+    are found by Ball's method and the root in each is found by Newton
+    iteration safeguarded by bisection.
 
-    roots = np.zeros(kA)
-    for i in range(kA):
-        roots[i] = so.brentq(qml.detW, sro[i, 0], sro[i, 1],
-            args=(tres, QAA, QFF, QAF, QFA, kA, kF))
+    Parameters
+    ----------
+    tres : float
+        Time resolution (dead time).
+    QAA, QFF, QAF, QFA : array_like
+        Submatrices of Q.
+    kA, kF : ints
+        Numbers of open and shut states.
+    guess : array_like, shape (kA,), optional
+        Approximate roots.
+    tol : float
+        Relative tolerance of roots.
+    maxiter : int
+        Maximum number of Newton steps per root.
+
+    Returns
+    -------
+    roots : ndarray, shape (kA,) or None
+        Roots in ascending order; None if they were not found (e.g. QFF has
+        complex eigenvalues).
+    nprobes : int
+        Number of evaluations of H(s).
+    warm : bool
+        True if roots were found from the guess.
+    """
+
+    eigvals, A = qml.eigs(QFF)
+    if np.iscomplexobj(eigvals):
+        return None, 0, False
+    B = np.einsum('ij,mjk,kl->mil', QAF, A, QFA).reshape(kF, kA * kA)
+    IA = np.eye(kA)
+    nprobes = [0]
+
+    def probe(s, derivative=False):
+        nprobes[0] += 1
+        x = s - eigvals
+        y = x * tres
+        e = np.expm1(-y)
+        c = -e / x
+        if derivative:
+            dc = (tres * x * (e + 1) + e) / (x * x)
+        small = np.abs(y) < 1e-5
+        if small.any():
+            # Series where x (almost) coincides with an eigenvalue of QFF.
+            ys = y[small]
+            c[small] = tres * (1 - ys / 2 + ys * ys / 6)
+            if derivative:
+                dc[small] = tres * tres * (-0.5 + ys / 3 - ys * ys / 8)
+        H = QAA + np.dot(c, B).reshape(kA, kA)
+        if not derivative:
+            return H
+        return s * IA - H, IA - np.dot(dc, B).reshape(kA, kA)
+
+    def count(s):
+        return (nplin.eigvals(probe(s)) <= s).sum()
+
+    def newton(s, counted=False):
+        # Newton step -det W / (d det W / ds) and, if asked for, Ball's
+        # count at s.
+        W, dW = probe(s, True)
+        try:
+            step = -1.0 / np.trace(nplin.solve(W, dW))
+        except nplin.LinAlgError:
+            step = 0.0
+        if counted:
+            return (nplin.eigvals(s * IA - W) <= s).sum(), step
+        return step
+
+    def middle(sa, sb):
+        if sa < 0 and sb < 0:
+            return -sqrt(sa * sb)
+        return (sa + sb) / 2.0
+
+    if guess is not None:
+        roots = np.array(guess, dtype=np.float64).reshape(-1)
+        for i in range(kA):
+            s = roots[i]
+            for it in range(maxiter):
+                step = newton(s)
+                if not np.isfinite(step) or s + step >= 0:
+                    break
+                s += step
+                if abs(step) <= tol * abs(s):
+                    break
+            roots[i] = s
+        roots.sort()
+        if (np.all(np.isfinite(roots)) and np.all(roots < 0) and
+            np.all(np.diff(roots) > tol * np.abs(roots[1:]))):
+            marks = ([2 * roots[0]] + [middle(roots[i], roots[i+1])
+                for i in range(kA - 1)] + [roots[-1] / 2])
+            if all(count(marks[i]) == i for i in range(kA + 1)):
+                return roots, nprobes[0], True
+
+    # Brackets with exactly one root each (Frank Ball's method). For
+    # s * tres << -30 rounding errors of exp(-s * tres) terms swamp the
+    # eigenvalues of H(s), so the search does not start below that.
+    sa, sb = max(-1000000.0, -30.0 / tres), -0.0000001
+    nga, ngb = count(sa), count(sb)
+    while nga > 0 and sa * tres > -60:
+        sa *= 4
+        nga = count(sa)
+    while ngb < kA and sb < -1e-15:
+        sb /= 4
+        ngb = count(sb)
+    done = []
+    todo = [(sa, sb, nga, ngb)]
+    nsplit = 0
+    while todo and nsplit < 1000 * kA:
+        sa, sb, nga, ngb = todo.pop()
+        if ngb - nga == 1:
+            done.append((sa, sb, nga))
+            continue
+        if ngb - nga < 1:
+            continue
+        sc = middle(sa, sb)
+        ngc = count(sc)
+        nsplit += 1
+        todo.append((sa, sc, nga, ngc))
+        todo.append((sc, sb, ngc, ngb))
+    if len(done) != kA:
+        return None, nprobes[0], False
+
+    # Newton iteration within each bracket. The bracket is narrowed using
+    # Ball's count, which unlike the sign of det W(s) changes only at
+    # roots, and bisected whenever a Newton step leaves it.
+    roots = np.empty(kA)
+    for i, (sa, sb, nga) in enumerate(done):
+        s = middle(sa, sb)
+        for it in range(maxiter):
+            ng, step = newton(s, True)
+            if ng == nga:
+                sa = s
+            else:
+                sb = s
+            snew = s + step
+            if not (sa < snew < sb):
+                snew = middle(sa, sb)
+            if abs(snew - s) <= tol * abs(s) or sb - sa <= tol * abs(s):
+                s = snew
+                break
+            s = snew
+        # A final Newton step so that roots change smoothly with the rates
+        # however the loop ended (matters for finite differences).
+        step = newton(s)
+        roots[i] = s + step if sa < s + step < sb else s
+    roots.sort()
+    return roots, nprobes[0], False
+
+def asymptotic_roots_stack(tres, QAA, QFF, QAF, QFA, kA, kF, guess,
+    tol=1e-14, maxiter=100):
+    """
+    Find roots of det W(s) = 0 for a stack of parameter sets at once.
+    Newton iteration as in asymptotic_roots_newton() starts from the guess
+    for all sets together and the roots found are checked by Ball's count.
+    Sets which fail are solved one by one with asymptotic_roots().
 
-#        roots[i] = so.bisect(qml.detW, sro[i,0], sro[i,1],
-#            args=(tres, QAA, QFF, QAF, QFA, kA, kF))
+    Parameters
+    ----------
+    tres : float
+        Time resolution (dead time).
+    QAA, QFF, QAF, QFA : array_like, shapes (n, kA, kA), (n, kF, kF) ...
+        Submatrices of Q.
+    kA, kF : ints
+        Numbers of open and shut states.
+    guess : array_like, shape (n, kA) or (kA,)
+        Approximate roots.
+    tol : float
+        Relative tolerance of roots.
+    maxiter : int
+        Maximum number of Newton steps.
 
+    Returns
+    -------
+    roots : ndarray, shape (n, kA)
+        Roots in ascending order.
+    """
+
+    n = QAA.shape[0]
+    roots = np.array(np.broadcast_to(guess, (n, kA)), dtype=np.float64)
+    eigvals, M = nplin.eig(QFF)
+    ok = ~np.iscomplex(eigvals).any(axis=1)
+    eigvals = eigvals.real
+    A = np.einsum('nim,nmj->nmij', M, nplin.inv(M)).real
+    B = np.einsum('nij,nmjk,nkl->nmil', QAF, A, QFA).reshape(n, kF, kA * kA)
+    IA = np.eye(kA)
+    nprobes = [0]
+
+    def probe(s, derivative=False):
+        # H(s) (and W(s), W'(s)) for s of shape (n, m); see
+        # asymptotic_roots_newton().
+        nprobes[0] += s.size
+        x = s[:, :, np.newaxis] - eigvals[:, np.newaxis, :]
+        y = x * tres
+        with np.errstate(divide='ignore', invalid='ignore'):
+            e = np.expm1(-y)
+            c = -e / x
+            dc = (tres * x * (e + 1) + e) / (x * x)
+        small = np.abs(y) < 1e-5
+        ys = y[small]
+        c[small] = tres * (1 - ys / 2 + ys * ys / 6)
+        dc[small] = tres * tres * (-0.5 + ys / 3 - ys * ys / 8)
+        H = QAA[:, np.newaxis] + np.matmul(c, B).reshape(s.shape +
+            (kA, kA))
+        if not derivative:
+            return H
+        return (s[:, :, np.newaxis, np.newaxis] * IA - H,
+            IA - np.matmul(dc, B).reshape(s.shape + (kA, kA)))
+
+    def trace_solve(W, dW):
+        try:
+            return np.trace(nplin.solve(W, dW), axis1=-2, axis2=-1)
+        except nplin.LinAlgError:
+            # W(s) singular (s is a root to working precision) for some.
+            tr = np.empty(W.shape[:-2])
+            for i in np.ndindex(tr.shape):
+                try:
+                    tr[i] = np.trace(nplin.solve(W[i], dW[i]))
+                except nplin.LinAlgError:
+                    tr[i] = np.inf
+            return tr
+
+    active = np.ones((n, kA), dtype=bool)
+    converged = np.zeros((n, kA), dtype=bool)
+    for it in range(maxiter):
+        if not active.any():
+            break
+        W, dW = probe(roots, True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = -1.0 / trace_solve(W, dW)
+        stop = ~np.isfinite(step) | (roots + step >= 0)
+        move = active & ~stop
+        roots[move] += step[move]
+        done = active & (np.abs(step) <= tol * np.abs(roots))
+        converged |= done
+        active &= move & ~done
+    roots.sort(axis=1)
+
+    # Accept converged roots only if they are different roots (Ball's
+    # count).
+    ok &= np.all(converged, axis=1)
+    ok &= (np.all(np.isfinite(roots), axis=1) & np.all(roots < 0, axis=1) &
+        np.all(np.diff(roots, axis=1) > tol * np.abs(roots[:, 1:]), axis=1))
+    marks = np.concatenate((2 * roots[:, :1], (roots[:, :-1] +
+        roots[:, 1:]) / 2, roots[:, -1:] / 2), axis=1)
+    both = (roots[:, :-1] < 0) & (roots[:, 1:] < 0)
+    marks[:, 1:-1][both] = -np.sqrt(roots[:, :-1] * roots[:, 1:])[both]
+    with np.errstate(invalid='ignore'):
+        H = probe(np.where(ok[:, np.newaxis], marks, -1.0))
+        counts = (nplin.eigvals(H) <= marks[:, :, np.newaxis]).sum(axis=2)
+    ok &= np.all(counts == np.arange(kA + 1), axis=1)
+
+    _root_stats['calls'] += int(ok.sum())
+    _root_stats['warm'] += int(ok.sum())
+    _root_stats['probes'] += nprobes[0]
+    for i in np.flatnonzero(~ok):
+        roots[i] = asymptotic_roots(tres, QAA[i], QFF[i], QAF[i], QFA[i],
+            kA, kF, guess=None)
     return roots
 
 def bisect_gFB(s, tres, Q11, Q22, Q12, Q21, k1, k2):
@@ -475,7 +803,7 @@ def exact_pdf(t, tres, roots, areas, eigvals, gamma00, gamma10, gamma11):
 
     Parameters
     ----------
-    t : float
+    t : float or array_like, shape (n,)
         Time.
     tres : float
         Time resolution (dead time).
@@ -488,8 +816,21 @@ def exact_pdf(t, tres, roots, areas, eigvals, gamma00, gamma10, gamma11):
 
     Returns
     -------
-    f : float
-    """
+    f : float or ndarray, shape (n,)
+    """
+
+    if np.ndim(t) > 0:
+        # Same regions as for scalar t below, evaluated with masks.
+        t = np.asarray(t, dtype=np.float64)
+        f = np.zeros(t.shape)
+        ex1 = (tres < t) & (t < (2 * tres))
+        ex2 = ((tres * 2) < t) & (t < (3 * tres))
+        asy = (t >= tres) & ~ex1 & ~ex2
+        f[ex1] = qml.f0(t[ex1] - tres, eigvals, gamma00)
+        f[ex2] = (qml.f0(t[ex2] - tres, eigvals, gamma00) -
+            qml.f1(t[ex2] - 2 * tres, eigvals, gamma10, gamma11))
+        f[asy] = pdfs.expPDF(t[asy] - tres, -1 / roots, areas)
+        return f
 
     if t < tres:
         f = 0
@@ -547,6 +888,58 @@ def exact_mean_open_shut_time(mec, tres):
 
     return meanA, meanF
 
+def exact_mean_open_shut_time_stack(Q, kA, kF, tres):
+    """
+    Calculate exact mean open and shut times from HJC probability density
+    functions for a stack of Q matrices (e.g. one per concentration). This
+    is a batched version of exact_mean_open_shut_time().
+
+    Parameters
+    ----------
+    Q : array_like, shape (n, k, k)
+        Q matrices.
+    kA : int
+        A number of open states in kinetic scheme.
+    kF : int
+        A number of shut states in kinetic scheme.
+    tres : float
+        Time resolution (dead time).
+
+    Returns
+    -------
+    meanA, meanF : ndarrays, shape (n,)
+        Apparent mean open and shut times.
+    """
+
+    Q = np.asarray(Q)
+    kG = kA + kF
+    QAA, QAF = Q[:, :kA, :kA], Q[:, :kA, kA:kG]
+    QFA, QFF = Q[:, kA:kG, :kA], Q[:, kA:kG, kA:kG]
+    invQAA, invQFF = nplin.inv(QAA), nplin.inv(QFF)
+    GAF, GFA = -np.matmul(invQAA, QAF), -np.matmul(invQFF, QFA)
+    expQAA, expQFF = qml.expQ_stack(QAA, tres), qml.expQ_stack(QFF, tres)
+
+    def mean(invQAA, invQFF, GAF, GFA, QAF, expQFF, phi, kA, kF):
+        # Batched equivalent of qml.dARSdS().
+        IA = np.eye(kA)
+        SFF = np.eye(kF) - expQFF
+        GSG = np.matmul(np.matmul(GAF, SFF), GFA)
+        Q1 = (tres * np.matmul(GAF, np.matmul(expQFF, GFA)) -
+            np.matmul(GAF, np.matmul(SFF, np.matmul(invQFF, GFA))) -
+            np.matmul(invQAA, GSG))
+        invVA = nplin.inv(IA - GSG)
+        DARS = np.matmul(np.matmul(invVA, invQAA - np.matmul(Q1, invVA)),
+            invQAA)
+        v = np.sum(np.matmul(np.matmul(DARS, QAF), expQFF), axis=2)
+        return tres + np.sum(phi * v, axis=1)
+
+    eGAF = qml.eGs_stack(GAF, GFA, expQFF)
+    eGFA = qml.eGs_stack(GFA, GAF, expQAA)
+    phiA, phiF = qml.phiHJC_stack(eGAF, eGFA), qml.phiHJC_stack(eGFA, eGAF)
+    meanA = mean(invQAA, invQFF, GAF, GFA, QAF, expQFF, phiA, kA, kF)
+    meanF = mean(invQFF, invQAA, GFA, GAF, QFA, expQAA, phiF, kF, kA)
+    return meanA, meanF
+
 
 def exact_mean_time(tres, QAA, QFF, QAF, kA, kF, GAF, GFA):
     """
@@ -638,11 +1031,45 @@ def likelihood(theta, opts):
     """
     Calculate likelihood for a series of open and shut times using ideal
     probability density functions.
+
+    Lik = phiA * GAF(t1) * GFA(t2) * GAF(t3) * ... * GAF(tn) * uF
+
+    QAA and QFF are decomposed once per call; GAF(t) and GFA(t) of all
+    openings and shuttings are calculated as stacks (qmatlib.iGt_stack())
+    and burst products are evaluated as a batched matrix-chain reduction
+    (see burst_chain_loglik()).
+
+    Parameters
+    ----------
+    theta : array_like
+        Guesses.
+    opts : dictionary
+        opts['mec'] : instance of type Mechanism
+        opts['conc'] : float
+            Concentration.
+        opts['data'] : dictionary
+            A dictionary containing lists of open and shut intervals. May
+            also be a tuple (intervals, offsets) as returned by
+            pack_bursts().
+        opts['normstep'] : int, optional
+            Not used; kept for compatibility with HJClik(). Burst products
+            are always rescaled during reduction.
+
+    Returns
+    -------
+    loglik : float
+        Log-likelihood.
+    newrates : array_like
+        Updated rates/guesses.
     """
 
     mec = opts['mec']
     conc = opts['conc']
     bursts = opts['data']
+    if isinstance(bursts, tuple):
+        intervals, offsets = bursts
+    else:
+        intervals, offsets = pack_bursts(bursts)
 
     #mec.set_rateconstants(np.exp(theta))
     mec.theta_unsqueeze(np.exp(theta))
@@ -651,26 +1078,203 @@ def likelihood(theta, opts):
     startB = qml.phiA(mec)
     endB = np.ones((mec.kF, 1))
 
-    loglik = 0
-    for ind in bursts:
-        burst = bursts[ind]
-        grouplik = startB
-        for i in range(len(burst)):
-            t = burst[i]
-            if i % 2 == 0: # open time
-                GAFt = qml.iGt(t, mec.QAA, mec.QAF)
-            else: # shut
-                GAFt = qml.iGt(t, mec.QFF, mec.QFA)
-            grouplik = np.dot(grouplik, GAFt)
-            if grouplik.max() > 1e50:
-                grouplik = grouplik * 1e-100
-                print ('grouplik was scaled down')
-        grouplik = np.dot(grouplik, endB)
-        loglik += log(grouplik[0])
+    lengths = np.diff(offsets)
+    if np.any(lengths % 2 == 0):
+        raise RuntimeError("likelihood: Each burst has to start and end " +
+            "with an opening.")
+    pos = np.arange(intervals.shape[0]) - np.repeat(offsets[:-1], lengths)
+    isopen = pos % 2 == 0
+    islast = np.zeros(intervals.shape[0], dtype=bool)
+    islast[offsets[1:] - 1] = True
+    lastopen = islast[isopen]
+
+    GAFt = qml.iGt_stack(intervals[isopen], mec.QAA, mec.QAF)
+    GFAt = qml.iGt_stack(intervals[~isopen], mec.QFF, mec.QFA)
+    lastA = np.dot(GAFt[lastopen], endB)[:, :, 0]
+    pairs = np.matmul(GAFt[~lastopen], GFAt)
+    logliks = burst_chain_loglik(startB.reshape(-1), pairs, lengths // 2,
+        lastA)
+    if np.isnan(logliks).any():
+        raise RuntimeError("likelihood: Likelihood of a burst is not " +
+            "positive.")
+    loglik = np.sum(logliks)
 
     newrates = np.log(mec.theta())
     return -loglik, newrates
 
+def burst_vector_scale(grouplik, i, normstep=0):
+    """
+    Scale burst likelihood row vector to avoid overflow.
+
+    If normstep > 0 the vector is normalised to unit sum after every normstep
+    intervals. Otherwise it is scaled down by 1e-100 when its largest element
+    exceeds 1e50.
+
+    Parameters
+    ----------
+    grouplik : ndarray
+        Burst likelihood row vector after interval i.
+    i : int
+        Index of interval within burst.
+    normstep : int
+        Number of intervals between normalisations.
+
+    Returns
+    -------
+    grouplik : ndarray
+        Scaled vector.
+    logscale : float
+        Log of the factor the vector was divided by.
+    """
+
+    if normstep:
+        if (i + 1) % normstep == 0:
+            norm = np.sum(grouplik)
+            if norm > 0:
+                return grouplik / norm, log(norm)
+    elif grouplik.max() > 1e50:
+        return grouplik * 1e-100, 100 * log(10)
+    return grouplik, 0.0
+
+def HJC_lik_components(mec, tres, tcrit, is_chsvec, roots=None, guess=None):
+    """
+    Calculate the parameter dependent quantities needed to evaluate HJC
+    likelihood: initial and final vectors and the constants of the exact and
+    asymptotic eGAF(t) and eGFA(t).
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism with rates and concentration already set.
+    tres : float
+        Time resolution (dead time).
+    tcrit : float
+        Critical time interval.
+    is_chsvec : bool
+        True if CHS vectors should be used (Eq. 5.7, CHS96).
+    roots : tuple of ndarrays, optional
+        Roots (Aroots, Froots) of the asymptotic pdfs if already known.
+    guess : tuple of ndarrays, optional
+        Approximate roots (Aroots, Froots) to start root search from, e.g.
+        roots for the previous parameters during fitting.
+
+    Returns
+    -------
+    startB : ndarray, shape (kA,)
+        Initial vector.
+    endB : ndarray, shape (kF, 1)
+        Final vector.
+    Apars, Fpars : tuples
+        Arguments (eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF) of
+        qmatlib.eGAF() for open and shut intervals respectively.
+    """
+
+    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kF)
+    expQFF = qml.expQt(mec.QFF, tres)
+    expQAA = qml.expQt(mec.QAA, tres)
+    eGAF = qml.eGs(GAF, GFA, mec.kA, mec.kF, expQFF)
+    eGFA = qml.eGs(GFA, GAF, mec.kF, mec.kA, expQAA)
+    phiF = qml.phiHJC(eGFA, eGAF, mec.kF)
+    startB = qml.phiHJC(eGAF, eGFA, mec.kA)
+    endB = np.ones((mec.kF, 1))
+
+    eigen, A = qml.eigs(-mec.Q)
+    Aeigvals, AZ00, AZ10, AZ11 = qml.Zxx(mec.Q, eigen, A, mec.kA, mec.QFF,
+        mec.QAF, mec.QFA, expQFF, True)
+    Feigvals, FZ00, FZ10, FZ11 = qml.Zxx(mec.Q, eigen, A, mec.kA, mec.QAA,
+        mec.QFA, mec.QAF, expQAA, False)
+    if roots is None:
+        Aguess, Fguess = (None, None) if guess is None else guess
+        Aroots = asymptotic_roots(tres,
+            mec.QAA, mec.QFF, mec.QAF, mec.QFA, mec.kA, mec.kF, Aguess)
+        Froots = asymptotic_roots(tres,
+            mec.QFF, mec.QAA, mec.QFA, mec.QAF, mec.kF, mec.kA, Fguess)
+    else:
+        Aroots, Froots = roots
+    AR = qml.AR(Aroots, tres, mec.QAA, mec.QFF, mec.QAF, mec.QFA, mec.kA, mec.kF)
+    FR = qml.AR(Froots, tres, mec.QFF, mec.QAA, mec.QFA, mec.QAF, mec.kF, mec.kA)
+
+    if is_chsvec:
+        startB, endB = qml.CHSvec(Froots, tres, tcrit,
+            mec.QFA, mec.kA, expQAA, phiF, FR)
+
+    Apars = (Aeigvals, AZ00, AZ10, AZ11, Aroots, AR, mec.QAF.copy(), expQFF)
+    Fpars = (Feigvals, FZ00, FZ10, FZ11, Froots, FR, mec.QFA.copy(), expQAA)
+    return startB, endB, Apars, Fpars
+
+def HJC_lik_components_stack(Q, kA, kF, tres, tcrit, is_chsvec,
+    guess=None):
+    """
+    Batched version of HJC_lik_components() for a stack of Q matrices, e.g.
+    one per parameter set of a population. All quantities are calculated
+    for the whole stack at once; asymptotic roots are found by
+    asymptotic_roots_stack().
+
+    Parameters
+    ----------
+    Q : array_like, shape (P, k, k)
+        Q matrices with rates and concentration set.
+    kA, kF : ints
+        Numbers of open and shut states.
+    tres : float
+        Time resolution (dead time).
+    tcrit : float
+        Critical time interval.
+    is_chsvec : bool
+        True if CHS vectors should be used (Eq. 5.7, CHS96).
+    guess : tuple of ndarrays, optional
+        Approximate roots (Aroots, Froots), shapes (kA,) and (kF,) or
+        (P, kA) and (P, kF).
+
+    Returns
+    -------
+    startB : ndarray, shape (P, kA)
+        Initial vectors.
+    endB : ndarray, shape (P, kF, 1)
+        Final vectors.
+    Apars, Fpars : tuples
+        As returned by HJC_lik_components() with a leading axis of length P
+        on each item.
+    """
+
+    Q = np.asarray(Q)
+    P, kG = Q.shape[0], kA + kF
+    QAA, QAF = Q[:, :kA, :kA], Q[:, :kA, kA:kG]
+    QFA, QFF = Q[:, kA:kG, :kA], Q[:, kA:kG, kA:kG]
+    GAF = -np.matmul(nplin.inv(QAA), QAF)
+    GFA = -np.matmul(nplin.inv(QFF), QFA)
+    expQFF, expQAA = qml.expQ_stack(QFF, tres), qml.expQ_stack(QAA, tres)
+    eGAF = qml.eGs_stack(GAF, GFA, expQFF)
+    eGFA = qml.eGs_stack(GFA, GAF, expQAA)
+    phiF = qml.phiHJC_stack(eGFA, eGAF)
+    startB = qml.phiHJC_stack(eGAF, eGFA)
+    endB = np.ones((P, kF, 1))
+
+    eigen, A = qml.eigs_stack(-Q)
+    Aeigvals, AZ00, AZ10, AZ11 = qml.Zxx_stack(eigen, A, kA, QAF, QFA,
+        expQFF, True)
+    Feigvals, FZ00, FZ10, FZ11 = qml.Zxx_stack(eigen, A, kA, QFA, QAF,
+        expQAA, False)
+    if guess is None:
+        Aroots = np.array([asymptotic_roots(tres, QAA[0], QFF[0], QAF[0],
+            QFA[0], kA, kF)])
+        Froots = np.array([asymptotic_roots(tres, QFF[0], QAA[0], QFA[0],
+            QAF[0], kF, kA)])
+    else:
+        Aroots, Froots = guess
+    Aroots = asymptotic_roots_stack(tres, QAA, QFF, QAF, QFA, kA, kF, Aroots)
+    Froots = asymptotic_roots_stack(tres, QFF, QAA, QFA, QAF, kF, kA, Froots)
+    AR = qml.AR_stack(Aroots, tres, QAA, QFF, QAF, QFA, expQFF)
+    FR = qml.AR_stack(Froots, tres, QFF, QAA, QFA, QAF, expQAA)
+
+    if is_chsvec:
+        startB, endB = qml.CHSvec_stack(Froots, tres, tcrit, QFA, expQAA,
+            phiF, FR)
+
+    Apars = (Aeigvals, AZ00, AZ10, AZ11, Aroots, AR, QAF.copy(), expQFF)
+    Fpars = (Feigvals, FZ00, FZ10, FZ11, Froots, FR, QFA.copy(), expQAA)
+    return startB, endB, Apars, Fpars
+
 def HJClik(theta, opts):
     """
     Calculate likelihood for a series of open and shut times using HJC missed
@@ -703,6 +1307,11 @@ def HJClik(theta, opts):
             Ctritical time interval.
         opts['isCHS'] : bool
             True if CHS vectors should be used (Eq. 5.7, CHS96).
+        opts['normstep'] : int, optional
+            If given, burst vector is normalised to unit sum after every
+            normstep intervals and log of normaliser is added to
+            log-likelihood. Otherwise vector is scaled by 1e-100 whenever its
+            largest element exceeds 1e50 (checked after every interval).
 
     Returns
     -------
@@ -719,39 +1328,20 @@ def HJClik(theta, opts):
     tcrit = opts['tcrit']
     is_chsvec = opts['isCHS']
     bursts = opts['data']
+    normstep = opts.get('normstep', 0)
 
     mec.theta_unsqueeze(np.exp(theta))
     mec.set_eff('c', conc)
 
-    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kF)
-    expQFF = qml.expQt(mec.QFF, tres)
-    expQAA = qml.expQt(mec.QAA, tres)
-    eGAF = qml.eGs(GAF, GFA, mec.kA, mec.kF, expQFF)
-    eGFA = qml.eGs(GFA, GAF, mec.kF, mec.kA, expQAA)
-    phiF = qml.phiHJC(eGFA, eGAF, mec.kF)
-    startB = qml.phiHJC(eGAF, eGFA, mec.kA)
-    endB = np.ones((mec.kF, 1))
-
-    eigen, A = qml.eigs(-mec.Q)
-    Aeigvals, AZ00, AZ10, AZ11 = qml.Zxx(mec.Q, eigen, A, mec.kA, mec.QFF,
-        mec.QAF, mec.QFA, expQFF, True)
-    Aroots = asymptotic_roots(tres,
-        mec.QAA, mec.QFF, mec.QAF, mec.QFA, mec.kA, mec.kF)
-    AR = qml.AR(Aroots, tres, mec.QAA, mec.QFF, mec.QAF, mec.QFA, mec.kA, mec.kF)
-    Feigvals, FZ00, FZ10, FZ11 = qml.Zxx(mec.Q, eigen, A, mec.kA, mec.QAA,
-        mec.QFA, mec.QAF, expQAA, False)
-    Froots = asymptotic_roots(tres,
-        mec.QFF, mec.QAA, mec.QFA, mec.QAF, mec.kF, mec.kA)
-    FR = qml.AR(Froots, tres, mec.QFF, mec.QAA, mec.QFA, mec.QAF, mec.kF, mec.kA)
-
-    if is_chsvec:
-        startB, endB = qml.CHSvec(Froots, tres, tcrit,
-            mec.QFA, mec.kA, expQAA, phiF, FR)
+    startB, endB, Apars, Fpars = HJC_lik_components(mec, tres, tcrit, is_chsvec)
+    Aeigvals, AZ00, AZ10, AZ11, Aroots, AR, QAF, expQFF = Apars
+    Feigvals, FZ00, FZ10, FZ11, Froots, FR, QFA, expQAA = Fpars
 
     loglik = 0
     for ind in range(len(bursts)):
         burst = bursts[ind]
         grouplik = startB
+        logscale = 0
         for i in range(len(burst)):
             t = burst[i]
             if i % 2 == 0: # open time
@@ -761,12 +1351,11 @@ def HJClik(theta, opts):
                 eGAFt = qml.eGAF(t, tres, Feigvals, FZ00, FZ10, FZ11, Froots,
                 FR, mec.QFA, expQAA)
             grouplik = np.dot(grouplik, eGAFt)
-            if grouplik.max() > 1e50:
-                grouplik = grouplik * 1e-100
-                #print 'grouplik was scaled down'
+            grouplik, scale = burst_vector_scale(grouplik, i, normstep)
+            logscale += scale
         grouplik = np.dot(grouplik, endB)
         try:
-            loglik += log(grouplik[0])
+            loglik += log(grouplik[0]) + logscale
         except:
             print ('HJClik: Warning: likelihood has been set to 0')
             print ('likelihood=', grouplik[0])
@@ -777,6 +1366,927 @@ def HJClik(theta, opts):
     newrates = np.log(mec.theta())
     return -loglik, newrates
 
+def pack_bursts(bursts):
+    """
+    Pack bursts into one contiguous array of intervals.
+
+    Parameters
+    ----------
+    bursts : dictionary or list
+        Lists of open and shut intervals; each burst starts and ends with
+        an opening.
+
+    Returns
+    -------
+    intervals : ndarray, shape (n,)
+        All intervals, burst after burst.
+    offsets : ndarray, shape (nbursts + 1,)
+        Burst i occupies intervals[offsets[i] : offsets[i+1]].
+    """
+
+    if isinstance(bursts, dict):
+        bursts = [bursts[ind] for ind in range(len(bursts))]
+    lengths = np.array([len(burst) for burst in bursts], dtype=np.intp)
+    offsets = np.zeros(lengths.shape[0] + 1, dtype=np.intp)
+    np.cumsum(lengths, out=offsets[1:])
+    if lengths.shape[0]:
+        intervals = np.concatenate([np.asarray(burst, dtype=np.float64)
+            for burst in bursts])
+    else:
+        intervals = np.zeros(0)
+    return intervals, offsets
+
+def burst_chain_plan(npairs):
+    """
+    Prepare gather indices for burst_chain_loglik(). Bursts are bucketed by
+    the number of open-shut pairs (powers of two) and each bucket is padded
+    to the length of its longest burst.
+
+    Parameters
+    ----------
+    npairs : array_like of ints, shape (nbursts,)
+        Number of open-shut pairs in each burst.
+
+    Returns
+    -------
+    plan : list of tuples
+        (ind, gather, used) for each bucket: burst indices, indices into the
+        array of pair matrices and mask of used (not padded) positions.
+    """
+
+    npairs = np.asarray(npairs, dtype=np.intp)
+    nb = npairs.shape[0]
+    starts = np.zeros(nb, dtype=np.intp)
+    np.cumsum(npairs[:-1], out=starts[1:])
+
+    bucket = np.zeros(nb, dtype=np.intp)
+    many = npairs > 1
+    bucket[many] = np.ceil(np.log2(npairs[many])).astype(np.intp) + 1
+    bucket[npairs == 1] = 1
+    plan = []
+    for b in np.unique(bucket):
+        ind = np.nonzero(bucket == b)[0]
+        if b == 0:
+            plan.append((ind, None, None))
+        else:
+            pos = np.arange(npairs[ind].max())
+            used = pos < npairs[ind, np.newaxis]
+            gather = np.where(used, starts[ind, np.newaxis] + pos, 0)
+            plan.append((ind, gather, used))
+    return plan
+
+def burst_chain_loglik(startB, pairs, npairs, lastA, plan=None):
+    """
+    Calculate log-likelihood of each burst as a batched matrix-chain
+    reduction:
+        lik = startB * X(1) * X(2) * ... * X(m) * lastA
+    where X(i) = eGAF(open i) * eGFA(shut i) and lastA = eGAF(last open) * endB.
+
+    Padded pair matrices are multiplied pairwise in log2(m) batched steps.
+    After each step every matrix is divided by its largest element and the
+    log of that factor is added to the burst log-likelihood, so long bursts
+    do not overflow.
+
+    Parameters
+    ----------
+    startB : array_like, shape (kA,) or (nbursts, kA)
+        Initial vector, or one initial vector per burst.
+    pairs : array_like, shape (sum(npairs), kA, kA)
+        Open-shut pair matrices of all bursts, burst after burst.
+    npairs : array_like of ints, shape (nbursts,)
+        Number of open-shut pairs in each burst.
+    lastA : array_like, shape (nbursts, kA)
+        eGAF(t) * endB for the last opening of each burst.
+    plan : list, optional
+        Output of burst_chain_plan(npairs).
+
+    Returns
+    -------
+    loglik : ndarray, shape (nbursts,)
+        Log-likelihood of each burst (nan if likelihood is not positive).
+    """
+
+    if plan is None:
+        plan = burst_chain_plan(npairs)
+    kA = lastA.shape[1]
+    loglik = np.empty(lastA.shape[0])
+    I = np.eye(kA)
+
+    for ind, gather, used in plan:
+        logscale = np.zeros(ind.shape[0])
+        start = startB[ind] if np.ndim(startB) > 1 else startB
+        if gather is None:
+            lik = np.sum(lastA[ind] * start, axis=-1)
+        else:
+            X = pairs[gather]
+            X[~used] = I
+            while X.shape[1] > 1:
+                if X.shape[1] % 2:
+                    X = np.concatenate((X, np.broadcast_to(I,
+                        (X.shape[0], 1, kA, kA))), axis=1)
+                X = np.matmul(X[:, 0::2], X[:, 1::2])
+                scale = np.abs(X).max(axis=(2, 3))
+                scale[scale == 0] = 1.0
+                X /= scale[:, :, np.newaxis, np.newaxis]
+                logscale += np.log(scale).sum(axis=1)
+            row = np.einsum('...i,...ij->...j', start, X[:, 0])
+            lik = np.einsum('bj,bj->b', row, lastA[ind])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            loglik[ind] = np.where(lik > 0, np.log(lik), np.nan) + logscale
+    return loglik
+
+def HJC_record_plan(intervals, offsets, tres):
+    """
+    Prepare packed bursts for HJC_record_loglik(): split intervals into
+    openings and shuttings, sort them into exact and asymptotic regions and
+    bucket bursts for the burst product reduction.
+
+    Parameters
+    ----------
+    intervals, offsets : ndarrays
+        Packed bursts as returned by pack_bursts().
+    tres : float
+        Time resolution (dead time).
+
+    Returns
+    -------
+    record : tuple
+        (lastopen, npairs, Aregions, Fregions, plan).
+    """
+
+    lengths = np.diff(offsets)
+    if np.any(lengths % 2 == 0):
+        raise RuntimeError("HJClik: Each burst has to start and end " +
+            "with an opening.")
+    pos = np.arange(intervals.shape[0]) - np.repeat(offsets[:-1], lengths)
+    isopen = pos % 2 == 0
+    islast = np.zeros(intervals.shape[0], dtype=bool)
+    islast[offsets[1:] - 1] = True
+    npairs = lengths // 2
+    return (islast[isopen], npairs,
+        qml.eGAF_regions(intervals[isopen], tres),
+        qml.eGAF_regions(intervals[~isopen], tres),
+        burst_chain_plan(npairs))
+
+def HJC_record_loglik(record, startB, endB, Apars, Fpars):
+    """
+    Calculate log-likelihood of each burst of a prepared record.
+
+    Parameters
+    ----------
+    record : tuple
+        Output of HJC_record_plan().
+    startB, endB, Apars, Fpars :
+        Output of HJC_lik_components().
+
+    Returns
+    -------
+    logliks : ndarray, shape (nbursts,)
+        Log-likelihoods of bursts (nan if likelihood is not positive).
+    """
+
+    lastopen, npairs, Aregions, Fregions, plan = record
+    eGAFt = qml.eGAF_stack(None, None, *Apars, regions=Aregions)
+    eGFAt = qml.eGAF_stack(None, None, *Fpars, regions=Fregions)
+    lastA = np.dot(eGAFt[lastopen], endB)[:, :, 0]
+    pairs = np.matmul(eGAFt[~lastopen], eGFAt)
+    return burst_chain_loglik(startB, pairs, npairs, lastA, plan)
+
+def HJC_record_loglik_stack(record, startB, endB, Apars, Fpars,
+    plan=None):
+    """
+    Calculate log-likelihood of each burst of a prepared record for a
+    population of parameter sets. eGAF(t) of all intervals and parameter
+    sets are calculated in one call (qmatlib.eGAF_population()) and burst
+    products of the whole population are reduced together.
+
+    Parameters
+    ----------
+    record : tuple
+        Output of HJC_record_plan().
+    startB, endB, Apars, Fpars :
+        Output of HJC_lik_components_stack().
+    plan : list, optional
+        burst_chain_plan() for the number of pairs of all bursts repeated
+        for each parameter set.
+
+    Returns
+    -------
+    logliks : ndarray, shape (P, nbursts)
+        Log-likelihoods of bursts (nan if likelihood is not positive).
+    """
+
+    lastopen, npairs, Aregions, Fregions, plan1 = record
+    P, nb = startB.shape[0], npairs.shape[0]
+    kA = startB.shape[1]
+    eGAFt = qml.eGAF_population(Aregions, *Apars)
+    eGFAt = qml.eGAF_population(Fregions, *Fpars)
+    lastA = np.matmul(eGAFt[:, lastopen], endB[:, np.newaxis])[..., 0]
+    pairs = np.matmul(eGAFt[:, ~lastopen], eGFAt)
+    if plan is None:
+        plan = burst_chain_plan(np.tile(npairs, P))
+    logliks = burst_chain_loglik(np.repeat(startB, nb, axis=0),
+        pairs.reshape(-1, kA, kA), np.tile(npairs, P),
+        lastA.reshape(P * nb, kA), plan)
+    return logliks.reshape(P, nb)
+
+def eGAF_coefficients(pars):
+    """
+    Constants eGAF(t) is built from, as differentiated by
+    HJC_lik_components_fd_derivatives(). Components are ordered by eigenvalue
+    so that they can be compared between nearby parameter values.
+
+    Parameters
+    ----------
+    pars : tuple
+        Apars or Fpars as returned by HJC_lik_components().
+
+    Returns
+    -------
+    coefs : tuple
+        (eigvals, Z00, Z10, Z11, roots, RQ) where RQ = R * QAF * expQFF.
+    """
+
+    eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF = pars
+    order = np.argsort(eigvals)
+    return (eigvals[order], Z00[order], Z10[order], Z11[order], roots,
+        np.dot(np.dot(R, QAF), expQFF))
+
+def burst_pass_plan(offsets):
+    """
+    Prepare packed bursts for the forward and backward vector passes of
+    HJC_record_loglik_gradient(). Bursts are ordered by decreasing length
+    so that bursts still running at any position form a leading block.
+
+    Parameters
+    ----------
+    offsets : ndarray, shape (nbursts + 1,)
+        Burst offsets as returned by pack_bursts().
+
+    Returns
+    -------
+    passplan : tuple
+        (order, counts, ostart, sstart): burst order, number of bursts
+        longer than each position and index of the first opening and
+        shutting of each (ordered) burst in the opening and shutting
+        arrays.
+    """
+
+    lengths = np.diff(offsets)
+    order = np.argsort(-lengths, kind='stable')
+    nmax = lengths.max() if lengths.shape[0] else 0
+    counts = lengths.shape[0] - np.cumsum(np.bincount(lengths,
+        minlength=nmax + 1))[:nmax]
+    ostart = np.concatenate(([0], np.cumsum((lengths + 1) // 2)[:-1]))
+    sstart = np.concatenate(([0], np.cumsum(lengths // 2)[:-1]))
+    return order, counts, ostart[order], sstart[order]
+
+def HJC_record_loglik_gradient(record, passplan, startB, endB, Apars, Fpars):
+    """
+    Calculate log-likelihood of each burst of a prepared record together
+    with the gradient of the total log-likelihood with respect to the
+    initial and final vectors and eGAF(t) constants.
+
+    For each burst one forward (startB * eGAF(t1) * eGFA(t2) ...) and one
+    backward (... eGFA(tn-1) * eGAF(tn) * endB) pass of normalised vectors
+    gives the derivative of the burst log-likelihood with respect to the
+    matrix of every interval, which is then back-propagated to the
+    constants by qml.eGAF_stack_gradient().
+
+    Parameters
+    ----------
+    record : tuple
+        Output of HJC_record_plan().
+    passplan : tuple
+        Output of burst_pass_plan().
+    startB, endB, Apars, Fpars :
+        Output of HJC_lik_components().
+
+    Returns
+    -------
+    logliks : ndarray, shape (nbursts,)
+        Log-likelihoods of bursts (nan if likelihood is not positive).
+    grads : tuple
+        Gradients with respect to startB, endB and the eGAF_coefficients()
+        of Apars and Fpars.
+    """
+
+    lastopen, npairs, Aregions, Fregions, plan = record
+    order, counts, ostart, sstart = passplan
+    eGAFt = qml.eGAF_stack(None, None, *Apars, regions=Aregions)
+    eGFAt = qml.eGAF_stack(None, None, *Fpars, regions=Fregions)
+    start = startB.reshape(-1)
+    end = endB.reshape(-1)
+    kA, kF = start.shape[0], end.shape[0]
+    nb = order.shape[0]
+    Aprev, Anext = np.empty((eGAFt.shape[0], kA)), np.empty((eGAFt.shape[0], kF))
+    Fprev, Fnext = np.empty((eGFAt.shape[0], kF)), np.empty((eGFAt.shape[0], kA))
+    vecA, vecF = np.tile(start, (nb, 1)), np.empty((nb, kF))
+    final = np.empty((nb, kF))
+    logscale = np.zeros(nb)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Forward pass: normalised startB * eGAF(t1) * eGFA(t2) * ...
+        for pos, c in enumerate(counts):
+            if pos % 2 == 0:
+                ind = ostart[:c] + pos // 2
+                Aprev[ind] = vecA[:c]
+                vec = np.einsum('bi,bij->bj', vecA[:c], eGAFt[ind])
+                scale = np.sum(vec, axis=1)
+                vecF[:c] = vec / scale[:, np.newaxis]
+                cnext = counts[pos + 1] if pos + 1 < counts.shape[0] else 0
+                final[cnext:c] = vecF[cnext:c]
+            else:
+                ind = sstart[:c] + pos // 2
+                Fprev[ind] = vecF[:c]
+                vec = np.einsum('bi,bij->bj', vecF[:c], eGFAt[ind])
+                scale = np.sum(vec, axis=1)
+                vecA[:c] = vec / scale[:, np.newaxis]
+            logscale[:c] += np.log(scale)
+        lik = np.dot(final, end)
+        logliks = np.empty(nb)
+        logliks[order] = logscale + np.log(lik)
+
+        # Backward pass: normalised ... * eGFA(tn-1) * eGAF(tn) * endB
+        vecA, vecF = np.empty((nb, kA)), np.tile(end, (nb, 1))
+        for pos in range(counts.shape[0] - 1, -1, -1):
+            c = counts[pos]
+            if pos % 2 == 0:
+                ind = ostart[:c] + pos // 2
+                Anext[ind] = vecF[:c]
+                vec = np.einsum('bij,bj->bi', eGAFt[ind], vecF[:c])
+                vecA[:c] = vec / np.sum(vec, axis=1)[:, np.newaxis]
+            else:
+                ind = sstart[:c] + pos // 2
+                Fnext[ind] = vecA[:c]
+                vec = np.einsum('bij,bj->bi', eGFAt[ind], vecA[:c])
+                vecF[:c] = vec / np.sum(vec, axis=1)[:, np.newaxis]
+
+        # d log(prev * M * next) / dM = prev' * next' / (prev * M * next)
+        GA = (Aprev[:, :, np.newaxis] * Anext[:, np.newaxis, :] /
+            np.einsum('ni,nij,nj->n', Aprev, eGAFt, Anext)[:, np.newaxis,
+            np.newaxis])
+        GF = (Fprev[:, :, np.newaxis] * Fnext[:, np.newaxis, :] /
+            np.einsum('ni,nij,nj->n', Fprev, eGFAt, Fnext)[:, np.newaxis,
+            np.newaxis])
+        gstart = np.sum(vecA / np.dot(vecA, start)[:, np.newaxis], axis=0)
+        gend = np.sum(final / lik[:, np.newaxis], axis=0)
+
+    gA = qml.eGAF_stack_gradient(GA, *eGAF_coefficients(Apars),
+        regions=Aregions)
+    gF = qml.eGAF_stack_gradient(GF, *eGAF_coefficients(Fpars),
+        regions=Fregions)
+    return logliks, (gstart.reshape(startB.shape), gend.reshape(endB.shape),
+        gA, gF)
+
+def asymptotic_roots_derivative(roots, R, tres, Qplus, Qminus, step, kA, kF):
+    """
+    Derivative of the roots of det W(s) = 0 in a direction of parameter
+    change by implicit differentiation: ds = -trace(R * dW) where dW is the
+    change of W at fixed s and R are the asymptotic pdf constants (qml.AR),
+    which include the null vectors of W(s) and W'(s) at the root. Finding
+    the roots again is not needed.
+
+    Parameters
+    ----------
+    roots : array_like, shape (kA,)
+        Roots of the asymptotic pdf.
+    R : array_like, shape (kA, kA, kA)
+        Output of qml.AR() for the roots.
+    tres : float
+        Time resolution (dead time).
+    Qplus, Qminus : tuples
+        Submatrices (QAA, QFF, QAF, QFA) at parameters changed by +step and
+        -step in the direction of interest.
+    step : float
+        Size of parameter change.
+    kA, kF : ints
+        Number of open and shut states.
+
+    Returns
+    -------
+    droots : ndarray, shape (kA,)
+    """
+
+    droots = np.empty(kA)
+    for i in range(kA):
+        dW = (qml.W(roots[i], tres, *(Qplus + (kA, kF))) -
+            qml.W(roots[i], tres, *(Qminus + (kA, kF)))) / (2 * step)
+        droots[i] = -np.trace(np.dot(R[i], dW))
+    return droots
+
+def HJC_lik_components_fd_derivatives(mec, theta, conc, tres, tcrit, is_chsvec,
+    Apars, Fpars, step=1e-5):
+    """
+    Calculate finite difference derivatives of initial and final vectors and
+    eGAF(t) constants (see HJC_lik_components() and eGAF_coefficients())
+    with respect to log(theta). Roots of asymptotic pdfs are differentiated
+    implicitly (asymptotic_roots_derivative()); everything else depends
+    explicitly on Q and the roots and is differentiated by central
+    differences, moving the roots along their derivative so that no roots
+    need to be searched for. The mechanism is left set to theta.
+
+    Components are matched between theta + step and theta - step by
+    eigenvalue order, which is only valid while eigenvalues of Q are real
+    and well separated (see eigenvalues_separated()).
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism.
+    theta : array_like
+        Logarithms of free rate constants.
+    conc : float
+        Concentration.
+    tres : float
+        Time resolution (dead time).
+    tcrit : float
+        Critical time interval.
+    is_chsvec : bool
+        True if CHS vectors should be used (Eq. 5.7, CHS96).
+    Apars, Fpars : tuples
+        Output of HJC_lik_components() at theta.
+    step : float
+        Step in log(theta) for central differences.
+
+    Returns
+    -------
+    derivs : list of tuples
+        For each parameter (dstartB, dendB, dAcoefs, dFcoefs).
+    """
+
+    theta = np.asarray(theta, dtype=np.float64)
+    kA, kF = mec.kA, mec.kF
+    Aroots, AR, Froots, FR = Apars[4], Apars[5], Fpars[4], Fpars[5]
+
+    def set_theta(th):
+        mec.theta_unsqueeze(np.exp(th))
+        mec.set_eff('c', conc)
+        return mec.QAA.copy(), mec.QFF.copy(), mec.QAF.copy(), mec.QFA.copy()
+
+    derivs = []
+    for p in range(theta.shape[0]):
+        dtheta = np.zeros(theta.shape)
+        dtheta[p] = step
+        QAA, QFF, QAF, QFA = set_theta(theta + dtheta)
+        Qplus, Fplus = (QAA, QFF, QAF, QFA), (QFF, QAA, QFA, QAF)
+        QAA, QFF, QAF, QFA = set_theta(theta - dtheta)
+        Qminus, Fminus = (QAA, QFF, QAF, QFA), (QFF, QAA, QFA, QAF)
+        dAroots = asymptotic_roots_derivative(Aroots, AR, tres,
+            Qplus, Qminus, step, kA, kF)
+        dFroots = asymptotic_roots_derivative(Froots, FR, tres,
+            Fplus, Fminus, step, kF, kA)
+
+        sides = []
+        for sign in (1, -1):
+            set_theta(theta + sign * dtheta)
+            startB, endB, Ap, Fp = HJC_lik_components(mec, tres, tcrit,
+                is_chsvec, roots=(Aroots + sign * step * dAroots,
+                Froots + sign * step * dFroots))
+            sides.append((startB, endB,
+                eGAF_coefficients(Ap), eGAF_coefficients(Fp)))
+        (sp, ep, Ap, Fp), (sm, em, Am, Fm) = sides
+        derivs.append(((sp - sm) / (2 * step), (ep - em) / (2 * step),
+            tuple((a - b) / (2 * step) for a, b in zip(Ap, Am)),
+            tuple((a - b) / (2 * step) for a, b in zip(Fp, Fm))))
+
+    set_theta(theta)
+    return derivs
+
+def eigenvalues_separated(eigvals, gap=1e-3):
+    """
+    Check whether eigenvalues are real and well enough separated for
+    components sorted by eigenvalue to be compared between nearby
+    parameter values (see HJC_lik_components_fd_derivatives()).
+
+    Parameters
+    ----------
+    eigvals : array_like
+        Eigenvalues.
+    gap : float
+        Smallest allowed difference between neighbouring eigenvalues
+        relative to the largest eigenvalue magnitude.
+
+    Returns
+    -------
+    separated : bool
+    """
+
+    eigvals = np.asarray(eigvals)
+    if np.iscomplexobj(eigvals):
+        if np.any(np.abs(eigvals.imag) > 0):
+            return False
+        eigvals = eigvals.real
+    if eigvals.shape[0] < 2:
+        return True
+    scale = np.max(np.abs(eigvals))
+    return bool(np.min(np.diff(np.sort(eigvals))) > gap * scale)
+
+def HJC_loglik_fd_gradient(derivs, grads):
+    """
+    Combine gradients of the log-likelihood with respect to likelihood
+    components (HJC_record_loglik_gradient()) with derivatives of the
+    components (HJC_lik_components_fd_derivatives()).
+
+    Parameters
+    ----------
+    derivs : list of tuples
+        Output of HJC_lik_components_fd_derivatives().
+    grads : tuple
+        Gradients as returned by HJC_record_loglik_gradient().
+
+    Returns
+    -------
+    grad : ndarray, shape (ntheta,)
+        Gradient of the log-likelihood with respect to log(theta).
+    """
+
+    gstart, gend, gA, gF = grads
+    grad = np.empty(len(derivs))
+    for p, (dstart, dend, dA, dF) in enumerate(derivs):
+        grad[p] = (np.sum(gstart * dstart) + np.sum(gend * dend) +
+            sum(np.sum(g * d) for g, d in zip(gA + gF, dA + dF)))
+    return grad
+
+def HJClik_batched(theta, opts):
+    """
+    Calculate likelihood for a series of open and shut times using HJC missed
+    events probability density functions. Same as HJClik() but all eGAF(t)
+    and eGFA(t) matrices of a record are calculated in one stacked call and
+    burst products are evaluated as a batched matrix-chain reduction (see
+    burst_chain_loglik()).
+
+    The two functions agree to better than 1e-8 relative error in
+    log-likelihood.
+
+    Parameters
+    ----------
+    theta : array_like
+        Guesses.
+    opts : dictionary
+        Same as in HJClik(). opts['data'] may also be a tuple
+        (intervals, offsets) as returned by pack_bursts().
+
+    Returns
+    -------
+    loglik : float
+        Log-likelihood.
+    newrates : array_like
+        Updated rates/guesses.
+    """
+
+    lik = HJCLikelihood(opts['mec'], opts['tres'], opts['tcrit'],
+        opts['conc'], opts['data'], opts['isCHS'])
+    return lik(theta)
+
+def HJClik_fd_gradient(theta, opts):
+    """
+    Calculate minus HJC log-likelihood and its finite difference gradient
+    with respect to theta (logarithms of free rate constants); see
+    HJCLikelihood.loglik_fd_gradient(). Arguments as in HJClik().
+
+    Returns
+    -------
+    loglik : float
+        Minus log-likelihood (inf if the likelihood is not positive).
+    grad : ndarray, shape (ntheta,)
+        Minus gradient of log-likelihood.
+    """
+
+    loglik, grad = HJCLikelihood(opts['mec'], opts['tres'], opts['tcrit'],
+        opts['conc'], opts['data'], opts['isCHS']).loglik_fd_gradient(theta)
+    return -loglik, -grad
+
+class HJCLikelihood(object):
+    """
+    HJC likelihood of a record prepared for repeated evaluation, e.g. during
+    fitting. Mechanism, resolution, tcrit, concentration and bursts are
+    given once; intervals are packed into contiguous arrays, sorted into
+    exact and asymptotic regions and bucketed for the burst product
+    reduction. Calling the object with new parameters does only the
+    parameter dependent work; the search for asymptotic roots starts from
+    the roots for the previous parameters.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be fitted.
+    tres : float
+        Time resolution (dead time).
+    tcrit : float
+        Critical time interval.
+    conc : float
+        Concentration.
+    bursts : dictionary, list or tuple
+        Lists of open and shut intervals (each burst starts and ends with
+        an opening) or (intervals, offsets) as returned by pack_bursts().
+    isCHS : bool
+        True if CHS vectors should be used (Eq. 5.7, CHS96).
+    """
+
+    def __init__(self, mec, tres, tcrit, conc, bursts, isCHS=True):
+
+        self.mec = mec
+        self.tres = tres
+        self.tcrit = tcrit
+        self.conc = conc
+        self.isCHS = isCHS
+        if isinstance(bursts, tuple):
+            self.intervals, self.offsets = bursts
+        else:
+            self.intervals, self.offsets = pack_bursts(bursts)
+        self.nevals = 0
+        self.roots = None
+        self._population_plan = None
+
+        self.record = HJC_record_plan(self.intervals, self.offsets, tres)
+        self.passplan = burst_pass_plan(self.offsets)
+
+    def components(self, theta):
+        """
+        Set mechanism parameters and concentration and calculate initial and
+        final vectors and eGAF(t) constants (see HJC_lik_components()).
+
+        Parameters
+        ----------
+        theta : array_like
+            Logarithms of free rate constants.
+        """
+
+        self.mec.theta_unsqueeze(np.exp(theta))
+        self.mec.set_eff('c', self.conc)
+        components = HJC_lik_components(self.mec, self.tres, self.tcrit,
+            self.isCHS, guess=self.roots)
+        self.roots = (components[2][4], components[3][4])
+        return components
+
+    def loglik_bursts(self, theta):
+        """
+        Calculate log-likelihood of each burst.
+
+        Parameters
+        ----------
+        theta : array_like
+            Logarithms of free rate constants.
+
+        Returns
+        -------
+        logliks : ndarray, shape (nbursts,)
+            Log-likelihoods of bursts (nan if likelihood is not positive).
+        """
+
+        startB, endB, Apars, Fpars = self.components(theta)
+        self.nevals += 1
+        return HJC_record_loglik(self.record, startB, endB, Apars, Fpars)
+
+    def __call__(self, theta):
+        """
+        Calculate minus log-likelihood. Same return values as HJClik().
+
+        Parameters
+        ----------
+        theta : array_like
+            Logarithms of free rate constants.
+
+        Returns
+        -------
+        loglik : float
+            Minus log-likelihood.
+        newrates : array_like
+            Updated rates/guesses.
+        """
+
+        logliks = self.loglik_bursts(theta)
+        if np.isnan(logliks).any():
+            print ('HJClik: Warning: likelihood has been set to 0')
+            print ('rates=', self.mec.unit_rates())
+            loglik = 0
+        else:
+            loglik = np.sum(logliks)
+        return -loglik, np.log(self.mec.theta())
+
+    def loglik_population(self, thetas):
+        """
+        Calculate log-likelihoods for a population of parameter sets, e.g.
+        a generation of an evolutionary optimiser or points of a profile
+        grid. Q matrices of all sets are built together, likelihood
+        components are calculated with stacked linear algebra
+        (HJC_lik_components_stack()) and bursts of all sets are reduced
+        at once. The mechanism is left as it was.
+
+        Parameters
+        ----------
+        thetas : array_like, shape (P, ntheta)
+            Logarithms of free rate constants, one set per row.
+
+        Returns
+        -------
+        logliks : ndarray, shape (P,)
+            Log-likelihoods; -inf where the likelihood is not positive.
+        """
+
+        thetas = np.atleast_2d(thetas)
+        P = thetas.shape[0]
+        Q = self.mec.Q_theta_stack(np.exp(thetas), 'c', self.conc)
+        components = HJC_lik_components_stack(Q, self.mec.kA, self.mec.kF,
+            self.tres, self.tcrit, self.isCHS, guess=self.roots)
+        if self._population_plan is None or self._population_plan[0] != P:
+            self._population_plan = (P,
+                burst_chain_plan(np.tile(self.record[1], P)))
+        logliks = HJC_record_loglik_stack(self.record, *components,
+            plan=self._population_plan[1])
+        self.nevals += P
+        loglik = np.sum(logliks, axis=1)
+        loglik[np.isnan(loglik)] = -np.inf
+        return loglik
+
+    def loglik_fd_gradient(self, theta, step=1e-5):
+        """
+        Calculate log-likelihood and its gradient with respect to log(theta).
+
+        The gradient is a finite difference approximation: derivatives of
+        the log-likelihood with respect to the likelihood components come
+        from one forward and one backward pass over the bursts, and
+        derivatives of the (data independent) components with respect to
+        theta from central differences, two component evaluations per
+        parameter (see HJC_lik_components_fd_derivatives()). If eigenvalues
+        of Q are complex or nearly degenerate, components cannot be
+        matched between neighbouring parameter values and the gradient is
+        instead calculated by central differences of the total
+        log-likelihood, two likelihood evaluations per parameter. Either
+        way the cost grows with the number of parameters and the error with
+        step (as step**2, until rounding errors take over).
+
+        Parameters
+        ----------
+        theta : array_like
+            Logarithms of free rate constants.
+        step : float
+            Step in log(theta) for central differences.
+
+        Returns
+        -------
+        loglik : float
+            Log-likelihood; -inf if the likelihood of any burst is not
+            positive, in which case the gradient is zero and the point
+            should be rejected by the optimiser.
+        grad : ndarray, shape (ntheta,)
+            Gradient of log-likelihood with respect to theta.
+        """
+
+        theta = np.asarray(theta, dtype=np.float64)
+        startB, endB, Apars, Fpars = self.components(theta)
+        self.nevals += 1
+        logliks, grads = HJC_record_loglik_gradient(self.record,
+            self.passplan, startB, endB, Apars, Fpars)
+        if np.isnan(logliks).any():
+            return -np.inf, np.zeros(theta.shape[0])
+        if eigenvalues_separated(Apars[0]):
+            derivs = HJC_lik_components_fd_derivatives(self.mec, theta,
+                self.conc, self.tres, self.tcrit, self.isCHS, Apars, Fpars,
+                step)
+            return np.sum(logliks), HJC_loglik_fd_gradient(derivs, grads)
+
+        grad = np.empty(theta.shape[0])
+        for p in range(theta.shape[0]):
+            dtheta = np.zeros(theta.shape)
+            dtheta[p] = step
+            grad[p] = (np.sum(self.loglik_bursts(theta + dtheta)) -
+                np.sum(self.loglik_bursts(theta - dtheta))) / (2 * step)
+        self.components(theta)
+        return np.sum(logliks), grad
+
+# Packed records and prepared chunks attached in a pool worker process.
+_pool_data = []
+_pool_records = {}
+
+def _pool_init(blocks):
+    """
+    Attach shared memory copies of packed records in a worker process.
+    """
+
+    for names, nint, nbst, tres in blocks:
+        shm = [shared_memory.SharedMemory(name=name) for name in names]
+        intervals = np.ndarray((nint, ), dtype=np.float64, buffer=shm[0].buf)
+        offsets = np.ndarray((nbst + 1, ), dtype=np.intp, buffer=shm[1].buf)
+        _pool_data.append((shm, intervals, offsets, tres))
+
+def _pool_loglik(patch, b0, b1, components):
+    """
+    Sum of log-likelihoods of bursts b0 to b1 - 1 of a record attached with
+    _pool_init().
+    """
+
+    shm, intervals, offsets, tres = _pool_data[patch]
+    record = _pool_records.get((patch, b0, b1))
+    if record is None:
+        o = offsets[b0 : b1 + 1]
+        record = HJC_record_plan(intervals[o[0] : o[-1]], o - o[0], tres)
+        _pool_records[(patch, b0, b1)] = record
+    return np.sum(HJC_record_loglik(record, *components))
+
+class HJCLikelihoodPool(object):
+    """
+    HJC likelihood of one or more records (e.g. patches recorded at
+    different concentrations) evaluated in parallel. Bursts of each record
+    are split into chunks of similar number of intervals which are sent to
+    a process pool; each worker gets a shared memory copy of the interval
+    arrays. Parameter dependent quantities are calculated once per record
+    in the calling process and partial log-likelihoods are summed.
+
+    Use as a context manager or call close() to stop workers and free
+    shared memory.
+
+    Parameters
+    ----------
+    liks : list of HJCLikelihood
+        One prepared likelihood per record. All have to describe the same
+        mechanism (same free parameters).
+    nproc : int, optional
+        Number of worker processes. Default: number of CPUs.
+    nchunks : int, optional
+        Number of chunks each record is split into. Default: nproc.
+    """
+
+    def __init__(self, liks, nproc=None, nchunks=None):
+
+        self.liks = liks
+        self.nproc = nproc if nproc else os.cpu_count()
+        nchunks = nchunks if nchunks else self.nproc
+        self.nevals = 0
+
+        self.shm = []
+        self.chunks = []
+        blocks = []
+        for lik in liks:
+            names = []
+            for arr in (lik.intervals, lik.offsets.astype(np.intp)):
+                shm = shared_memory.SharedMemory(create=True,
+                    size=max(arr.nbytes, 1))
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+                self.shm.append(shm)
+                names.append(shm.name)
+            nbst = lik.offsets.shape[0] - 1
+            blocks.append((names, lik.intervals.shape[0], nbst, lik.tres))
+
+            # Split bursts into chunks with similar number of intervals.
+            target = np.linspace(0, lik.offsets[-1], nchunks + 1)
+            bounds = np.unique(np.searchsorted(lik.offsets, target))
+            bounds = np.unique(np.clip(np.append(0, bounds), 0, nbst))
+            self.chunks.append(list(zip(bounds[:-1], bounds[1:])))
+
+        self.pool = ProcessPoolExecutor(self.nproc, initializer=_pool_init,
+            initargs=(blocks, ))
+
+    def __call__(self, theta):
+        """
+        Calculate minus log-likelihood summed over all records. Same return
+        values as HJClik().
+
+        Parameters
+        ----------
+        theta : array_like
+            Logarithms of free rate constants.
+
+        Returns
+        -------
+        loglik : float
+            Minus log-likelihood.
+        newrates : array_like
+            Updated rates/guesses.
+        """
+
+        futures = []
+        for patch, lik in enumerate(self.liks):
+            components = lik.components(theta)
+            for b0, b1 in self.chunks[patch]:
+                futures.append(self.pool.submit(_pool_loglik, patch,
+                    b0, b1, components))
+        loglik = np.sum([future.result() for future in futures])
+        self.nevals += 1
+
+        if np.isnan(loglik):
+            print ('HJClik: Warning: likelihood has been set to 0')
+            loglik = 0
+        return -loglik, np.log(self.liks[0].mec.theta())
+
+    def close(self):
+        """
+        Shut down worker processes and release shared memory.
+        """
+
+        self.pool.shutdown()
+        for shm in self.shm:
+            shm.close()
+            shm.unlink()
+        self.shm = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 def corr_variance_A(phiA, QAA, kA):
     """
     Calculate variance of open (shut) time according Eq. 2.6 (CH87).
@@ -945,7 +2455,8 @@ def adjacent_open_to_shut_range_mean(u1, u2, QAA, QAF, QFF, QFA, phiA):
     kA = QAA.shape[0]
     uA = np.ones((kA))[:,np.newaxis]
     invQAA, invQFF = -nplin.inv(QAA), nplin.inv(QFF)
-    expQFFr = qml.expQt(QFF, u2) - qml.expQt(QFF, u1)
+    expQFF1, expQFF2 = qml.expQt_stack(QFF, [u1, u2])
+    expQFFr = expQFF2 - expQFF1
     col = np.dot(np.dot(np.dot(np.dot(QAF, invQFF), expQFFr), QFA), uA)
     row1 = np.dot(phiA, qml.Qpow(invQAA, 2))
     row2 = np.dot(phiA, invQAA)
@@ -1088,7 +2599,8 @@ def adjacent_open_to_shut_range_pdf_components(u1, u2, QAA, QAF, QFF, QFA, phiA)
     kA = QAA.shape[0]
     uA = np.ones((kA))[:,np.newaxis]
     invQAA, invQFF = -nplin.inv(QAA), nplin.inv(QFF)
-    expQFFr = qml.expQt(QFF, u2) - qml.expQt(QFF, u1)
+    expQFF1, expQFF2 = qml.expQt_stack(QFF, [u1, u2])
+    expQFFr = expQFF2 - expQFF1
     col = np.dot(np.dot(np.dot(np.dot(QAF, invQFF), expQFFr), QFA), uA)
     w = np.zeros(kA)
     eigs, A = qml.eigs(-QAA)
@@ -1099,32 +2611,18 @@ def adjacent_open_to_shut_range_pdf_components(u1, u2, QAA, QAF, QFF, QFA, phiA)
         w[i] = np.dot(np.dot(phiA, A[i]), col) / den
     return eigs, w
 
-def simulate_intervals(mec, tres, state, opamp=5, nintmax=5000):
-    """
-
+def simulate_intervals(mec, tres, state, opamp=5, nintmax=5000, rng=None):
     """
-    picum = np.cumsum(transition_probability(mec.Q), axis=1)
-    tmean = -1 / mec.Q.diagonal() # in s
-    ints = [random.expovariate(1 / tmean[state])]
-    amps = [opamp] if state < mec.kA else [0]
-    while len(ints) < nintmax:
-        state, t, a = next_state(state, picum, tmean, mec.kA, opamp)
-        if t < tres or a == amps[-1]:
-            ints[-1] += t
-        else:
-            ints.append(t)
-            amps.append(a)
-    return np.array(ints), np.array(amps), np.zeros((len(ints)), dtype='b')
+    Simulate resolved open and shut intervals. See
+    scsim.simulate_intervals().
 
-def next_state(present, picum, tmean, kA, opamp):
-    """
-    Get next state, its lifetime and amplitude.
+    Returns
+    -------
+    tints, ampls, flags : ndarrays, shape (nintmax,)
+        Interval lengths, amplitudes and properties.
     """
-    possible = np.nonzero(picum[present] >= random.random())[0]
-    next = np.delete(possible, np.where(possible == present))[0]
-    t = random.expovariate(1 / tmean[next])
-    a = opamp if next < kA else 0
-    return next, t, a
+    return scsim.simulate_intervals(mec, tres, state, opamp, nintmax,
+        rng)[:3]
 
 def printout_occupancies(mec, tres):
     """
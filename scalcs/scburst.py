@@ -68,15 +68,17 @@ def length_pdf(mec, t):
     ----------
     mec : dcpyps.Mechanism
         The mechanism to be analysed.
+    t : float or array_like, shape (n,)
+        Burst length(s).
 
     Returns
     -------
-    f : float
+    f : ndarray, shape (n,)
     """
 
-    expQEEA = qml.expQt(mec.QEE, t)[:mec.kA, :mec.kA]
-    f = np.dot(np.dot(np.dot(phiBurst(mec), expQEEA), -mec.QAA),
-        endBurst(mec))
+    expQEEA = qml.expQt_stack(mec.QEE, t)[:, :mec.kA, :mec.kA]
+    f = np.dot(np.dot(expQEEA, np.dot(-mec.QAA, endBurst(mec))[:, 0]),
+        phiBurst(mec))
     return f
 
 def length_pdf_components(mec):
@@ -140,18 +142,17 @@ def length_cond_pdf(mec, t):
     ----------
     mec : dcpyps.Mechanism
         The mechanism to be analysed.
-    t : float
-        Length.
+    t : float or array_like, shape (n,)
+        Length(s).
 
     Returns
     -------
-    vec : array_like, shape (kA, 1)
+    vec : ndarray, shape (n, kA)
         Probability of seeing burst length t depending on starting state.
     """
 
-    expQEEA = qml.expQt(mec.QEE, t)[:mec.kA, :mec.kA]
-    vec = np.dot(np.dot(expQEEA, -mec.QAA), endBurst(mec))
-    vec = vec.transpose()
+    expQEEA = qml.expQt_stack(mec.QEE, t)[:, :mec.kA, :mec.kA]
+    vec = np.dot(expQEEA, np.dot(-mec.QAA, endBurst(mec))[:, 0])
     return vec
 
 def length_no_single_openings_pdf_components(mec):
@@ -36,10 +36,8 @@ def Popen(mec, tres):
         Ideal open probability.
     """
 
-    iEC50 = popen.EC50(mec, 0)
-    eEC50 = popen.EC50(mec, tres)
-    pmax, cx = popen.maxPopen(mec, 0)
-    nH = popen.nH(mec, 0)
+    icurve = popen.PopenCurve(mec, 0)
+    iEC50, pmax, nH = icurve.EC50, icurve.maxPopen, icurve.nH
 
     # Plot ideal and corrected Popen curves.
     cmin = iEC50 / 20
@@ -49,13 +47,9 @@ def Popen(mec, tres):
     points = 512
 
     c = np.logspace(log_start, log_end, points)
-    pe = np.zeros(points)
-    pi = np.zeros(points)
-    H = np.zeros(points)
-    for i in range(points):
-        pe[i] = popen.Popen(mec, tres, c[i])
-        pi[i] = popen.Popen(mec, 0, c[i])
-        H[i] = pmax / (math.pow((iEC50 / c[i]), nH) + 1) # Hill equation
+    pe = popen.Popen_curve(mec, tres, c)
+    pi = popen.Popen_curve(mec, 0, c)
+    H = pmax / (np.power(iEC50 / c, nH) + 1) # Hill equation
 
     c = c * 1000000 # x axis in microM
 
@@ -98,9 +92,7 @@ def burst_length_pdf(mec, multicomp=False, conditional=False,
         return t * 1000, fbst, mfbst
 
     if conditional:
-        cfbst = np.zeros((points, mec.kA))
-        for i in range(points):
-            cfbst[i] = t[i] * scburst.length_cond_pdf(mec, t[i])
+        cfbst = t[:, np.newaxis] * scburst.length_cond_pdf(mec, t)
         cfbrst = cfbst.transpose()
         return t * 1000, fbst, cfbrst
 
@@ -372,10 +364,8 @@ def open_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
     # Exact pdf
     eigvals, gamma00, gamma10, gamma11 = scl.exact_GAMAxx(mec,
         tres, open)
-    epdf = np.zeros(points)
-    for i in range(points):
-        epdf[i] = (t[i] * scl.exact_pdf(t[i], tres,
-            roots, areas, eigvals, gamma00, gamma10, gamma11))
+    epdf = t * scl.exact_pdf(t, tres,
+        roots, areas, eigvals, gamma00, gamma10, gamma11)
             
     if unit == 'ms':
         t = t * 1000 # x scale in millisec
@@ -499,10 +489,8 @@ def shut_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
 
     # Exact pdf
     eigvals, gamma00, gamma10, gamma11 = scl.exact_GAMAxx(mec, tres, open)
-    epdf = np.zeros(points)
-    for i in range(points):
-        epdf[i] = (t[i] * scl.exact_pdf(t[i], tres,
-            roots, areas, eigvals, gamma00, gamma10, gamma11))
+    epdf = t * scl.exact_pdf(t, tres,
+        roots, areas, eigvals, gamma00, gamma10, gamma11)
 
     if unit == 'ms':
         t = t * 1000 # x scale in millisec
@@ -558,8 +546,210 @@ def subset_time_pdf(mec, tres, state1, state2,
 
     return t, ipdf, spdf
 
+class LogHistogram(object):
+    """
+    Histogram with logarithmic bins (nbdec bins per decade starting at
+    tmin) which is accumulated block by block, so that records of any
+    length can be binned in constant memory. Bins are added as longer
+    values arrive; values shorter than tmin are counted in 'below' only.
+
+    Parameters
+    ----------
+    tmin : float
+        Lower edge of the first bin (usually tres).
+    nbdec : int
+        Number of bins per decade.
+    """
+
+    def __init__(self, tmin, nbdec=12):
+        self.tmin = tmin
+        self.nbdec = nbdec
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.below = 0
+
+    def add(self, x):
+        """
+        Add a block of values to the histogram.
+
+        Parameters
+        ----------
+        x : array_like, shape (n,)
+        """
+
+        x = np.asarray(x, dtype=np.float64)
+        inside = x >= self.tmin
+        self.below += x.shape[0] - np.count_nonzero(inside)
+        ind = np.floor(np.log10(x[inside] / self.tmin) *
+            self.nbdec).astype(np.intp)
+        counts = np.bincount(ind, minlength=self.counts.shape[0])
+        counts[:self.counts.shape[0]] += self.counts
+        self.counts = counts
+
+    @property
+    def n(self):
+        """Number of values in bins."""
+        return int(self.counts.sum())
+
+    @property
+    def dt(self):
+        """Bin width in log10 units (as used by scaled_pdf())."""
+        return 1.0 / self.nbdec
+
+    @property
+    def edges(self):
+        """Bin edges, shape (nbins + 1,)."""
+        return self.tmin * 10 ** (np.arange(self.counts.shape[0] + 1) /
+            float(self.nbdec))
+
+    def xy(self, unit='ms'):
+        """
+        Prepare x and y values for plotting the histogram as steps.
+
+        Parameters
+        ----------
+        unit : str
+            'ms'- x values in milliseconds.
+
+        Returns
+        -------
+        x, y : ndarrays, shape (2 * nbins + 2,)
+        """
+
+        edges = self.edges
+        if unit == 'ms':
+            edges = edges * 1000
+        x = np.repeat(edges, 2)
+        y = np.zeros(x.shape[0])
+        y[1:-1] = np.repeat(self.counts, 2)
+        return x, y
+
+class DwellHistograms(object):
+    """
+    Open time, shut time, burst length and openings per burst histograms
+    of a single channel record accumulated block by block, e.g. from
+    scsim.iter_intervals(). A burst ends at a shut time longer than tcrit;
+    the burst not finished at the end of a block is carried over to the
+    next one. Memory used does not depend on the length of the record.
+
+    Parameters
+    ----------
+    tres : float
+        Time resolution; lower edge of the first time bin.
+    tcrit : float
+        Critical shut time dividing bursts.
+    nbdec : int
+        Number of bins per decade of time histograms.
+
+    Attributes
+    ----------
+    open, shut, burst : LogHistogram
+        Open time, shut time and burst length histograms.
+    openings : ndarray of ints
+        openings[r - 1] is the number of bursts with r openings.
+    """
+
+    def __init__(self, tres, tcrit, nbdec=12):
+        self.tcrit = tcrit
+        self.open = LogHistogram(tres, nbdec)
+        self.shut = LogHistogram(tres, nbdec)
+        self.burst = LogHistogram(tres, nbdec)
+        self.openings = np.zeros(0, dtype=np.int64)
+        self._length, self._nopen = 0.0, 0
+
+    def add(self, tints, ampls):
+        """
+        Add a block of consecutive intervals.
+
+        Parameters
+        ----------
+        tints : array_like, shape (n,)
+            Interval lengths.
+        ampls : array_like, shape (n,)
+            Interval amplitudes (0 for shuttings).
+        """
+
+        t = np.asarray(tints, dtype=np.float64)
+        isopen = np.asarray(ampls) != 0
+        self.open.add(t[isopen])
+        self.shut.add(t[~isopen])
+
+        # Burst lengths and openings from cumulative sums between gaps. A
+        # burst starts with an opening, so shuttings before the first
+        # opening of the record are not counted.
+        gap = ~isopen & (t >= self.tcrit)
+        inburst = ~gap
+        if self._nopen == 0:
+            lead = np.argmax(isopen) if isopen.any() else t.shape[0]
+            inburst[:lead] = False
+        cslen = np.zeros(t.shape[0] + 1)
+        np.cumsum(np.where(inburst, t, 0.0), out=cslen[1:])
+        csop = np.zeros(t.shape[0] + 1, dtype=np.int64)
+        np.cumsum(isopen, out=csop[1:])
+        gaps = np.flatnonzero(gap)
+        start = np.append(0, gaps + 1)
+        end = np.append(gaps, t.shape[0])
+        length = cslen[end] - cslen[start]
+        nopen = csop[end] - csop[start]
+        length[0] += self._length
+        nopen[0] += self._nopen
+        self._length, self._nopen = length[-1], nopen[-1]
+        self._add_bursts(length[:-1], nopen[:-1])
+
+    def flush(self):
+        """Add the burst not finished at the end of the record."""
+        self._add_bursts(np.array([self._length]), np.array([self._nopen]))
+        self._length, self._nopen = 0.0, 0
+
+    def _add_bursts(self, length, nopen):
+        done = nopen > 0
+        self.burst.add(length[done])
+        counts = np.bincount(nopen[done] - 1,
+            minlength=self.openings.shape[0])
+        counts[:self.openings.shape[0]] += self.openings
+        self.openings = counts
+
+def prepare_hist(X, tres):
+    """
+    Prepare x and y values for plotting a histogram of dwell times with
+    logarithmic bins starting at tres. Values shorter than tres are not
+    binned. Number of bins per decade depends on number n of values not
+    shorter than tres: 5 if n <= 300, 8 if n <= 1000, 10 if n <= 3000 and
+    12 otherwise.
+
+    Parameters
+    ----------
+    X : array_like
+        Dwell times.
+    tres : float
+        Time resolution.
+
+    Returns
+    -------
+    x, y : ndarrays
+        x and y values to plot histogram.
+    dx : float
+        Ratio of bin edges.
+    n : int
+        Number of values in bins (to scale pdfs with).
+    """
+
+    X = np.asarray(X, dtype=np.float64)
+    n = np.count_nonzero(X >= tres)
+    if n <= 300:
+        nbdec = 5
+    elif n <= 1000:
+        nbdec = 8
+    elif n <= 3000:
+        nbdec = 10
+    else:
+        nbdec = 12
+    hist = LogHistogram(tres, nbdec)
+    hist.add(X)
+    x, y = hist.xy(unit=None)
+    return x, y, 10 ** hist.dt, hist.n
+
 def png_save_pdf_fig(outfile, ints, mec, conc, tres, type):
-    x, y, dx = prepare_hist(ints, tres)
+    x, y, dx, n = prepare_hist(ints, tres)
     mec.set_eff('c', conc)
     if type == 'open':
         t, ipdf, epdf, apdf = open_time_pdf(mec, tres)
@@ -568,8 +758,8 @@ def png_save_pdf_fig(outfile, ints, mec, conc, tres, type):
     else:
         print ('Wrong type.')
 
-    sipdf = scaled_pdf(t, ipdf, math.log10(dx), len(ints))
-    sepdf = scaled_pdf(t, epdf, math.log10(dx), len(ints))
+    sipdf = scaled_pdf(t, ipdf, math.log10(dx), n)
+    sepdf = scaled_pdf(t, epdf, math.log10(dx), n)
     figure(figsize=(6, 4))
     semilogx(x*1000, y, 'k-', t, sipdf, 'r--', t, sepdf, 'b-')
     savefig(outfile, bbox_inches=0)
\ No newline at end of file
@@ -1,54 +1,644 @@
+import os
+import copy
 import math
-import random
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+from scipy.signal import fftconvolve
+
+from scalcs import qmatlib as qml
+
+def simulate_intervals(mec, tres, state, opamp=5, nintmax=5000, rng=None):
+    """
+    Simulate a single channel record: a series of resolved open and shut
+    intervals. Sojourns in states of equal amplitude form ideal intervals;
+    ideal intervals shorter than tres are added to the preceding interval
+    and contiguous intervals of equal amplitude are concatenated.
+
+    Random variates are drawn in large blocks from a numpy Generator, the
+    states visited are found with _embedded_chain() and unresolved
+    intervals are removed from the whole block at once, so that several
+    million transitions per second are simulated. For records too long to
+    keep in memory use iter_intervals().
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism with rates and concentration already set.
+    tres : float
+        Time resolution (dead time).
+    state : int
+        Initial state.
+    opamp : float
+        Amplitude of openings.
+    nintmax : int
+        Number of intervals to simulate.
+    rng : numpy.random.Generator or int, optional
+        Random number generator or seed for numpy.random.default_rng().
+
+    Returns
+    -------
+    tints : ndarray, shape (nintmax,)
+        Interval lengths in seconds.
+    ampls : ndarray, shape (nintmax,)
+        Interval amplitudes.
+    flags : ndarray, shape (nintmax,)
+        Interval properties (all zero).
+    ntrns : int
+        Number of transitions in the simulated record.
+    """
+
+    tints, ampls, starts = [], [], []
+    nint = 0
+    # One interval more than needed: its start gives number of transitions.
+    for t, a, s in _resolved_blocks(mec, tres, state, opamp, rng,
+        nintmax + 1):
+        tints.append(t)
+        ampls.append(a)
+        starts.append(s)
+        nint += t.shape[0]
+        if nint > nintmax:
+            break
+    ntrns = np.concatenate(starts)[nintmax] - 1
+    tints = np.concatenate(tints)[:nintmax]
+    ampls = np.concatenate(ampls)[:nintmax]
+    return tints, ampls, np.zeros((nintmax), dtype='b'), ntrns
+
+def iter_intervals(mec, tres, state, opamp=5, blocksize=1048576,
+    nintmax=None, rng=None):
+    """
+    Simulate a single channel record (see simulate_intervals()) block by
+    block. State of the channel and the interval not finished at the end of
+    a block are carried over to the next one, so that concatenated blocks
+    are one continuous record; memory used does not depend on its length.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism with rates and concentration already set.
+    tres : float
+        Time resolution (dead time).
+    state : int
+        Initial state.
+    opamp : float
+        Amplitude of openings.
+    blocksize : int
+        Number of intervals in each block.
+    nintmax : int, optional
+        Total number of intervals; the last block may be shorter. By default
+        the generator never stops.
+    rng : numpy.random.Generator or int, optional
+        Random number generator or seed for numpy.random.default_rng().
+
+    Yields
+    ------
+    tints : ndarray, shape (blocksize,)
+        Interval lengths in seconds.
+    ampls : ndarray, shape (blocksize,)
+        Interval amplitudes.
+    """
+
+    tints, ampls = [], []
+    nbuf, nint = 0, 0
+    for t, a, s in _resolved_blocks(mec, tres, state, opamp, rng, nintmax):
+        tints.append(t)
+        ampls.append(a)
+        nbuf += t.shape[0]
+        while nbuf >= blocksize or (nintmax is not None and
+            nint + nbuf >= nintmax and nbuf > 0):
+            t, a = np.concatenate(tints), np.concatenate(ampls)
+            n = blocksize if nintmax is None else min(blocksize,
+                nintmax - nint)
+            yield t[:n], a[:n]
+            nint += n
+            if nintmax is not None and nint >= nintmax:
+                return
+            tints, ampls = [t[n:]], [a[n:]]
+            nbuf -= n
+
+def iter_trace(mec, fs, fc, noise=0.0, state=None, voltage=-0.1,
+    blocksize=1048576, nsamples=None, ideal=False, rng=None):
+    """
+    Simulate a digitised single channel current record block by block.
+
+    Current of each state is conductance (mechanism.State.conductance)
+    times driving force. The ideal current is averaged over each sample
+    interval, white noise is added and the result is filtered with a
+    Gaussian filter (impulse response of standard deviation 0.1325 / fc,
+    Colquhoun & Sigworth, 1995) by overlap-add FFT convolution. The filter
+    kernel is cut at +/- 4 standard deviations; as many samples at the
+    start of the simulation are used to let the filter settle and are not
+    returned. Memory used does not depend on length of the record.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism with rates and concentration already set.
+    fs : float
+        Sampling frequency (Hz).
+    fc : float
+        Filter cut-off (-3 dB) frequency (Hz).
+    noise : float
+        Standard deviation of noise in the filtered record (pA).
+    state : int, optional
+        Initial state. By default drawn from equilibrium occupancies.
+    voltage : float
+        Driving force (membrane potential minus reversal potential) in V.
+    blocksize : int
+        Number of samples in each block.
+    nsamples : int, optional
+        Total number of samples; the last block may be shorter. By default
+        the generator never stops.
+    ideal : bool
+        If True, yield also the ideal (unfiltered, noiseless) current.
+    rng : numpy.random.Generator or int, optional
+        Random number generator or seed for numpy.random.default_rng().
+
+    Yields
+    ------
+    current : ndarray, shape (blocksize,)
+        Sampled current (pA).
+    icurrent : ndarray, shape (blocksize,)
+        Ideal current (pA), aligned with current; only if ideal is True.
+    """
+
+    rng = np.random.default_rng(rng)
+    # Separate noise stream, so that the record does not depend on block
+    # size.
+    nrng = np.random.default_rng(rng.integers(2**62))
+    tables = _chain_tables(mec.Q)
+    cur = np.array([st.conductance for st in mec.States]) * voltage * 1e12
+    if state is None:
+        pinf = np.maximum(qml.pinf(mec.Q), 0)
+        state = rng.choice(mec.k, p=pinf / pinf.sum())
+
+    sigma = 0.1325 * fs / fc # in samples
+    m = max(int(math.ceil(4 * sigma)), 1)
+    kernel = np.exp(-0.5 * (np.arange(-m, m + 1) / sigma)**2)
+    kernel /= kernel.sum()
+    # White noise before filter giving required standard deviation after.
+    sdin = noise / math.sqrt(np.sum(kernel * kernel))
 
-def simulate_intervals(mec, tres, state, opamp=5, nintmax=5000):
-    """
-
-    """
-    # Initialise simulation
-    # Cummulative transition probability
-    picum = np.cumsum(transition_probability(mec.Q), axis=1)
-    #Mean lifetime in each state
-    tmean = -1 / mec.Q.diagonal() # in s
-    # interval and transition counters
-    nint, ntrns = 0, 0 
-    # initial state
-    inst = state
-    # amplitude of initial state
-    a = opamp if inst < mec.kA else 0
-    # length of initial interval
-    t = - tmean[inst] * math.log(random.random())
-    # lists to keep intervals and amplitudes
-    tints, ampls = [t], [a]
-    
-    while nint < nintmax-1:
-
-        newst, t, a = next_state(inst, picum, tmean, mec.kA, opamp)
-        ntrns += 1
-        if t < tres:
-            tints[-1] += t
-            a = ampls[-1]
+    # Sojourns not yet sampled: end times relative to the start of the
+    # present block and currents.
+    tmean = tables[2]
+    ends = np.array([tmean[state] * rng.standard_exponential()])
+    levels = cur[[state]]
+    n = 1024 # transitions simulated at once
+    tail = np.zeros(2 * m) # filter output waiting for following samples
+    iwait = np.zeros(0) # ideal samples waiting to be aligned
+    nout = 0
+    first = True
+    while nsamples is None or nout < nsamples:
+        # Output sample i is (filtered) input sample i + m; full convolution
+        # of the first block is 2m samples longer than the output.
+        N = blocksize if nsamples is None else min(blocksize,
+            nsamples - nout)
+        nin = N + 2 * m if first else N
+        T = nin / fs
+        while ends[-1] <= T:
+            states, t = _sojourns(tables, state, n, rng)
+            state = states[-1]
+            ends = np.append(ends, ends[-1] + np.cumsum(t))
+            levels = np.append(levels, cur[states])
+            n = min(2 * n, 1048576)
+
+        # Charge passed up to each sample time, averaged over samples.
+        edges = np.arange(nin + 1) / fs
+        starts = np.maximum(np.append(0, ends[:-1]), 0)
+        charge = np.append(0, np.cumsum(levels * (ends - starts)))
+        j = np.searchsorted(ends, edges, side='right')
+        x = np.diff(charge[j] + levels[j] * (edges - starts[j])) * fs
+
+        y = fftconvolve(x + sdin * nrng.standard_normal(nin), kernel)
+        y[:2 * m] += tail
+        tail = y[nin:].copy()
+        y = y[2 * m : nin] if first else y[:nin]
+        xi = x[m:] if first else np.append(iwait, x)
+        iwait = xi[N:]
+
+        keep = ends > T
+        ends, levels = ends[keep] - T, levels[keep]
+        first = False
+        nout += N
+        if ideal:
+            yield y, xi[:N]
+        else:
+            yield y
+
+def simulate_trace(mec, fs, fc, nsamples, noise=0.0, state=None,
+    voltage=-0.1, ideal=False, rng=None):
+    """
+    Simulate a digitised single channel current record. See iter_trace()
+    for parameters.
+
+    Returns
+    -------
+    current : ndarray, shape (nsamples,)
+        Sampled current (pA).
+    icurrent : ndarray, shape (nsamples,)
+        Ideal current (pA); only if ideal is True.
+    """
+
+    blocks = list(iter_trace(mec, fs, fc, noise, state, voltage,
+        min(nsamples, 1048576), nsamples, ideal, rng))
+    if ideal:
+        return (np.concatenate([b[0] for b in blocks]),
+            np.concatenate([b[1] for b in blocks]))
+    return np.concatenate(blocks)
+
+def _resolved_blocks(mec, tres, state, opamp, rng, nintmax=None):
+    """
+    Generator of resolved intervals of a simulated record in blocks of
+    varying length; used by simulate_intervals() and iter_intervals().
+
+    Parameters
+    ----------
+    nintmax : int, optional
+        Number of intervals wanted, used to size blocks of transitions.
+        Blocks go on after it is reached.
+
+    Yields
+    ------
+    tints, ampls : ndarrays
+        Lengths and amplitudes of intervals finished in a block.
+    starts : ndarray
+        Index of first sojourn of each interval (number of transitions
+        before it).
+    """
+
+    rng = np.random.default_rng(rng)
+    tables = _chain_tables(mec.Q)
+    tmean = tables[2]
+    amps = np.where(np.arange(mec.k) < mec.kA, opamp, 0)
+
+    # Ideal interval (run of sojourns of equal amplitude) not finished at
+    # the end of previous block: length, amplitude and index of its first
+    # sojourn (index of a sojourn = number of transitions before it).
+    trun, arun, srun = tmean[state] * rng.standard_exponential(), amps[state], 0
+    # Resolved interval being built.
+    tcur, acur, scur = None, None, None
+    nint, first = 0, 1 # first: index of block's first sojourn
+
+    while True:
+        # Number of transitions: estimated from transitions per interval so
+        # far if number of intervals is limited.
+        if nintmax is None or nint >= nintmax:
+            n = 1048576
         else:
-            if ((a != 0 and ampls[-1] != 0) or (a == 0 and ampls[-1] == 0)):
-                tints[-1] += t
-            else:
-                tints.append(t)
-                ampls.append(a)
-                nint += 1
-        inst = newst
-    
-    return np.array(tints), np.array(ampls), np.zeros((len(tints)), dtype='b'), ntrns
-
-def next_state(present, picum, tmean, kA, opamp):
-    """
-    Get next state, its lifetime and amplitude.
-    """
-    possible = np.nonzero(picum[present] >= random.random())[0]
-    next = np.delete(possible, np.where(possible == present))[0]
-    t = random.expovariate(1 / tmean[next])
-    a = opamp if next < kA else 0
-    return next, t, a
+            n = int(1.2 * (nintmax - nint) * max(first / max(nint, 1), 4))
+            n = min(max(n, 1024), 1048576)
+
+        states, t = _sojourns(tables, state, n, rng)
+        state = states[-1]
+
+        # Ideal intervals; the last one may go on in the next block.
+        t = np.append(trun, t)
+        a = np.append(arun, amps[states])
+        rs = np.flatnonzero(np.append(True, a[1:] != a[:-1]))
+        ti, ai = np.add.reduceat(t, rs), a[rs]
+        si = first + rs - 1
+        si[0] = srun
+        trun, arun, srun = ti[-1], ai[-1], si[-1]
+        ti, ai, si = ti[:-1], ai[:-1], si[:-1]
+        first += n
+        if tcur is None:
+            if ti.shape[0] == 0:
+                continue
+            tcur, acur, scur = ti[0], ai[0], si[0]
+            ti, ai, si = ti[1:], ai[1:], si[1:]
+
+        # Impose resolution: unresolved intervals are added to the preceding
+        # one; a new interval starts at a resolved ideal interval whose
+        # amplitude differs from that of the previous resolved one.
+        resolved = np.flatnonzero(ti >= tres)
+        ar = ai[resolved]
+        new = resolved[ar != np.append(acur, ar[:-1])]
+        if new.shape[0] == 0:
+            tcur += ti.sum()
+            continue
+        tcur += ti[:new[0]].sum()
+        sums = np.add.reduceat(ti, new)
+        yield (np.append(tcur, sums[:-1]), np.append(acur, ai[new[:-1]]),
+            np.append(scur, si[new[:-1]]))
+        tcur, acur, scur = sums[-1], ai[new[-1]], si[new[-1]]
+        nint += new.shape[0]
+
+def simulate_ensemble(mec, tres, nrec, nintmax=5000, state=None, opamp=5,
+    seed=None, nproc=None):
+    """
+    Simulate a number of independent single channel records (see
+    simulate_intervals()).
+
+    Each record gets its own random stream spawned from one
+    numpy.random.SeedSequence, so that the records depend only on seed and
+    not on the number of processes or on how records are shared between
+    them.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism with rates and concentration already set.
+    tres : float
+        Time resolution (dead time).
+    nrec : int
+        Number of records.
+    nintmax : int
+        Number of intervals in each record.
+    state : int, optional
+        Initial state. By default it is drawn for each record from
+        equilibrium occupancies.
+    opamp : float
+        Amplitude of openings.
+    seed : int or numpy.random.SeedSequence, optional
+        Seed of the ensemble.
+    nproc : int, optional
+        Number of worker processes. Default: number of CPUs. With one
+        process records are simulated in the calling process.
+
+    Returns
+    -------
+    intervals : ndarray, shape (nrec * nintmax,)
+        Interval lengths in seconds, record after record.
+    amplitudes : ndarray, shape (nrec * nintmax,)
+        Interval amplitudes.
+    offsets : ndarray, shape (nrec + 1,)
+        Record i occupies intervals[offsets[i] : offsets[i+1]].
+    """
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(nrec)
+    nproc = nproc if nproc else os.cpu_count()
+    args = (mec, tres, nintmax, state, opamp)
+
+    if nproc == 1 or nrec < 2:
+        records = _simulate_records(seeds, *args)
+    else:
+        # A few chunks per process to even out the load.
+        bounds = np.linspace(0, nrec, min(4 * nproc, nrec) + 1).astype(int)
+        with ProcessPoolExecutor(nproc) as pool:
+            futures = [pool.submit(_simulate_records, seeds[b0 : b1], *args)
+                for b0, b1 in zip(bounds[:-1], bounds[1:])]
+            records = [record for future in futures
+                for record in future.result()]
+
+    offsets = np.arange(nrec + 1, dtype=np.intp) * nintmax
+    if nrec == 0:
+        return np.zeros(0), np.zeros(0), offsets
+    intervals = np.concatenate([record[0] for record in records])
+    amplitudes = np.concatenate([record[1] for record in records])
+    return intervals, amplitudes, offsets
+
+def simulate_jump_sweeps(mec, reclen, step, cfunc, cargs, nsweeps,
+    seed=None, nproc=1, chunksize=500):
+    """
+    Simulate single channel responses to a concentration profile (e.g.
+    cjumps.pulse_square()). As in cjumps.calc_jump(), concentration is
+    sampled every step and held constant between samples at its value at
+    the end of each step, so that Q changes only at sample times. Sweeps
+    are simulated in chunks of chunksize sweeps held in one state array;
+    chunks can be spread over a process pool. First latencies and open
+    times (ideal, no resolution imposed) are collected as the sweeps go.
+
+    Each chunk gets its own random stream spawned from one
+    numpy.random.SeedSequence, so that results depend only on seed and
+    chunksize and not on the number of processes. Concentration of mec is
+    left unchanged.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be simulated.
+    reclen : float
+        Sweep length.
+    step : float
+        Sampling time interval.
+    cfunc : function
+        Concentration profile.
+    cargs : tuple
+        Arguments for cfunc(t, cargs); cargs[1] is background
+        concentration, at which channels start at equilibrium.
+    nsweeps : int
+        Number of sweeps.
+    seed : int or numpy.random.SeedSequence, optional
+        Seed of the simulation.
+    nproc : int, optional
+        Number of worker processes. Default: 1, chunks are simulated in the
+        calling process. None uses all CPUs.
+    chunksize : int
+        Number of sweeps simulated together.
+
+    Returns
+    -------
+    t : ndarray
+        Time samples.
+    Popen : ndarray
+        Fraction of sweeps open at each sample time (compare with
+        cjumps.calc_jump()).
+    latency : ndarray, shape (nsweeps,)
+        First latency (time of first opening) of each sweep; nan if the
+        channel did not open or was open at t = 0.
+    opentimes : ndarray
+        Lengths of open periods which began and ended within sweeps.
+    """
+
+    t = np.arange(0, reclen, step)
+    c = cfunc(t, cargs)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    nproc = nproc if nproc else os.cpu_count()
+    bounds = np.append(np.arange(0, nsweeps, chunksize), nsweeps)
+    seeds = seed.spawn(bounds.shape[0] - 1)
+    args = [(mec, t, c, cargs[1], b1 - b0, sd)
+        for b0, b1, sd in zip(bounds[:-1], bounds[1:], seeds)]
+    if nproc == 1 or len(args) < 2:
+        # Worker processes get copies of mec; so does the serial path.
+        mec = copy.deepcopy(mec)
+        results = [_jump_sweeps(mec, *arg[1:]) for arg in args]
+    else:
+        with ProcessPoolExecutor(nproc) as pool:
+            futures = [pool.submit(_jump_sweeps, *arg) for arg in args]
+            results = [future.result() for future in futures]
+
+    nopen = np.sum([res[0] for res in results], axis=0)
+    latency = np.concatenate([res[1] for res in results])
+    opentimes = np.concatenate([res[2] for res in results])
+    return t, nopen / float(nsweeps), latency, opentimes
+
+def _jump_sweeps(mec, t, c, cb, nsweeps, seed):
+    """
+    Simulate nsweeps sweeps (see simulate_jump_sweeps()).
+
+    Returns
+    -------
+    nopen : ndarray
+        Number of sweeps open at each sample time.
+    latency : ndarray, shape (nsweeps,)
+    opentimes : ndarray
+    """
+
+    rng = np.random.default_rng(seed)
+    # Exit rates and cummulative transition probabilities for each
+    # concentration level.
+    levels, index = np.unique(c, return_inverse=True)
+    exits, cums = [], []
+    for conc in levels:
+        mec.set_eff('c', conc)
+        exits.append(-mec.Q.diagonal().copy())
+        # Rows of absorbing states (no exit) are never used.
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cums.append(np.cumsum(transition_probability(mec.Q), axis=1))
+    mec.set_eff('c', cb)
+    pinf = np.maximum(qml.pinf(mec.Q), 0)
+    state = rng.choice(mec.k, size=nsweeps, p=pinf / pinf.sum())
+
+    nopen = np.zeros(t.shape[0], dtype=np.intp)
+    nopen[0] = (state < mec.kA).sum()
+    latency = np.full(nsweeps, np.nan)
+    latency[state < mec.kA] = -np.inf # open at t = 0
+    opened = np.full(nsweeps, np.nan) # start of present opening
+    opentimes = []
+    for i in range(1, t.shape[0]):
+        exit, cum = exits[index[i]], cums[index[i]]
+        step = t[i] - t[i-1]
+        tt = np.zeros(nsweeps) # time within step
+        active = np.arange(nsweeps)
+        while active.shape[0]:
+            s = state[active]
+            with np.errstate(divide='ignore'):
+                tnew = tt[active] + rng.standard_exponential(s.shape[0]) / exit[s]
+            go = tnew < step
+            active, tnew, s = active[go], tnew[go], s[go]
+            if not active.shape[0]:
+                break
+            u = 1.0 - rng.random(s.shape[0])
+            new = (u[:, np.newaxis] > cum[s]).sum(axis=1)
+            now = t[i-1] + tnew
+            opening = (s >= mec.kA) & (new < mec.kA)
+            first = active[opening][np.isnan(latency[active[opening]])]
+            latency[first] = now[opening][np.isnan(latency[active[opening]])]
+            opened[active[opening]] = now[opening]
+            closing = (s < mec.kA) & (new >= mec.kA)
+            opentimes.append(now[closing] - opened[active[closing]])
+            state[active] = new
+            tt[active] = tnew
+        nopen[i] = (state < mec.kA).sum()
+
+    latency[np.isinf(latency)] = np.nan
+    opentimes = np.concatenate(opentimes) if opentimes else np.zeros(0)
+    return nopen, latency, opentimes[~np.isnan(opentimes)]
+
+def _simulate_records(seeds, mec, tres, nintmax, state, opamp):
+    """
+    Simulate one record for each seed (see simulate_ensemble()).
+    """
+
+    if state is None:
+        pinf = qml.pinf(mec.Q)
+        pinf = np.maximum(pinf, 0) / np.maximum(pinf, 0).sum()
+    records = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        start = rng.choice(mec.k, p=pinf) if state is None else state
+        records.append(simulate_intervals(mec, tres, start, opamp, nintmax,
+            rng)[:2])
+    return records
+
+def _chain_tables(Q):
+    """
+    States reachable from each state, cummulative probabilities of going
+    to them and mean lifetimes of states; used by _sojourns().
+    """
+
+    pi = transition_probability(Q)
+    nbrs = [np.flatnonzero(pi[i]) for i in range(Q.shape[0])]
+    picum = [np.cumsum(pi[i, nbrs[i]]) / pi[i, nbrs[i]].sum()
+        for i in range(Q.shape[0])]
+    tmean = -1 / Q.diagonal() # in s
+    return nbrs, picum, tmean
+
+def _sojourns(tables, state, n, rng):
+    """
+    Simulate n transitions starting from state.
+
+    Parameters
+    ----------
+    tables : tuple
+        Output of _chain_tables().
+    state : int
+        Present state.
+    n : int
+        Number of transitions.
+    rng : numpy.random.Generator
+        Random number generator.
+
+    Returns
+    -------
+    states : ndarray, shape (n,)
+        States entered.
+    t : ndarray, shape (n,)
+        Lifetimes of sojourns in them.
+    """
+
+    nbrs, picum, tmean = tables
+    # Next state for each step and each state the chain may be in.
+    u = rng.random(n)
+    dest = np.empty((len(nbrs), n), dtype=np.intp)
+    for i in range(len(nbrs)):
+        index = np.zeros(n, dtype=np.intp)
+        for p in picum[i][:-1]:
+            index += u > p
+        dest[i] = nbrs[i][index]
+    states = _embedded_chain(dest, state)
+    return states, tmean[states] * rng.standard_exponential(n)
+
+def _embedded_chain(dest, state):
+    """
+    Find states visited by the embedded Markov chain.
+
+    The n steps are arranged in B blocks of L (both about sqrt(n)). A pass
+    over the L columns, vectorised across blocks and starting states, gives
+    the state each block ends in for any state it starts in; block start
+    states then follow in B scalar steps and a second pass gives all
+    states. Python level work is thus O(sqrt(n)).
+
+    Parameters
+    ----------
+    dest : ndarray, shape (k, n)
+        dest[i, j] is the state the chain goes to at step j if it is in
+        state i.
+    state : int
+        State before the first step.
+
+    Returns
+    -------
+    states : ndarray, shape (n,)
+        States after each step.
+    """
+
+    k, n = dest.shape
+    L = max(int(math.sqrt(n)), 1)
+    B = -(-n // L)
+    if B * L > n:
+        # Pad with steps that leave the state unchanged.
+        dest = np.concatenate((dest, np.repeat(np.arange(k)[:, np.newaxis],
+            B * L - n, axis=1)), axis=1)
+    cols = np.arange(B) * L
+
+    ends = np.tile(np.arange(k), (B, 1))
+    for l in range(L):
+        ends = dest[ends, cols[:, np.newaxis] + l]
+    starts = np.empty(B, dtype=np.intp)
+    for b in range(B):
+        starts[b] = state
+        state = ends[b, state]
+
+    states = np.empty((B, L), dtype=np.intp)
+    for l in range(L):
+        starts = dest[starts, cols + l]
+        states[:, l] = starts
+    return states.reshape(-1)[:n]
 
 def transition_probability(Q):
     """
@@ -58,4 +648,4 @@ def transition_probability(Q):
     for i in range(k):
         pi[i] = pi[i] / -Q[i,i]
         pi[i,i] = 0
-    return pi
\ No newline at end of file
+    return pi
@@ -3,17 +3,25 @@ from scalcs.samples import samples
 from scalcs import popen
 from scalcs import pdfs
 from scalcs import scburst
+from scalcs import scsim
 from scalcs import cjumps
 from scalcs import scalcslib as scl
 from scalcs import scplotlib as scpl
 from scalcs import qmatlib as qml
+from scalcs import fit
+from scalcs import mechanism
+from scalcs import scalcsio
+from scalcs import dataset
 #from dcpyps import dcio
 #from dcpyps import dataset
 
+import os
 import sys
 import time
+import tempfile
 import unittest
 import numpy as np
+import scipy.optimize as so
 
 class TestDC_PyPs(unittest.TestCase):
 
@@ -115,6 +123,14 @@ class TestDC_PyPs(unittest.TestCase):
         self.assertAlmostEqual(gamma11[3], -39.7437, 3)
         self.assertAlmostEqual(gamma11[4], -1.9832288e+06, 0)
 
+        # Exact pdf over a time grid equals point by point evaluation.
+        t = np.array([0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 10.0]) * self.tres
+        f = scl.exact_pdf(t, self.tres, roots, areas,
+            eigvals, gamma00, gamma10, gamma11)
+        for i in range(t.shape[0]):
+            self.assertAlmostEqual(f[i], float(scl.exact_pdf(t[i], self.tres,
+                roots, areas, eigvals, gamma00, gamma10, gamma11)), 8)
+
     def test_cjumps(self):
 
         start = time.time()
@@ -147,6 +163,116 @@ class TestDC_PyPs(unittest.TestCase):
         maxP2 = max(Popen)
         self.assertAlmostEqual(maxP1, maxP2, 3)
 
+        cargs = (0.0001, 0.0, 0.001, 0.002)
+        t, c, Popen, P = cjumps.calc_jump(self.mec, 0.005, 0.00005,
+            cjumps.pulse_square, cargs)
+        # Mechanism is left at the final (background) concentration.
+        Qend = self.mec.Q.copy()
+        self.mec.set_eff('c', c[-1])
+        self.assertTrue(np.array_equal(Qend, self.mec.Q))
+        self.mec.set_eff('c', 0.0)
+        pi = qml.pinf(self.mec.Q)
+        for i in range(1, t.shape[0]):
+            self.mec.set_eff('c', c[i])
+            pi = np.dot(pi, qml.expQt(self.mec.Q, 0.00005))
+        self.assertTrue(np.allclose(P[:, -1], pi, atol=1e-12))
+        Popen1 = cjumps.calc_jump(self.mec, 0.005, 0.00005,
+            cjumps.pulse_erf, (0.0001, 0.0, 0.002, 0.002, 0.0002, 0.0002),
+            cstep=1e-7)[2]
+        Popen2 = cjumps.calc_jump(self.mec, 0.005, 0.00005,
+            cjumps.pulse_erf, (0.0001, 0.0, 0.002, 0.002, 0.0002, 0.0002))[2]
+        self.assertTrue(np.allclose(Popen1, Popen2, atol=1e-3))
+
+        Q0, Q1 = self.mec.Q_linear('c')
+        self.mec.set_eff('c', 3e-6)
+        self.assertTrue(np.allclose(Q0 + 3e-6 * Q1, self.mec.Q))
+        # A short pulse in a long flat record is not stepped over.
+        cargs = (0.001, 0.0, 0.02, 0.0002)
+        Popen1 = cjumps.solve_jump(self.mec, 0.05, 0.000005,
+            cjumps.pulse_square, cargs)[2]
+        Popen2 = cjumps.calc_jump(self.mec, 0.05, 0.000005,
+            cjumps.pulse_square, cargs)[2]
+        self.assertAlmostEqual(max(Popen1), max(Popen2), 4)
+
+    def test_solve_jump_nonlinear(self):
+
+        # Binding rates saturating in concentration are not linear in c;
+        # solve_jump() falls back to integration with Q rebuilt by
+        # set_eff().
+        mec = samples.CH82()
+        for rate in mec.Rates:
+            if rate.effectors[0] == 'c':
+                rate.func = lambda rate, effdict: (rate[0] * effdict['c'] /
+                    (1 + effdict['c'] / 1e-5))
+        self.assertRaises(RuntimeError, mec.Q_linear, 'c')
+        cargs = (0.0001, 0.0, 0.0001, 0.002)
+        Popen1 = cjumps.solve_jump(mec, 0.005, 0.000005,
+            cjumps.pulse_square, cargs)[2]
+        Popen2 = cjumps.calc_jump(mec, 0.005, 0.000005,
+            cjumps.pulse_square, cargs)[2]
+        self.assertTrue(max(Popen1) > 0.1)
+        self.assertAlmostEqual(max(Popen1), max(Popen2), 3)
+
+    def test_Q_stack(self):
+
+        conc = np.array([0.0, 1e-7, 1e-4])
+        Q = self.mec.Q_stack(conc)
+        self.assertTrue(self.mec._linear is not None)
+        # Custom rate functions switch the compiled fast path off.
+        mec = samples.CH82()
+        rate = [r for r in mec.Rates if r.effectors[0] == 'c'][0]
+        rate.func = lambda rate, effdict: rate[0] * effdict['c']
+        mec.set_eff('c', conc[1])
+        self.assertTrue(mec._linear is None)
+        for i in range(len(conc)):
+            self.mec.set_eff('c', conc[i])
+            mec.set_eff('c', conc[i])
+            self.assertTrue(np.allclose(Q[i], self.mec.Q, rtol=1e-14))
+            self.assertTrue(np.allclose(mec.Q, self.mec.Q, rtol=1e-14))
+        Q0, Q1 = mec.Q_linear('c')
+        self.assertTrue(np.allclose(Q0 + conc[2] * Q1, Q[2]))
+        self.assertTrue(np.allclose(mec.Q_stack(conc), Q))
+        # Replacing a rate function takes effect on the next Q update.
+        rate.func = lambda rate, effdict: 2 * rate[0] * effdict['c']
+        mec.set_eff('c', conc[1])
+        i, j = rate.State1.no, rate.State2.no
+        self.assertAlmostEqual(mec.Q[i, j], 2 * rate.rateconstants[0] *
+            conc[1], 10)
+        self.assertAlmostEqual(mec.Q[i].sum(), 0.0, 10)
+
+    def test_theta_map(self):
+
+        self.mec.set_mr(True, 7, 0)
+        self.mec.Rates[5].is_constrained = True
+        self.mec.Rates[5].constrain_func = mechanism.constrain_rate_multiple
+        self.mec.Rates[5].constrain_args = [4, 2]
+        self.mec.update_constrains()
+        theta = self.mec.theta() * np.exp(0.3 * np.arange(7) / 7)
+        self.mec.theta_unsqueeze(theta)
+        self.assertTrue(self.mec._theta_map is not False)
+        rates = self.mec.unit_rates()
+        self.assertTrue(np.allclose(self.mec.theta(), theta, rtol=1e-14))
+        self.assertAlmostEqual(rates[5], 2 * rates[4], 8)
+        # Rate by rate update gives the same rates.
+        self.mec._theta_map = False
+        self.mec.theta_unsqueeze(theta)
+        self.assertTrue(np.allclose(self.mec.unit_rates(), rates,
+            rtol=1e-13))
+        fprod, bprod = self.mec.check_mr(self.mec.Cycles[0])
+        self.assertAlmostEqual(fprod / bprod, 1.0, 12)
+
+        # Flags and constraint arguments edited directly (as in the GUI)
+        # rebuild the map.
+        self.mec.Rates[5].constrain_args = [4, 3]
+        self.mec.Rates[0].fixed = True
+        theta = self.mec.theta()
+        self.assertEqual(len(theta), 6)
+        self.assertEqual(len(self.mec.get_free_parameter_names()), 6)
+        self.mec.theta_unsqueeze(theta)
+        self.assertTrue(self.mec._theta_map is not False)
+        rates = self.mec.unit_rates()
+        self.assertAlmostEqual(rates[5], 3 * rates[4], 8)
+
 #    def test_likelihood(self):
 #
 #        GAF, GFA = qml.iGs(self.mec.Q, self.mec.kA, self.mec.kF)
@@ -240,6 +366,440 @@ class TestDC_PyPs(unittest.TestCase):
 #        print ('lik=', lik)
 #        self.assertAlmostEqual(-lik, 5265.9536156, 5)
 
+    def test_HJClik_batched(self):
+
+        rng = np.random.RandomState(7)
+        bursts = []
+        for i in range(200):
+            n = 2 * rng.randint(0, 5) + 1
+            bursts.append(list(self.tres + rng.exponential(0.001, n)))
+        opts = {'mec': self.mec, 'conc': self.conc, 'tres': self.tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': bursts}
+        theta = np.log(self.mec.theta())
+        lik1, rates1 = scl.HJClik(theta, opts)
+        lik2, rates2 = scl.HJClik_batched(theta, opts)
+        self.assertAlmostEqual(lik1 / lik2, 1.0, 8)
+        opts['data'] = scl.pack_bursts(bursts)
+        lik3, rates3 = scl.HJClik_batched(theta, opts)
+        self.assertAlmostEqual(lik2, lik3, 8)
+
+        # Prepared likelihood gives the same values for repeated calls.
+        HJCl = scl.HJCLikelihood(self.mec, self.tres, self.tcrit, self.conc,
+            bursts, isCHS=True)
+        lik4, rates4 = HJCl(theta + 0.1)
+        lik5, rates5 = HJCl(theta)
+        self.assertAlmostEqual(lik2, lik5, 8)
+        self.assertNotAlmostEqual(lik4, lik5, 2)
+        self.assertEqual(HJCl.nevals, 2)
+
+        # Two patches at different concentrations evaluated in a pool.
+        HJCl2 = scl.HJCLikelihood(self.mec, self.tres, self.tcrit,
+            self.conc * 10, bursts[:50], isCHS=True)
+        with scl.HJCLikelihoodPool([HJCl, HJCl2], nproc=2) as pool:
+            lik6, rates6 = pool(theta)
+        self.assertAlmostEqual(lik6 / (HJCl(theta)[0] + HJCl2(theta)[0]),
+            1.0, 10)
+
+    def test_likelihood_scaling(self):
+
+        # Long bursts overflow without scaling.
+        rng = np.random.RandomState(3)
+        bursts = {}
+        for i in range(5):
+            bursts[i] = list(self.tres + rng.exponential(0.0005, 81))
+        opts = {'mec': self.mec, 'conc': self.conc, 'tres': self.tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': bursts}
+        theta = np.log(self.mec.theta())
+        lik0, r = scl.HJClik_batched(theta, opts)
+        lik1, r = scl.HJClik(theta, opts)
+        opts['normstep'] = 1
+        lik2, r = scl.HJClik(theta, opts)
+        opts['normstep'] = 7
+        lik3, r = scl.HJClik(theta, opts)
+        self.assertAlmostEqual(lik1 / lik0, 1.0, 10)
+        self.assertAlmostEqual(lik2 / lik0, 1.0, 10)
+        self.assertAlmostEqual(lik3 / lik0, 1.0, 10)
+
+        lik4, r = scl.likelihood(theta, opts)
+        del opts['normstep']
+        lik5, r = scl.likelihood(theta, opts)
+        self.assertAlmostEqual(lik4 / lik5, 1.0, 10)
+
+    def test_likelihood_ideal(self):
+
+        rng = np.random.RandomState(5)
+        bursts = {}
+        for i in range(20):
+            n = 2 * rng.randint(0, 6) + 1
+            bursts[i] = list(rng.exponential(0.001, n))
+        opts = {'mec': self.mec, 'conc': self.conc, 'data': bursts}
+        theta = np.log(self.mec.theta())
+        lik1, r = scl.likelihood(theta, opts)
+        lik0 = 0
+        for ind in bursts:
+            grouplik = qml.phiA(self.mec)
+            for i, t in enumerate(bursts[ind]):
+                if i % 2 == 0:
+                    G = qml.iGt(t, self.mec.QAA, self.mec.QAF)
+                else:
+                    G = qml.iGt(t, self.mec.QFF, self.mec.QFA)
+                grouplik = np.dot(grouplik, G)
+            lik0 += np.log(np.sum(grouplik))
+        self.assertAlmostEqual(-lik1 / lik0, 1.0, 10)
+        opts['data'] = scl.pack_bursts(bursts)
+        lik2, r = scl.likelihood(theta, opts)
+        self.assertAlmostEqual(lik1, lik2, 8)
+
+    def test_HJClik_gradient(self):
+
+        rng = np.random.RandomState(7)
+        bursts = []
+        for i in range(100):
+            n = 2 * rng.randint(0, 5) + 1
+            bursts.append(list(self.tres + rng.exponential(0.0003, n)))
+        theta = np.log(self.mec.theta()) + 0.05 * rng.randn(8)
+        HJCl = scl.HJCLikelihood(self.mec, self.tres, self.tcrit, self.conc,
+            bursts, isCHS=True)
+        loglik, grad = HJCl.loglik_fd_gradient(theta)
+        self.assertAlmostEqual(loglik / -HJCl(theta)[0], 1.0, 10)
+        for p in range(theta.shape[0]):
+            dtheta = np.zeros(theta.shape)
+            dtheta[p] = 1e-5
+            fd = (HJCl(theta - dtheta)[0] - HJCl(theta + dtheta)[0]) / 2e-5
+            self.assertAlmostEqual(grad[p], fd, 5)
+        # Forward differences of scipy (step 1e-6) agree to 1e-3 with
+        # gradient components of up to a few hundred.
+        fd = so.approx_fprime(theta, lambda th: -HJCl(th)[0], 1e-6)
+        np.testing.assert_allclose(grad, fd, rtol=0, atol=1e-3)
+        self.assertTrue(scl.eigenvalues_separated([0.0, 2.0, 1.0]))
+        self.assertFalse(scl.eigenvalues_separated([0.0, 1.0, 1.0 + 1e-6]))
+        self.assertFalse(scl.eigenvalues_separated([0.0, 1.0 + 1j, 1.0 - 1j]))
+
+    def test_HJClik_population(self):
+
+        rng = np.random.RandomState(11)
+        bursts = []
+        for i in range(100):
+            n = 2 * rng.randint(0, 5) + 1
+            bursts.append(list(self.tres + rng.exponential(0.0005, n)))
+        theta0 = np.log(self.mec.theta())
+        thetas = theta0 + 0.1 * rng.randn(6, theta0.shape[0])
+        HJCl = scl.HJCLikelihood(self.mec, self.tres, self.tcrit, self.conc,
+            bursts, isCHS=True)
+        logliks = HJCl.loglik_population(thetas)
+        self.assertEqual(logliks.shape, (6,))
+        np.testing.assert_allclose(self.mec.theta(), np.exp(theta0))
+        for i in range(thetas.shape[0]):
+            self.assertAlmostEqual(logliks[i] / -HJCl(thetas[i])[0], 1.0, 10)
+
+    def test_asymptotic_roots(self):
+
+        args = (self.tres, self.mec.QFF, self.mec.QAA, self.mec.QFA,
+            self.mec.QAF, self.mec.kF, self.mec.kA)
+        sro = scl.bisect_intervals(-1000000, -0.0000001, *args)
+        ref = np.sort([so.brentq(qml.detW, sro[i, 0], sro[i, 1], args=args,
+            xtol=1e-20, rtol=1e-15) for i in range(self.mec.kF)])
+        roots, nprobes, warm = scl.asymptotic_roots_newton(*args)
+        self.assertFalse(warm)
+        self.assertTrue(np.allclose(roots, ref, rtol=1e-13, atol=0))
+        roots1, nprobes1, warm = scl.asymptotic_roots_newton(*args,
+            guess=ref * 1.01)
+        self.assertTrue(warm and nprobes1 < nprobes)
+        self.assertTrue(np.allclose(roots1, ref, rtol=1e-13, atol=0))
+        # A guess that converges twice to the same root is rejected.
+        roots2, nprobes2, warm = scl.asymptotic_roots_newton(*args,
+            guess=[ref[0], ref[0], ref[2]])
+        self.assertFalse(warm)
+        self.assertTrue(np.allclose(roots2, ref, rtol=1e-13, atol=0))
+
+    def test_scn_read(self):
+
+        rng = np.random.RandomState(2)
+        tmpdir = tempfile.mkdtemp()
+        fnames, data = [], []
+        for k in range(3):
+            n = 10 + k
+            tint = rng.exponential(1.0, n).astype(np.float32)
+            iampl = rng.randint(0, 300, n)
+            iprops = np.zeros(n, dtype=np.int8)
+            iprops[-1] = 8
+            fname = os.path.join(tmpdir, 'patch{0:d}.scn'.format(k))
+            scalcsio.scn_write(fname, tint, iampl, iprops,
+                calfac2=0.1 * (k + 1), title='patch')
+            fnames.append(fname)
+            data.append((tint, iampl * np.float32(0.1 * (k + 1)), iprops))
+
+        rec = scalcsio.SCNRecord(fnames[0])
+        self.assertEqual(len(rec), 10)
+        self.assertEqual(rec.header['title'], 'patch')
+        self.assertTrue(isinstance(rec.intervals, np.memmap))
+        np.testing.assert_array_equal(rec.intervals, data[0][0])
+        np.testing.assert_array_equal(rec.props, data[0][2])
+
+        ds = scalcsio.SCNDataset(fnames)
+        self.assertEqual(len(ds), 33)
+        self.assertTrue(isinstance(ds.intervals(12, 15), np.memmap))
+        np.testing.assert_array_equal(ds.intervals(),
+            np.concatenate([d[0] for d in data]))
+        np.testing.assert_allclose(ds.amplitudes(8, 25),
+            np.concatenate([d[1] for d in data])[8:25], rtol=1e-6)
+        np.testing.assert_array_equal(ds.props(5, 30),
+            np.concatenate([d[2] for d in data])[5:30])
+        # Empty ranges keep the types of non-empty ones.
+        for start in (20, 40):
+            self.assertEqual(ds.intervals(start, 20).dtype, np.float32)
+            self.assertEqual(ds.amplitudes(start, 20).dtype, np.float32)
+            self.assertEqual(ds.props(start, 20).dtype, np.int8)
+
+    def test_prepare_bursts(self):
+
+        # Unresolved intervals (< 0.1) join the preceding resolved one;
+        # record starts at first resolved usable interval.
+        tint = [0.05, 1.0, 0.5, 0.05, 0.3, 5.0, 1.0, 0.2, 0.04, 0.8, 0.3,
+            2.0, 0.6, 0.1, 0.7, 0.4, 0.9]
+        ampl = [0, 4, 0, 2, 2, 0, 2, 0, 0, 2, 0, 0, 6, 0, 2, 0, 0]
+        props = [0] * 17
+        props[14] = 8
+        pint, pampl, pbad = dataset.impose_resolution(tint, ampl, props, 0.1)
+        np.testing.assert_allclose(pint, [1.0, 0.55, 0.3, 5.0, 1.0, 0.24,
+            0.8, 2.3, 0.6, 0.1, 0.7, 1.3])
+        self.assertAlmostEqual(pampl[2], 2.0)
+        self.assertAlmostEqual(pampl[7], 0.0)
+        np.testing.assert_array_equal(np.flatnonzero(pbad), [10, 11])
+
+        intervals, offsets = dataset.burst_segments(pint, pampl, pbad, 2.0)
+        np.testing.assert_allclose(intervals, [1.0, 0.55, 0.3, 1.0, 0.24,
+            0.8])
+        np.testing.assert_array_equal(offsets, [0, 3, 6])
+        intervals2, offsets2 = dataset.prepare_bursts(tint, ampl, props, 0.1,
+            2.0)
+        np.testing.assert_array_equal(intervals, intervals2)
+
+        # Packed bursts go directly to the likelihood.
+        intervals = self.tres + intervals * 1e-3
+        HJCl = scl.HJCLikelihood(self.mec, self.tres, self.tcrit, self.conc,
+            (intervals, offsets), isCHS=True)
+        bursts = [list(intervals[offsets[i]:offsets[i + 1]])
+            for i in range(offsets.shape[0] - 1)]
+        HJCl2 = scl.HJCLikelihood(self.mec, self.tres, self.tcrit, self.conc,
+            bursts, isCHS=True)
+        theta = np.log(self.mec.theta())
+        self.assertAlmostEqual(HJCl(theta)[0], HJCl2(theta)[0], 10)
+
+    def test_dwell_histograms(self):
+
+        tints, ampls = scl.simulate_intervals(self.mec, self.tres, 0,
+            nintmax=5000, rng=np.random.default_rng(3))[:2]
+        hist1 = scpl.DwellHistograms(self.tres, self.tcrit)
+        hist1.add(tints, ampls)
+        hist1.flush()
+        hist2 = scpl.DwellHistograms(self.tres, self.tcrit)
+        for i in range(0, 5000, 333):
+            hist2.add(tints[i:i + 333], ampls[i:i + 333])
+        hist2.flush()
+        np.testing.assert_array_equal(hist1.burst.counts, hist2.burst.counts)
+        np.testing.assert_array_equal(hist1.openings, hist2.openings)
+        np.testing.assert_array_equal(hist1.shut.counts,
+            np.histogram(tints[ampls == 0], hist1.shut.edges)[0])
+        self.assertEqual(hist1.open.n + hist1.shut.n + hist1.open.below +
+            hist1.shut.below, 5000)
+        self.assertEqual(hist1.burst.n + hist1.burst.below,
+            hist1.openings.sum())
+
+        # Scaled exact open time pdf follows the histogram.
+        t, ipdf, epdf, apdf = scpl.open_time_pdf(self.mec, self.tres)
+        spdf = scpl.scaled_pdf(t, epdf, hist1.open.dt, hist1.open.n)
+        edges = hist1.open.edges * 1000
+        centres = np.sqrt(edges[:-1] * edges[1:])
+        expected = np.interp(centres, t, spdf)
+        peak = np.argmax(hist1.open.counts)
+        self.assertAlmostEqual(hist1.open.counts[peak] / expected[peak],
+            1.0, 0)
+
+        # Unresolved values are neither binned nor counted.
+        opens = np.append(tints[ampls > 0], [0.5 * self.tres] * 50)
+        x, y, dx, n = scpl.prepare_hist(opens, self.tres)
+        self.assertEqual(n, hist1.open.n)
+        self.assertAlmostEqual(dx, 10 ** 0.1, 12)
+
+    def test_simulate_intervals(self):
+
+        tints, ampls, flags, ntrns = scsim.simulate_intervals(self.mec,
+            self.tres, 4, nintmax=20000, rng=np.random.default_rng(11))
+        self.assertEqual(tints.shape, (20000, ))
+        self.assertTrue(np.all(ampls[1:] != ampls[:-1]))
+        self.assertTrue(tints.min() >= self.tres)
+        self.assertTrue(np.array_equal(tints, scsim.simulate_intervals(
+            self.mec, self.tres, 4, nintmax=20000, rng=11)[0]))
+        # Mean apparent open time against HJC open time pdf.
+        roots = scl.asymptotic_roots(self.tres, self.mec.QAA, self.mec.QFF,
+            self.mec.QAF, self.mec.QFA, self.mec.kA, self.mec.kF)
+        GAF, GFA = qml.iGs(self.mec.Q, self.mec.kA, self.mec.kF)
+        areas = scl.asymptotic_areas(self.tres, roots, self.mec.QAA,
+            self.mec.QFF, self.mec.QAF, self.mec.QFA, self.mec.kA,
+            self.mec.kF, GAF, GFA)
+        eigvals, gamma00, gamma10, gamma11 = scl.exact_GAMAxx(self.mec,
+            self.tres, True)
+        t = np.linspace(self.tres, 0.1, 100001)
+        f = scl.exact_pdf(t, self.tres, roots, areas, eigvals, gamma00,
+            gamma10, gamma11)
+        mean = np.sum(t * f) * (t[1] - t[0])
+        self.assertAlmostEqual(tints[ampls > 0].mean() / mean, 1.0, 1)
+
+    def test_embedded_chain(self):
+
+        rng = np.random.default_rng(5)
+        dest = rng.integers(0, 4, size=(4, 1001))
+        states, state = [], 2
+        for j in range(1001):
+            state = dest[state, j]
+            states.append(state)
+        self.assertTrue(np.array_equal(scsim._embedded_chain(dest, 2),
+            states))
+
+        # Sojourns: only allowed transitions, mean lifetimes of states and
+        # transition frequencies as given by Q.
+        Q = self.mec.Q
+        states, t = scsim._sojourns(scsim._chain_tables(Q), 4, 100000,
+            np.random.default_rng(6))
+        prev = np.append(4, states[:-1])
+        self.assertTrue(np.all(Q[prev, states] > 0))
+        for i in range(self.mec.k):
+            self.assertAlmostEqual(t[states == i].mean() * -Q[i, i], 1.0, 1)
+        pi = scsim.transition_probability(Q)
+        counts = np.zeros((self.mec.k, self.mec.k))
+        np.add.at(counts, (prev, states), 1)
+        freq = counts / counts.sum(axis=1)[:, np.newaxis]
+        self.assertTrue(np.allclose(freq, pi, atol=0.02))
+
+    def test_simulate_ensemble(self):
+
+        intervals, amplitudes, offsets = scsim.simulate_ensemble(self.mec,
+            self.tres, 5, 1000, seed=7, nproc=1)
+        self.assertTrue(np.array_equal(offsets, np.arange(6) * 1000))
+        records = scsim.simulate_ensemble(self.mec, self.tres, 5, 1000,
+            seed=7, nproc=2)
+        self.assertTrue(np.array_equal(intervals, records[0]) and
+            np.array_equal(amplitudes, records[1]))
+
+    def test_iter_intervals(self):
+
+        blocks = list(scsim.iter_intervals(self.mec, self.tres, 4,
+            blocksize=700, nintmax=5000, rng=3))
+        self.assertEqual([b[0].shape[0] for b in blocks], [700] * 7 + [100])
+        tints, ampls = next(scsim.iter_intervals(self.mec, self.tres, 4,
+            blocksize=5000, nintmax=5000, rng=3))
+        self.assertTrue(np.array_equal(tints,
+            np.concatenate([b[0] for b in blocks])))
+        self.assertTrue(np.all(ampls[1:] != ampls[:-1]))
+
+    def test_simulate_trace(self):
+
+        fs, fc = 100000.0, 5000.0
+        current, icurrent = scsim.simulate_trace(self.mec, fs, fc, 100000,
+            ideal=True, rng=4)
+        self.assertTrue(np.all((icurrent <= 1e-9) & (icurrent >= -6 - 1e-9)))
+        sigma = 0.1325 * fs / fc
+        m = int(np.ceil(4 * sigma))
+        kernel = np.exp(-0.5 * (np.arange(-m, m + 1) / sigma)**2)
+        filtered = np.convolve(icurrent, kernel / kernel.sum(), mode='same')
+        self.assertTrue(np.allclose(filtered[m:-m], current[m:-m]))
+        blocks = list(scsim.iter_trace(self.mec, fs, fc, 0.5,
+            blocksize=30000, nsamples=100000, rng=4))
+        noisy = np.concatenate(blocks)
+        self.assertAlmostEqual(np.std(noisy - current), 0.5, 1)
+
+    def test_simulate_jump_sweeps(self):
+
+        cargs = (1e-3, 0.0, 0.002, 0.001)
+        Q = self.mec.Q.copy()
+        t, Popen, latency, opentimes = scsim.simulate_jump_sweeps(self.mec,
+            0.01, 2e-5, cjumps.pulse_square, cargs, 2000, seed=1)
+        self.assertTrue(np.array_equal(Q, self.mec.Q))
+        Pc = cjumps.calc_jump(self.mec, 0.01, 2e-5, cjumps.pulse_square,
+            cargs)[2]
+        self.assertTrue(np.abs(Popen - Pc).max() < 0.05)
+        self.assertTrue(np.all(latency[~np.isnan(latency)] > 0.002 - 2e-5))
+        self.assertTrue(np.all(opentimes > 0))
+
+        # Same seed gives the same sweeps in any number of processes.
+        res1 = scsim.simulate_jump_sweeps(self.mec, 0.005, 2e-5,
+            cjumps.pulse_square, cargs, 300, seed=2, nproc=1, chunksize=100)
+        res2 = scsim.simulate_jump_sweeps(self.mec, 0.005, 2e-5,
+            cjumps.pulse_square, cargs, 300, seed=2, nproc=2, chunksize=100)
+        for x1, x2 in zip(res1, res2):
+            np.testing.assert_array_equal(x1, x2)
+
+    def test_expQt_stack(self):
+
+        t = np.logspace(-5, -1, 50)
+        expQ = qml.expQt_stack(self.mec.Q, t)
+        self.assertEqual(expQ.shape, (50, self.mec.k, self.mec.k))
+        for i in (0, 25, 49):
+            self.assertTrue(np.allclose(expQ[i], qml.expQt(self.mec.Q, t[i]),
+                rtol=1e-12, atol=1e-15))
+        f = scburst.length_pdf(self.mec, t)
+        self.assertAlmostEqual(f[25], scburst.length_pdf(self.mec, t[25])[0], 8)
+
+    def test_eigs_cache(self):
+
+        eigs0, A0 = qml.eigs(-self.mec.Q)
+        qml.eigs_cache_enable(maxsize=2)
+        try:
+            eigs1, A1 = qml.eigs(-self.mec.Q)
+            eigs2, A2 = qml.eigs_sorted(-self.mec.Q)
+            A1[0] = 0
+            eigs3, A3 = qml.eigs(-self.mec.Q)
+            self.assertTrue(np.allclose(eigs0, eigs3) and np.allclose(A0, A3))
+            self.assertTrue(np.allclose(np.sort(eigs0), eigs2))
+            qml.expQt(self.mec.QAA, self.tres)
+            qml.expQt(self.mec.QFF, self.tres)
+            qml.expQt(self.mec.QAA, 2 * self.tres)
+            info = qml.eigs_cache_info()
+            self.assertEqual((info['hits'], info['misses'], info['size']),
+                (3, 3, 2))
+            qml.eigs_cache_clear()
+            self.assertEqual(qml.eigs_cache_info()['size'], 0)
+        finally:
+            qml.eigs_cache_disable()
+        self.assertFalse(qml.eigs_cache_info()['enabled'])
+
+    def test_fit(self):
+
+        rng = np.random.RandomState(7)
+        bursts = []
+        for i in range(50):
+            n = 2 * rng.randint(0, 5) + 1
+            bursts.append(list(self.tres + rng.exponential(0.0003, n)))
+        HJCl = scl.HJCLikelihood(self.mec, self.tres, self.tcrit, self.conc,
+            bursts, isCHS=True)
+        theta0 = np.log(self.mec.theta())
+        lik0 = -HJCl(theta0)[0]
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'fit.npz')
+
+        res = fit.fit(self.mec, HJCl, method='simplex', maxiter=20,
+            checkpoint=checkpoint, verbose=False)
+        self.assertTrue(res.loglik > lik0)
+        self.assertAlmostEqual(res.loglik, -HJCl(res.theta)[0], 8)
+        self.assertTrue(res.evals_per_sec > 0)
+        theta, loglik = fit.load_checkpoint(checkpoint, self.mec)
+        self.assertAlmostEqual(loglik, res.loglik, 8)
+        mec2 = samples.CH82()
+        mec2.Rates[0].fixed = True
+        with self.assertWarns(RuntimeWarning):
+            self.assertEqual(fit.load_checkpoint(checkpoint, mec2),
+                (None, None))
+
+        # Warm start from the simplex fit with gradient based optimiser.
+        res2 = fit.fit(self.mec, HJCl, method='lbfgs', maxiter=3,
+            warmstart=checkpoint, verbose=False)
+        self.assertTrue(res2.loglik >= res.loglik)
+        opts = {'mec': self.mec, 'conc': self.conc, 'tres': self.tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': bursts}
+        res3 = fit.fit(self.mec, scl.HJClik_batched, opts=opts,
+            theta0=res2.theta, method='trust', maxiter=2, verbose=False)
+        self.assertTrue(res3.loglik >= res2.loglik)
+
     def test_popen(self):
 
         self.mec.fastBlk = False
@@ -248,3 +808,24 @@ class TestDC_PyPs(unittest.TestCase):
         # POPEN CURVE CALCULATIONS
         c, pe, pi = scpl.Popen(self.mec, self.tres)
         self.assertTrue(pi[-1]>0.967 and pi[-1]<0.969)
+
+        # Batched curve agrees with Popen at single concentrations.
+        conc = np.array([1e-8, 1e-6, 1e-4])
+        for tres in (0, self.tres):
+            curve = popen.Popen_curve(self.mec, tres, conc)
+            for i in range(len(conc)):
+                self.assertAlmostEqual(curve[i],
+                    popen.Popen(self.mec, tres, conc[i]), 12)
+
+        # Summary from a single shared curve.
+        curve = popen.PopenCurve(self.mec, 0)
+        self.assertAlmostEqual(curve.maxPopen, 0.96774, 4)
+        self.assertAlmostEqual(curve.EC50 * 1e6, 2.4038, 3)
+        self.assertAlmostEqual(curve.nH, 1.8922, 3)
+        self.assertAlmostEqual(curve.response(curve.calc(
+            np.array([curve.EC50])))[0], 0.5, 8)
+        self.assertFalse(curve.decline)
+        # No half response below the peak: NaN rather than an IndexError.
+        curve.maxPopen = 2 * curve.popen.max()
+        curve._EC50()
+        self.assertTrue(np.isnan(curve.EC50))